@@ -1,6 +1,7 @@
 import asyncio
 from aadb import events
 from aadb.adb import AndroidDebugBridge
+from aadb.pool import ConnectionPool
 from enum import Enum
 
 
@@ -228,18 +229,21 @@ class KeyCode(Enum):
     KEYCODE_BRIGHTNESS_DOWN = 220
     KEYCODE_BRIGHTNESS_UP = 221
     KEYCODE_MEDIA_AUDIO_TRACK = 222
+    KEYCODE_SLEEP = 223
+    KEYCODE_WAKEUP = 224
 
 
 inner_host = ''
 inner_port = ''
 
 
-def create_bridge(host: str = '127.0.0.1', port: int = 5037):
+def create_bridge(host: str = '127.0.0.1', port: int = 5037, pool_size: int = 0, pool_idle_timeout: float = 30.0):
     global inner_port
     global inner_host
     inner_host = host
     inner_port = port
-    return AndroidDebugBridge()
+    # with pool_size 0 nothing is kept warm, the pool only carries the server address to the clients
+    return AndroidDebugBridge(ConnectionPool(host, port, size=pool_size, idle_timeout=pool_idle_timeout))
 
 
 def start(func):
@@ -1,10 +1,12 @@
 from enum import Enum
 from typing import List
 
+from aadb.cache import TTLCache
 from aadb.device import Device
 from aadb.device import Transport
-
-tp = Transport()
+from aadb.fleet import Fleet, FleetResult
+from aadb.pool import ConnectionPool
+from aadb.tracker import DeviceTracker, parse_devices
 
 
 class AndroidDebugBridge(object):
@@ -14,31 +16,72 @@ class AndroidDebugBridge(object):
         DEVICE = "device"
         BOOTLOADER = "bootloader"
 
+    def __init__(self, pool: ConnectionPool = None):
+        self.pool = pool
+        self.tp = Transport(pool=pool)
+        self.cache = TTLCache()
+        self.tracker: DeviceTracker = None
+        self._devices = {}
+
+    def refresh(self, *keys):
+        self.cache.invalidate(*keys)
+
+    async def close(self):
+        await self.untrack()
+        for device in self._devices.values():
+            await device.close()
+        if self.pool is not None:
+            await self.pool.close()
+
+    async def track(self, long: bool = True, timeout: float = None) -> DeviceTracker:
+        # once the first listing is in, devices() answers from the tracker without any I/O
+        if self.tracker is None:
+            self.tracker = DeviceTracker(self.pool, long)
+        await self.tracker.start().wait_ready(timeout)
+        return self.tracker
+
+    async def untrack(self):
+        if self.tracker is not None:
+            tracker, self.tracker = self.tracker, None
+            await tracker.stop()
+
+    def _device(self, serial: str) -> Device:
+        # the same Device object is handed out per serial so its metadata cache survives
+        if serial not in self._devices:
+            self._devices[serial] = Device(serial, self.pool)
+        return self._devices[serial]
+
     async def devices(self, state: DeviceStatus = None) -> List[Device]:
-        device_list = []
+        state = state.value if isinstance(state, self.DeviceStatus) else state
+        if self.tracker is not None and self.tracker.ready.is_set():
+            return [self._device(info.serial) for info in self.tracker.devices(state)]
+
+        table = {}
 
-        @tp.host(command='devices')
+        @self.tp.host(command='devices')
         async def list_devices(parsing_result):
             pass
 
         def parsing_result_f(result):
-            for line in result.split('\n'):
-                if not line:
-                    break
-
-                tokens = line.split()
-                if state and len(tokens) > 1 and tokens[1] != state:
-                    continue
-
-                device_list.append(Device(tokens[0]))
+            table.update(parse_devices(result))
 
         await list_devices(parsing_result=parsing_result_f)
-        return device_list
+        return [self._device(info.serial) for info in table.values() if not state or info.state == state]
+
+    async def fan_out_push(self, src: str, dest: str, devices: List[Device] = None, mode: int = 0o644,
+                           concurrency: int = None, timeout: float = None, progress_func=None) -> List[FleetResult]:
+        # reads src once for all devices, every online device when none are given
+        if devices is None:
+            devices = await self.devices(self.DeviceStatus.DEVICE)
+        return await Fleet(devices, self.pool, concurrency, timeout).push(src, dest, mode, progress_func)
 
     async def features(self):
+        return list(await self.cache.get_or_load('features', self._features))
+
+    async def _features(self):
         feature_list = []
 
-        @tp.host(command='features')
+        @self.tp.host(command='features')
         async def list_features(parsing_result):
             pass
 
@@ -49,9 +92,12 @@ class AndroidDebugBridge(object):
         return feature_list
 
     async def version(self):
+        return await self.cache.get_or_load('version', self._version)
+
+    async def _version(self):
         ver = 0
 
-        @tp.host(command='version')
+        @self.tp.host(command='version')
         async def check_version(parsing_result):
             pass
 
@@ -63,23 +109,29 @@ class AndroidDebugBridge(object):
         return ver
 
     async def kill_server(self):
-        @tp.host(command='kill', no_receive=False)
+        @self.tp.host(command='kill', no_receive=False)
         async def kill_adb_server():
             pass
 
         await kill_adb_server()
 
     async def kill_forward_all(self):
-        @tp.host(command='killforward-all', no_receive=False)
+        @self.tp.host(command='killforward-all', no_receive=False)
         async def kill_adb_server():
             pass
 
         await kill_adb_server()
 
+    async def forward(self, serial: str, local: str, remote: str, norebind: bool = False):
+        return await self._device(serial).forward(local, remote, norebind)
+
+    async def remove_forward(self, serial: str, local: str):
+        await self._device(serial).remove_forward(local)
+
     async def list_forward(self):
         forwards = {}
 
-        @tp.host(command='list-forward')
+        @self.tp.host(command='list-forward')
         async def list_features(parsing_result):
             pass
 
@@ -98,7 +150,7 @@ class AndroidDebugBridge(object):
     async def remote_connect(self, host: str, port: int):
         request_result = False
 
-        @tp.host(command='connect:%s:%d' % (host, port))
+        @self.tp.host(command='connect:%s:%d' % (host, port))
         async def connect_remote(parsing_result):
             pass
 
@@ -116,7 +168,7 @@ class AndroidDebugBridge(object):
         if host and not port:
             cmd = host
 
-        @tp.host(command='disconnect:{}'.format(cmd))
+        @self.tp.host(command='disconnect:{}'.format(cmd))
         async def disconnect_remote(parsing_result):
             pass
 
@@ -0,0 +1,93 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict
+
+DEFAULT_TTLS = {
+    'properties': 10.0,
+    'packages': 30.0,
+    'features': 300.0,
+    'version': 300.0,
+}
+
+
+class TTLCache(object):
+    # least recently used entries are evicted past maxsize, every key can carry its own ttl;
+    # concurrent misses on one key share a single load
+
+    def __init__(self, maxsize: int = 128, ttl: float = 30.0, ttls: Dict[str, float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.key_stats: Dict[str, Dict[str, int]] = {}
+        self._data = OrderedDict()
+        self._loading = {}
+        self._generation = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        entry = self._data.get(key)
+        return entry is not None and entry[0] > time.monotonic()
+
+    def _count(self, key, field: str):
+        setattr(self, field, getattr(self, field) + 1)
+        stats = self.key_stats.setdefault(key, {'hits': 0, 'misses': 0})
+        stats[field] += 1
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._data.move_to_end(key)
+            self._count(key, 'hits')
+            return entry[1]
+        if entry is not None:
+            del self._data[key]
+        self._count(key, 'misses')
+        return default
+
+    def set(self, key, value, ttl: float = None):
+        ttl = self.ttls.get(key, self.ttl) if ttl is None else ttl
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, *keys):
+        # loads already in flight must not write back what they fetched before the invalidation
+        self._generation += 1
+        if not keys:
+            self._data.clear()
+            self._loading.clear()
+        for key in keys:
+            self._data.pop(key, None)
+            self._loading.pop(key, None)
+
+    async def get_or_load(self, key, loader, ttl: float = None):
+        missing = object()
+        value = self.get(key, missing)
+        if value is not missing:
+            return value
+        if key in self._loading:
+            return await asyncio.shield(self._loading[key])
+
+        generation = self._generation
+        future = asyncio.ensure_future(loader())
+        self._loading[key] = future
+        try:
+            value = await asyncio.shield(future)
+        finally:
+            if self._loading.get(key) is future:
+                del self._loading[key]
+        if generation == self._generation:
+            self.set(key, value, ttl)
+        return value
+
+    def stats(self) -> Dict[str, object]:
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'size': len(self._data),
+                'keys': {key: dict(stats) for key, stats in self.key_stats.items()}}
@@ -0,0 +1,280 @@
+import asyncio
+import struct
+import time
+from typing import AsyncIterator, List, NamedTuple, Optional, Tuple
+
+from aadb import events
+from aadb.transport import STREAM_LIMIT, Client
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# framebuffer: header after its version word; v1 and v2 (with a color space) give bit offsets of the
+# channels in red, blue, green, alpha order, v16 is the legacy RGB565 layout
+_FB_V1 = struct.Struct('<12I')
+_FB_V2 = struct.Struct('<13I')
+_FB_V16 = struct.Struct('<3I')
+# `screencap` without -p: width, height, pixel format, then a color space word on newer releases
+_SCREENCAP = struct.Struct('<3I')
+_SCREENCAP_BPP = {1: 4, 2: 4, 3: 3, 4: 2}
+_SCREENCAP_ORDER = {1: 'RGBA', 2: 'RGBX', 3: 'RGB', 4: 'RGB565'}
+
+
+class Source(object):
+    FRAMEBUFFER = 'framebuffer'
+    SCREENCAP = 'screencap'
+
+
+class Roi(NamedTuple):
+    x: int
+    y: int
+    width: int
+    height: int
+
+
+class FrameFormat(NamedTuple):
+    width: int
+    height: int
+    bpp: int
+    # channel order of the pixels as they are in memory, e.g. 'RGBA', 'BGRA', 'RGB565'
+    order: str
+    header: bytes
+
+    @property
+    def channels(self) -> int:
+        return max(self.bpp // 8, 1) if self.bpp != 16 else 1
+
+    @property
+    def size(self) -> int:
+        return self.width * self.height * self.bpp // 8
+
+
+class Frame(NamedTuple):
+    index: int
+    timestamp: float
+    pixels: 'np.ndarray'
+    format: FrameFormat
+
+
+def _need_numpy():
+    if np is None:
+        raise RuntimeError('screen capture needs the numpy package')
+
+
+def _order(red: int, green: int, blue: int, alpha: int, alpha_length: int) -> str:
+    channels = [(red, 'R'), (green, 'G'), (blue, 'B')] + ([(alpha, 'A')] if alpha_length else [])
+    return ''.join(name for _, name in sorted(channels))
+
+
+def parse_framebuffer_header(version: int, data: bytes) -> Tuple[FrameFormat, int]:
+    # (format, header length after the version word)
+    if version == 16:
+        size, width, height = _FB_V16.unpack_from(data)
+        return FrameFormat(width, height, 16, 'RGB565', data[:_FB_V16.size]), _FB_V16.size
+    if version == 1:
+        fields = _FB_V1.unpack_from(data)
+        length = _FB_V1.size
+        bpp, size, width, height = fields[:4]
+    elif version == 2:
+        fields = _FB_V2.unpack_from(data)
+        length = _FB_V2.size
+        bpp, size, width, height = fields[0], fields[2], fields[3], fields[4]
+        fields = fields[:1] + fields[2:]
+    else:
+        raise ConnectionError('unknown framebuffer version {}'.format(version))
+    red, _, blue, _, green, _, alpha, alpha_length = fields[4:12]
+    order = _order(red, green, blue, alpha, alpha_length)
+    if bpp == 32 and len(order) == 3:
+        order += 'X'
+    return FrameFormat(width, height, bpp, order, data[:length]), length
+
+
+class ScreenCapture(object):
+    # raw frames from the framebuffer: service (or `screencap` without -p) read straight into a few
+    # reused buffers and exposed as (height, width, channels) uint8 arrays viewing them, no decoding;
+    # the header is parsed again only when its bytes change (rotation, resolution)
+
+    def __init__(self, serial: str, pool=None, source: str = Source.FRAMEBUFFER, buffers: int = 3):
+        _need_numpy()
+        if source not in (Source.FRAMEBUFFER, Source.SCREENCAP):
+            raise ValueError('unknown capture source {}'.format(source))
+        self.serial = serial
+        self.pool = pool
+        self.source = source
+        self.format: Optional[FrameFormat] = None
+        self.captured = 0
+        self.dropped = 0
+        self._buffers: List[bytearray] = [bytearray() for _ in range(max(buffers, 3))]
+        self._next = 0
+
+    def _buffer(self, size: int, busy=()) -> int:
+        # the next buffer in turn that no consumer holds, grown once for a new format
+        for _ in range(len(self._buffers)):
+            index, self._next = self._next, (self._next + 1) % len(self._buffers)
+            if index not in busy:
+                break
+        if len(self._buffers[index]) != size:
+            self._buffers[index] = bytearray(size)
+        return index
+
+    @staticmethod
+    async def _fill(reader: asyncio.StreamReader, view: memoryview) -> int:
+        filled = 0
+        while filled < len(view):
+            chunk = await reader.read(min(len(view) - filled, STREAM_LIMIT))
+            if not chunk:
+                break
+            view[filled:filled + len(chunk)] = chunk
+            filled += len(chunk)
+        return filled
+
+    def _array(self, buffer: bytearray, offset: int) -> 'np.ndarray':
+        fmt = self.format
+        if fmt.order == 'RGB565':
+            return np.frombuffer(buffer, np.uint16, fmt.width * fmt.height, offset).reshape(fmt.height, fmt.width)
+        return np.frombuffer(buffer, np.uint8, fmt.size, offset).reshape(fmt.height, fmt.width, fmt.channels)
+
+    async def grab(self) -> 'np.ndarray':
+        # the array views a reused buffer, it stays valid for the next buffers - 1 grabs
+        return (await self._grab())[1]
+
+    async def _grab(self, busy=()) -> Tuple[int, 'np.ndarray']:
+        async with Client(self.serial, self.pool) as client:
+            if self.source == Source.FRAMEBUFFER:
+                await client.call('framebuffer:')
+                grabbed = await self._grab_framebuffer(client.reader, busy)
+            else:
+                await client.call('exec:screencap')
+                grabbed = await self._grab_screencap(client.reader, busy)
+        self.captured += 1
+        return grabbed
+
+    async def _grab_framebuffer(self, reader: asyncio.StreamReader, busy) -> Tuple[int, 'np.ndarray']:
+        version = struct.unpack('<I', await reader.readexactly(4))[0]
+        length = {1: _FB_V1.size, 2: _FB_V2.size, 16: _FB_V16.size}.get(version)
+        if length is None:
+            raise ConnectionError('unknown framebuffer version {}'.format(version))
+        header = await reader.readexactly(length)
+        if self.format is None or self.format.header != header:
+            self.format = parse_framebuffer_header(version, header)[0]
+        index = self._buffer(self.format.size, busy)
+        if await self._fill(reader, memoryview(self._buffers[index])) != self.format.size:
+            raise ConnectionError('framebuffer ended early')
+        return index, self._array(self._buffers[index], 0)
+
+    async def _grab_screencap(self, reader: asyncio.StreamReader, busy) -> Tuple[int, 'np.ndarray']:
+        header = await reader.readexactly(_SCREENCAP.size)
+        if self.format is None or self.format.header != header:
+            width, height, pixel_format = _SCREENCAP.unpack(header)
+            if pixel_format not in _SCREENCAP_BPP:
+                raise ConnectionError('unknown screencap pixel format {}'.format(pixel_format))
+            self.format = FrameFormat(width, height, _SCREENCAP_BPP[pixel_format] * 8,
+                                      _SCREENCAP_ORDER[pixel_format], header)
+        # whether a color space word follows the header only shows from the length of the output
+        index = self._buffer(self.format.size + 4, busy)
+        received = await self._fill(reader, memoryview(self._buffers[index]))
+        if received not in (self.format.size, self.format.size + 4) or await reader.read(1):
+            raise ConnectionError('unexpected screencap output of {} bytes'.format(received))
+        return index, self._array(self._buffers[index], received - self.format.size)
+
+    async def frames(self, fps: float = 10.0) -> AsyncIterator[Frame]:
+        # continuous capture paced to fps; a frame the consumer hasn't taken when the next one is
+        # ready is dropped (and counted) rather than queued, so a slow consumer sees fresh frames.
+        # A yielded frame's buffer is left alone until the consumer asks for the next one
+        latest: Optional[Tuple[int, Frame]] = None
+        held: Optional[int] = None
+        failure: Optional[BaseException] = None
+        ready = asyncio.Event()
+
+        async def produce():
+            nonlocal latest, failure
+            interval = 1.0 / fps if fps else 0
+            index = 0
+            try:
+                while True:
+                    started = time.monotonic()
+                    busy = {held} if latest is None else {held, latest[0]}
+                    buffer, pixels = await self._grab(busy)
+                    if latest is not None:
+                        self.dropped += 1
+                    latest = buffer, Frame(index, time.time(), pixels, self.format)
+                    index += 1
+                    ready.set()
+                    delay = started + interval - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+            except Exception as e:
+                failure = e
+                ready.set()
+
+        producer = events.get_event_loop().create_task(produce())
+        try:
+            while True:
+                if latest is None:
+                    if failure is not None:
+                        raise failure
+                    ready.clear()
+                    await ready.wait()
+                    continue
+                (held, frame), latest = latest, None
+                yield frame
+        finally:
+            producer.cancel()
+            try:
+                await producer
+            except asyncio.CancelledError:
+                pass
+
+
+def to_rgb(pixels: 'np.ndarray', order: str = 'RGBA') -> 'np.ndarray':
+    # a view for RGB-ordered layouts, BGR ones are reversed through a negative stride
+    if order.startswith('RGB'):
+        return pixels[..., :3]
+    if order.startswith('BGR'):
+        return pixels[..., 2::-1]
+    raise ValueError('no rgb view for {}'.format(order))
+
+
+def to_gray(pixels: 'np.ndarray', order: str = 'RGBA') -> 'np.ndarray':
+    # BT.601 luma in integer arithmetic
+    rgb = to_rgb(pixels, order).astype(np.uint16)
+    return ((rgb[..., 0] * 77 + rgb[..., 1] * 150 + rgb[..., 2] * 29) >> 8).astype(np.uint8)
+
+
+def rgb565_to_rgba(pixels: 'np.ndarray') -> 'np.ndarray':
+    out = np.empty(pixels.shape + (4,), np.uint8)
+    out[..., 0] = (pixels >> 11 & 0x1f) * 255 // 31
+    out[..., 1] = (pixels >> 5 & 0x3f) * 255 // 63
+    out[..., 2] = (pixels & 0x1f) * 255 // 31
+    out[..., 3] = 255
+    return out
+
+
+def crop(pixels: 'np.ndarray', roi: Roi) -> 'np.ndarray':
+    x, y, width, height = roi
+    return pixels[y:y + height, x:x + width]
+
+
+def diff_mask(a: 'np.ndarray', b: 'np.ndarray', roi: Roi = None, threshold: int = 0) -> 'np.ndarray':
+    # pixels of the region where any channel moved by more than threshold
+    if roi is not None:
+        a, b = crop(a, roi), crop(b, roi)
+    delta = np.abs(a.astype(np.int16) - b.astype(np.int16))
+    return (delta.max(axis=-1) if delta.ndim == 3 else delta) > threshold
+
+
+def roi_diff(a: 'np.ndarray', b: 'np.ndarray', roi: Roi = None, threshold: int = 0) -> float:
+    # fraction of changed pixels in the region
+    mask = diff_mask(a, b, roi, threshold)
+    return float(mask.mean()) if mask.size else 0.0
+
+
+def changed_region(a: 'np.ndarray', b: 'np.ndarray', threshold: int = 0) -> Optional[Roi]:
+    # bounding box of everything that changed, None for identical frames
+    mask = diff_mask(a, b, threshold=threshold)
+    rows, columns = np.flatnonzero(mask.any(axis=1)), np.flatnonzero(mask.any(axis=0))
+    if not rows.size:
+        return None
+    return Roi(int(columns[0]), int(rows[0]), int(columns[-1] - columns[0] + 1), int(rows[-1] - rows[0] + 1))
@@ -0,0 +1,127 @@
+from typing import Iterable, Optional
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class SyncFlag(object):
+    NONE = 0
+    BROTLI = 1
+    LZ4 = 2
+    ZSTD = 4
+    DRY_RUN = 0x80000000
+
+
+FLAGS = {
+    'none': SyncFlag.NONE,
+    'brotli': SyncFlag.BROTLI,
+    'lz4': SyncFlag.LZ4,
+    'zstd': SyncFlag.ZSTD,
+}
+
+# favour speed, the link rather than the ratio is what we are trying to beat
+BROTLI_QUALITY = 1
+
+# same order adb itself prefers when asked for "any" compression
+PREFERENCE = ('zstd', 'lz4', 'brotli')
+
+
+class _Identity(object):
+
+    def compress(self, data) -> bytes:
+        return data
+
+    def flush(self) -> bytes:
+        return b''
+
+    def decompress(self, data) -> bytes:
+        return data
+
+
+class _BrotliCompressor(object):
+
+    def __init__(self):
+        self._c = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data) -> bytes:
+        return self._c.process(data)
+
+    def flush(self) -> bytes:
+        return self._c.finish()
+
+
+class _BrotliDecompressor(object):
+
+    def __init__(self):
+        self._d = brotli.Decompressor()
+
+    def decompress(self, data) -> bytes:
+        return self._d.process(data)
+
+
+class _Lz4Compressor(object):
+
+    def __init__(self):
+        self._c = lz4_frame.LZ4FrameCompressor()
+        self._started = False
+
+    def compress(self, data) -> bytes:
+        if not self._started:
+            self._started = True
+            return self._c.begin() + self._c.compress(data)
+        return self._c.compress(data)
+
+    def flush(self) -> bytes:
+        if not self._started:
+            self._started = True
+            return self._c.begin() + self._c.flush()
+        return self._c.flush()
+
+
+def available() -> Iterable[str]:
+    return [name for name, module in (('brotli', brotli), ('lz4', lz4_frame), ('zstd', zstandard)) if module]
+
+
+def choose(features: Iterable[str], preference: Optional[str] = 'any') -> Optional[str]:
+    # None means the original sync protocol, 'none' is sync v2 without compression
+    features = set(features)
+    if preference is None or 'sendrecv_v2' not in features:
+        return None
+    candidates = PREFERENCE if preference == 'any' else (preference,)
+    local = available()
+    for name in candidates:
+        if name in local and 'sendrecv_v2_{}'.format(name) in features:
+            return name
+    return 'none'
+
+
+def compressor(name: str):
+    if name == 'brotli':
+        return _BrotliCompressor()
+    if name == 'lz4':
+        return _Lz4Compressor()
+    if name == 'zstd':
+        return zstandard.ZstdCompressor().compressobj()
+    return _Identity()
+
+
+def decompressor(name: str):
+    if name == 'brotli':
+        return _BrotliDecompressor()
+    if name == 'lz4':
+        return lz4_frame.LZ4FrameDecompressor()
+    if name == 'zstd':
+        return zstandard.ZstdDecompressor().decompressobj()
+    return _Identity()
@@ -1,39 +1,89 @@
+import asyncio
+import hashlib
 import os
+import posixpath
 import re
-import struct
-from typing import List, Dict
+from typing import AsyncIterator, Iterable, List, Dict, NamedTuple, Optional, Tuple
 
 import aiofiles
 
-from aadb.transport import Client, Signal, Stats
+from aadb import compression as codec
+from aadb.cache import TTLCache
+from aadb.input import InputDevice, InputScript, TouchWriter, parse_input_devices
+from aadb.logcat import LogcatParser, build_command as build_logcat_command
+from aadb.relay import RELAY_BUFFER_SIZE, Relay
+from aadb.scheduler import Order, TransferJob, TransferScheduler
+from aadb.session import ShellResult, ShellSession
+from aadb.stream import LineStream, Overflow
+from aadb.sync import PULL_BUFFER_SIZE, DeltaReport, PullResult, PushResult, SyncEntry, SyncSession
+from aadb import events
+from aadb.transport import STREAM_LIMIT, Client
 
 try:
     from shlex import quote as cmd_quote
 except ImportError:
     from pipes import quote as cmd_quote1
 
+# paths per md5sum / rm invocation, keeps the command line well below the device limits
+SHELL_BATCH = 64
+INSTALL_CHUNK_SIZE = 1 << 20
+INSTALL_STAGING_DIR = '/data/local/tmp'
+
+
+class InstallResult(NamedTuple):
+    paths: List[str]
+    success: bool
+    message: str
+    streamed: bool
+
+
+def _write_fd(fd: int, data: bytes):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
 
-class Transport(object):
 
-    def __init__(self):
-        self.device = None
+def _install_result(paths: List[str], output: str, streamed: bool) -> InstallResult:
+    status = re.search(r"(Success|Failure|Error)\s?(.*)", output)
+    if status is None:
+        return InstallResult(paths, False, output.strip(), streamed)
+    return InstallResult(paths, status.group(1) == 'Success', status.group(2).strip().lstrip('[').rstrip(']'), streamed)
 
-    def transport(self, cls):
-        def wrapper(*args, **kwargs):
-            device = cls(*args, **kwargs)
-            self.device = device
-            return device
 
-        return wrapper
+def _md5_file(path: str) -> str:
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Transport(object):
+
+    def __init__(self, device: 'Device' = None, pool=None):
+        self.device = device
+        self.pool = pool
 
     def shell(self, **options):
         def decorator(f):
             async def wrapper(*args, **kwargs):
-                async with Client() as client:
-                    await client.call('host:transport:{}'.format(self.device.serial))
+                async with Client(self.device.serial, self.pool) as client:
                     cmd_args = '' if not args else args[0]
                     await client.call('shell:{}'.format(options['command']))
-                    await client.receive_lines(pipeline_func=kwargs['pipeline_func'])
+                    await client.receive_lines(pipeline_func=kwargs['pipeline_func'],
+                                               batch=options.get('batch', False))
+                return await f(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def exec(self, **options):
+        def decorator(f):
+            async def wrapper(*args, **kwargs):
+                async with Client(self.device.serial, self.pool) as client:
+                    await client.call('exec:{}'.format(options['command']))
+                    await client.receive_raw(consume_func=kwargs['consume_func'])
                 return await f(*args, **kwargs)
 
             return wrapper
@@ -43,8 +93,11 @@ class Transport(object):
     def host(self, **options):
         def decorator(f):
             async def wrapper(*args, **kwargs):
-                async with Client() as client:
-                    await client.call('host:{}'.format(options['command']))
+                async with Client(pool=self.pool) as client:
+                    if options.get('serial'):
+                        await client.call('host-serial:{}:{}'.format(self.device.serial, options['command']))
+                    else:
+                        await client.call('host:{}'.format(options['command']))
                     if 'no_receive' not in options:
                         kwargs['parsing_result'](await client.receive())
                 return await f(*args, **kwargs)
@@ -53,84 +106,75 @@ class Transport(object):
 
         return decorator
 
+    def sync(self, compression: str = None) -> SyncSession:
+        return SyncSession(self.device.serial, self.pool, compression)
+
     def push(self, **options):
         def decorator(f):
             async def wrapper(*args, **kwargs):
-                async with Client() as client:
-                    await client.call('host:transport:{}'.format(self.device.serial))
-                    # send sync signal
-                    await client.call('sync:')
-                    # send sync file info data
-                    arg = '{dest},{mode}'.format(dest=kwargs['dest_path'],
-                                                 mode=options['mode'] | Stats.S_IFREG).encode('utf-8')
-                    await client.write(Signal.SEND.encode('utf-8') + struct.pack('<I', len(arg)) + arg)
-                    # send data now
-                    total_size = os.path.getsize(kwargs['src_path'])
-                    async with aiofiles.open(kwargs['src_path'], 'rb') as stream:
-                        sent_size = 0
-                        while True:
-                            chunk = await stream.read(65536)
-                            if not chunk:
-                                break
-                            sent_size += len(chunk)
-                            await client.write(Signal.DATA.encode('utf-8') + struct.pack('<I', len(chunk)))
-                            await client.write(chunk)
-                            if 'progress_func' in options and options['progress_func']:
-                                options['progress_func'](total_size, sent_size)
-                        await client.write(Signal.DONE.encode('utf-8') + struct.pack('<I', len(chunk)))
-                        await client.receive_done()
+                async with self.sync(options.get('compression')) as session:
+                    await session.push(kwargs['src_path'], kwargs['dest_path'], options['mode'],
+                                       options.get('progress_func'))
                 return await f(*args, **kwargs)
 
             return wrapper
 
         return decorator
 
-    def pull(self, f):
-        async def wrapper(*args, **kwargs):
-            async with Client() as client:
-                await client.call('host:transport:{}'.format(self.device.serial))
-                # send sync signal
-                await client.call('sync:')
-                # send sync file info data
-                arg = kwargs['src_path'].encode('utf-8')
-                await client.write(Signal.RECV.encode('utf-8') + struct.pack('<I', len(arg)) + arg)
-                # send data now
-                async with aiofiles.open(kwargs['dest_path'], 'wb') as stream:
-                    while True:
-                        flag = (await client.reader.read(4)).decode('utf-8')
-
-                        if flag == Signal.DONE:
-                            await client.reader.read(4)
-                            break
-
-                        data_len = struct.unpack("<I", await client.reader.read(4))[0]
-                        data = bytearray()
-                        while len(data) < data_len:
-                            data += await client.reader.read(data_len - len(data))
-
-                        if flag == Signal.DATA:
-                            await stream.write(data)
+    def pull(self, **options):
+        def decorator(f):
+            async def wrapper(*args, **kwargs):
+                async with self.sync(options.get('compression')) as session:
+                    await session.pull(kwargs['src_path'], kwargs['dest_path'])
+                return await f(*args, **kwargs)
 
-                        if flag == Signal.FAIL:
-                            raise ConnectionError('pull data error: {}'.format(data.decode('utf-8')))
+            return wrapper
 
-            return await f(*args, **kwargs)
+        return decorator
 
-        return wrapper
 
+class Device(object):
 
-tp = Transport()
+    def __init__(self, serial: str, pool=None, compression: Optional[str] = 'any'):
+        # compression is 'any', a codec name, 'none' for uncompressed sync v2 or None for sync v1
+        self.serial = serial
+        self.compression = compression
+        self.tp = Transport(self, pool)
+        self.cache = TTLCache()
+        self._session: Optional[ShellSession] = None
+        # stat/listdir/walk share one sync session, its requests must not interleave
+        self._fs: Optional[SyncSession] = None
+        self._fs_lock = asyncio.Lock()
+
+    def refresh(self, *keys):
+        # drops the cached 'properties', 'packages' and 'features' (all of them without keys)
+        self.cache.invalidate(*keys)
+
+    async def features(self) -> List[str]:
+        return list(await self.cache.get_or_load('features', self._features))
+
+    async def _features(self) -> List[str]:
+        feature_list = []
+
+        @self.tp.host(command='features', serial=True)
+        async def list_features(parsing_result):
+            pass
 
+        def parsing_result_f(result):
+            feature_list.extend(result.split(','))
 
-@tp.transport
-class Device(object):
+        await list_features(parsing_result=parsing_result_f)
+        return feature_list
 
-    def __init__(self, serial: str):
-        self.serial = serial
+    async def sync_compression(self) -> Optional[str]:
+        # chosen per transfer from the cached features, so a changed compression or refresh('features') counts
+        if not self.compression:
+            return None
+        return codec.choose(await self.features(), self.compression)
 
-    async def shell(self, command: str, pipeline=None):
+    async def shell(self, command: str, pipeline=None, batch: bool = False):
 
-        @tp.shell(command=command)
+        @self.tp.shell(command=command, batch=batch)
         async def run_cmd(pipeline_func):
             pass
 
@@ -140,36 +184,303 @@ class Device(object):
 
         await run_cmd(pipeline_func=parsing_result)
 
-    async def push(self, src: str, dest: str, progress_func=None):
+    async def exec_out(self, command: str, consumer=None, fd=None) -> Optional[bytes]:
+        # raw bytes of the exec: service: collected and returned, handed chunk by chunk to
+        # consumer (plain or async callable) or written to fd (descriptor or object with fileno)
+        output = None
+        if consumer is None and fd is None:
+            output = bytearray()
+            consumer = output.extend
+        elif consumer is None:
+            fd = fd if isinstance(fd, int) else fd.fileno()
+
+            async def consumer(data):
+                await events.get_event_loop().run_in_executor(None, _write_fd, fd, data)
+
+        @self.tp.exec(command=command)
+        async def run_cmd(consume_func):
+            pass
+
+        await run_cmd(consume_func=consumer)
+        return None if output is None else bytes(output)
+
+    async def exec_iter(self, command: str, chunk_size: int = STREAM_LIMIT) -> AsyncIterator[bytes]:
+        async with Client(self.serial, self.tp.pool) as client:
+            await client.call('exec:{}'.format(command))
+            async for data in client.iter_raw(chunk_size):
+                yield data
+
+    async def close(self):
+        # the sessions kept open by session() and the filesystem calls
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        if self._fs_lock.locked():
+            # a listdir left unfinished may hold the lock for good, its session is dropped without a QUIT
+            await self._close_fs(ConnectionError('device closed'))
+            return
+        async with self._fs_lock:
+            await self._close_fs()
+
+    async def _open_fs(self) -> SyncSession:
+        if self._fs is None:
+            session = SyncSession(self.serial, self.tp.pool)
+            await session.__aenter__()
+            self._fs = session
+        return self._fs
+
+    async def _close_fs(self, error: BaseException = None):
+        session, self._fs = self._fs, None
+        if session is not None:
+            await session.__aexit__(type(error) if error else None, error, None)
+
+    async def stat(self, path: str) -> SyncEntry:
+        # lstat, a mode of 0 means the path does not exist
+        if self._fs_lock.locked():
+            # the shared session is busy, e.g. stat() inside a listdir() loop: a session of its own
+            async with SyncSession(self.serial, self.tp.pool) as session:
+                return await session.stat(path)
+        async with self._fs_lock:
+            session = await self._open_fs()
+            try:
+                return await session.stat(path)
+            except BaseException as e:
+                await self._close_fs(e)
+                raise
+
+    async def listdir(self, path: str) -> AsyncIterator[SyncEntry]:
+        # entries as their DENT records arrive; leaving the loop early costs the session its
+        # unread records, so it is closed and the next call opens a fresh one. The shared session
+        # stays taken across the yields, calls made meanwhile (nested ones included) get their own
+        if self._fs_lock.locked():
+            async with SyncSession(self.serial, self.tp.pool) as session:
+                async for entry in session.list(path):
+                    yield entry
+            return
+        async with self._fs_lock:
+            session = await self._open_fs()
+            done = False
+            try:
+                async for entry in session.list(path):
+                    yield entry
+                done = True
+            finally:
+                if not done:
+                    await self._close_fs(ConnectionError('listing of {} abandoned'.format(path)))
+
+    async def walk(self, top: str) -> AsyncIterator[Tuple[str, List[SyncEntry], List[SyncEntry]]]:
+        # os.walk top-down: (path, dirs, files) per directory, removing from dirs prunes the walk;
+        # symbolic links are listed in files and never followed
+        pending = [top.rstrip('/') or '/']
+        while pending:
+            path = pending.pop()
+            dirs, files = [], []
+            async for entry in self.listdir(path):
+                (dirs if entry.is_dir else files).append(entry)
+            yield path, dirs, files
+            pending.extend(posixpath.join(path, entry.name) for entry in reversed(dirs))
+
+    async def push(self, src: str, dest: str, progress_func=None) -> List[PushResult]:
+        # a PushResult per file, a single one for a file src; a failed file is reported, not raised
         if not os.path.exists(src):
             raise FileNotFoundError("Can't find the source file {}".format(src))
 
-        @tp.push(progress_func=progress_func, mode=0o644)
-        async def push_file(src_path, dest_path):
-            pass
+        if os.path.isfile(src):
+            return await self.push_batch([(src, dest)], progress_func=progress_func)
+
+        remote_root = posixpath.join(dest, os.path.basename(os.path.normpath(src)))
+        files, dirs, empty_dirs = self._local_tree(src)
+        # sync SEND creates missing parent directories, only empty ones need a mkdir
+        if empty_dirs:
+            await self.shell('mkdir -p {}'.format(
+                ' '.join(cmd_quote(posixpath.join(remote_root, d) if d else remote_root) for d in empty_dirs)))
+        return await self.push_batch([(path, posixpath.join(remote_root, rel)) for rel, path in files.items()],
+                                     progress_func=progress_func)
+
+    async def push_tree(self, src: str, dest: str, sessions: int = 4, order: str = Order.LARGEST,
+                        progress_func=None) -> List[PushResult]:
+        # same layout as push, spread over several sync sessions; progress_func gets a TransferProgress
+        if not os.path.exists(src):
+            raise FileNotFoundError("Can't find the source file {}".format(src))
 
         if os.path.isfile(src):
-            await push_file(src_path=src, dest_path=dest)
+            jobs = [TransferJob(src, dest, os.path.getsize(src))]
+        else:
+            remote_root = posixpath.join(dest, os.path.basename(os.path.normpath(src)))
+            files, dirs, empty_dirs = self._local_tree(src)
+            if empty_dirs:
+                await self.shell('mkdir -p {}'.format(
+                    ' '.join(cmd_quote(posixpath.join(remote_root, d) if d else remote_root) for d in empty_dirs)))
+            jobs = [TransferJob(path, posixpath.join(remote_root, rel), os.path.getsize(path))
+                    for rel, path in files.items()]
+
+        scheduler = TransferScheduler(self.serial, self.tp.pool, await self.sync_compression(), sessions, order,
+                                      progress_func)
+        return await scheduler.push(jobs)
+
+    async def pull_tree(self, src: str, dest: str, sessions: int = 4, order: str = Order.LARGEST,
+                        progress_func=None) -> List[PullResult]:
+        # a remote directory lands in dest/basename(src); symlinks and special files are skipped
+        async with self.tp.sync() as session:
+            root = await session.stat(src)
+            if not root.exists:
+                raise FileNotFoundError("Can't find the remote file {}".format(src))
+            remote = await session.tree(src) if root.is_dir else {}
+
+        if root.is_dir:
+            local_root = os.path.join(dest, posixpath.basename(src.rstrip('/')))
+            os.makedirs(local_root, exist_ok=True)
+            jobs = []
+            for rel, entry in sorted(remote.items()):
+                local_path = os.path.join(local_root, *rel.split('/'))
+                if entry.is_dir:
+                    os.makedirs(local_path, exist_ok=True)
+                elif entry.is_file:
+                    jobs.append(TransferJob(posixpath.join(src, rel), local_path, entry.size))
         else:
-            for root, dirs, files in os.walk(src):
-                root_dir_path = os.path.join(os.path.basename(src), root.replace(src, ''))
-                await self.shell('mkdir -p {}/{}'.format(dest, root_dir_path))
+            local_path = os.path.join(dest, posixpath.basename(src)) if os.path.isdir(dest) else dest
+            jobs = [TransferJob(src, local_path, root.size)]
 
-                for sub_f in files:
-                    await push_file(src_path=os.path.join(root, sub_f),
-                                    dest_path=os.path.join(dest, root_dir_path, sub_f))
+        scheduler = TransferScheduler(self.serial, self.tp.pool, await self.sync_compression(), sessions, order,
+                                      progress_func)
+        return await scheduler.pull(jobs)
 
-    async def pull(self, src: str, dest: str):
-        @tp.pull
+    @staticmethod
+    def _local_tree(src: str) -> Tuple[Dict[str, str], List[str], List[str]]:
+        # files keyed by their posix path relative to src, directories and empty directories as relative paths
+        files = {}
+        all_dirs = []
+        empty_dirs = []
+        for root, dirs, names in os.walk(src):
+            rel_path = os.path.relpath(root, src)
+            rel_dir = '' if rel_path == os.curdir else posixpath.join(*rel_path.split(os.sep))
+            if rel_dir:
+                all_dirs.append(rel_dir)
+            if not dirs and not names:
+                empty_dirs.append(rel_dir)
+            for name in names:
+                files[posixpath.join(rel_dir, name) if rel_dir else name] = os.path.join(root, name)
+        return files, all_dirs, empty_dirs
+
+    async def push_delta(self, src: str, dest: str, checksum: bool = False, delete: bool = False,
+                         progress_func=None) -> DeltaReport:
+        # only sends what is missing or differs on the device: size and mtime by default, size and an
+        # on-device md5 with checksum=True; delete=True also removes remote entries src does not have
+        if not os.path.exists(src):
+            raise FileNotFoundError("Can't find the source file {}".format(src))
+
+        if os.path.isfile(src):
+            remote_root, files, local_dirs, empty_dirs = dest, {'': src}, [], []
+        else:
+            remote_root = posixpath.join(dest, os.path.basename(os.path.normpath(src)))
+            files, local_dirs, empty_dirs = self._local_tree(src)
+
+        def remote_path(rel):
+            return posixpath.join(remote_root, rel) if rel else remote_root
+
+        async with self.tp.sync() as session:
+            root = await session.stat(remote_root)
+            if root.is_dir and '' in files:
+                # like push, a single file goes into an existing remote directory
+                remote_root = posixpath.join(remote_root, os.path.basename(src))
+                root = await session.stat(remote_root)
+            remote = await session.tree(remote_root) if root.is_dir and '' not in files else {}
+        if root.exists and ('' in files or not root.is_dir):
+            remote[''] = root
+
+        # remote entries standing where src has a different type are replaced, not merged
+        wanted = set(files) | set(local_dirs) | {''}
+        stale = [rel for rel, entry in remote.items()
+                 if (rel in files and not entry.is_file) or (rel in local_dirs and not entry.is_dir) or
+                 (delete and rel not in wanted)]
+        stale = [rel for rel in stale if not any(rel.startswith(other + '/') for other in stale if other)]
+        if stale:
+            await self._remove([remote_path(rel) for rel in stale])
+            remote = {rel: entry for rel, entry in remote.items()
+                      if not any(rel == other or rel.startswith(other + '/') for other in stale)}
+
+        changed = []
+        unchanged = []
+        candidates = []
+        for rel, path in files.items():
+            entry = remote.get(rel)
+            size = os.path.getsize(path)
+            if entry is None or entry.size != size:
+                changed.append(rel)
+            elif checksum:
+                candidates.append(rel)
+            elif entry.mtime == int(os.path.getmtime(path)):
+                unchanged.append(rel)
+            else:
+                changed.append(rel)
+        if candidates:
+            remote_sums = await self._md5sums([remote_path(rel) for rel in candidates])
+            loop = events.get_event_loop()
+            for rel in candidates:
+                local_sum = await loop.run_in_executor(None, _md5_file, files[rel])
+                (unchanged if remote_sums.get(remote_path(rel)) == local_sum else changed).append(rel)
+
+        missing_dirs = [d for d in empty_dirs if d not in remote]
+        if missing_dirs:
+            await self.shell('mkdir -p {}'.format(' '.join(cmd_quote(remote_path(d)) for d in missing_dirs)))
+        results = await self.push_batch([(files[rel], remote_path(rel)) for rel in changed],
+                                        progress_func=progress_func)
+        return DeltaReport(sum(1 for result in results if result.success),
+                           sum(result.size for result in results if result.success),
+                           len(unchanged), sum(os.path.getsize(files[rel]) for rel in unchanged),
+                           [remote_path(rel) for rel in stale], results)
+
+    async def _md5sums(self, paths: List[str]) -> Dict[str, str]:
+        sums = {}
+
+        def parsing_line(line):
+            digest, _, path = line.partition('  ')
+            if path:
+                sums[path] = digest
+
+        for offset in range(0, len(paths), SHELL_BATCH):
+            await self.shell('md5sum {}'.format(' '.join(cmd_quote(p) for p in paths[offset:offset + SHELL_BATCH])),
+                             pipeline=parsing_line)
+        return sums
+
+    async def _remove(self, paths: List[str]):
+        for offset in range(0, len(paths), SHELL_BATCH):
+            await self.shell('rm -rf {}'.format(' '.join(cmd_quote(p) for p in paths[offset:offset + SHELL_BATCH])))
+
+    async def push_batch(self, files: List[Tuple[str, str]], progress_func=None, mode: int = 0o644) -> List[PushResult]:
+        report = []
+        compression = await self.sync_compression()
+        while files:
+            async with self.tp.sync(compression) as session:
+                results = await session.push_many(files, mode=mode, progress_func=progress_func)
+            if not results:
+                report.extend(PushResult(src, dest, 0, False, 'sync session closed') for src, dest in files)
+                break
+            report.extend(results)
+            # adbd closes the session after a failure, carry on with the rest over a new one
+            files = files[len(results):]
+        return report
+
+    async def pull(self, src: str, dest):
+        # dest is a local path, a bytearray or any object with a write method
+        @self.tp.pull(compression=await self.sync_compression())
         async def pull_file(src_path, dest_path):
             pass
 
         await pull_file(src_path=src, dest_path=dest)
 
+    async def pull_iter(self, src: str, buffer_size: int = PULL_BUFFER_SIZE) -> AsyncIterator[memoryview]:
+        async with self.tp.sync(await self.sync_compression()) as session:
+            async for view in session.recv_chunks(src, buffer_size):
+                yield view
+
     async def list_package(self) -> List[str]:
+        return list(await self.cache.get_or_load('packages', self._list_package))
+
+    async def _list_package(self) -> List[str]:
         pkgs = []
 
-        @tp.shell(command='pm list packages 2>/dev/null')
+        @self.tp.shell(command='pm list packages 2>/dev/null')
         async def list_pkgs(pipeline_func):
             pass
 
@@ -183,9 +494,12 @@ class Device(object):
         return pkgs
 
     async def get_properties(self) -> Dict[str, str]:
+        return dict(await self.cache.get_or_load('properties', self._get_properties))
+
+    async def _get_properties(self) -> Dict[str, str]:
         properties = {}
 
-        @tp.shell(command='getprop')
+        @self.tp.shell(command='getprop')
         async def getprop(pipeline_func):
             pass
 
@@ -198,13 +512,147 @@ class Device(object):
 
         return properties
 
-    async def logcat(self, pipeline):
-        @tp.shell(command='logcat')
+    async def logcat(self, pipeline, batch: bool = False):
+        @self.tp.shell(command='logcat', batch=batch)
         async def print_logcat(pipeline_func):
             pass
 
         await print_logcat(pipeline_func=pipeline)
 
+    async def logcat_records(self, pipeline, tags=None, priority=None, pid: int = None, buffers=None,
+                             dump: bool = False, batch: bool = False):
+        # binary logger entries over exec:, the filters are applied by logcat on the device
+        parser = LogcatParser()
+
+        def consume(data):
+            records = parser.feed(data)
+            if batch:
+                if records:
+                    pipeline(records)
+            else:
+                for record in records:
+                    pipeline(record)
+
+        await self.exec_out(build_logcat_command(tags, priority, pid, buffers, dump), consumer=consume)
+
+    def shell_stream(self, command: str, maxsize: int = 1024, overflow: str = Overflow.BLOCK) -> LineStream:
+        return LineStream(self.serial, 'shell:{}'.format(command), self.tp.pool, maxsize, overflow)
+
+    def session(self) -> ShellSession:
+        # one `sh` kept open for the device, its commands skip the connect and spawn of shell()
+        if self._session is None:
+            self._session = ShellSession(self.serial, self.tp.pool)
+        return self._session
+
+    async def run(self, command: str, timeout: float = None) -> ShellResult:
+        return await self.session().run(command, timeout)
+
+    async def input(self, script: InputScript):
+        # the whole batch runs as one shell: invocation
+        if len(script):
+            await self.shell(script.script())
+
+    async def keyevent(self, *keys, longpress: bool = False):
+        await self.input(InputScript().key(*keys, longpress=longpress))
+
+    async def input_text(self, text: str):
+        await self.input(InputScript().text(text))
+
+    async def tap(self, x: int, y: int):
+        await self.input(InputScript().tap(x, y))
+
+    async def swipe(self, x1: int, y1: int, x2: int, y2: int, duration: int = 300):
+        await self.input(InputScript().swipe(x1, y1, x2, y2, duration))
+
+    async def input_devices(self) -> List[InputDevice]:
+        lines = []
+        await self.shell('getevent -p', pipeline=lines.append)
+        return parse_input_devices('\n'.join(lines))
+
+    async def screen_size(self) -> Tuple[int, int]:
+        # an override set with `wm size` wins over the physical size
+        sizes = {}
+
+        def parsing_line(line):
+            m = re.match(r'^(\w+) size: (\d+)x(\d+)', line)
+            if m:
+                sizes[m.group(1)] = (int(m.group(2)), int(m.group(3)))
+
+        await self.shell('wm size', pipeline=parsing_line)
+        if not sizes:
+            raise RuntimeError('screen size of {} is unknown'.format(self.serial))
+        return sizes.get('Override', sizes.get('Physical'))
+
+    async def touchscreen(self, path: str = None) -> TouchWriter:
+        # the first multi-touch input device unless path names one
+        devices = [d for d in await self.input_devices() if d.path == path or (path is None and d.multitouch)]
+        if not devices:
+            raise RuntimeError('no touchscreen found on {}'.format(self.serial))
+        wide = '64' in (await self.get_properties()).get('ro.product.cpu.abi', '')
+        return TouchWriter(self.serial, devices[0], await self.screen_size(), self.tp.pool, wide)
+
+    def capture(self, source: str = 'framebuffer', buffers: int = 3):
+        # imported here so numpy is only loaded by those who capture
+        from aadb.capture import ScreenCapture
+        return ScreenCapture(self.serial, self.tp.pool, source, buffers)
+
+    def sampler(self, interval: float = 1.0, capacity: int = 3600, packages: Iterable[str] = (), gfx: bool = True,
+                battery: bool = True):
+        # numpy again, and the sampler polls over session()
+        from aadb.sampler import Sampler
+        return Sampler(self, interval, capacity, packages, gfx, battery)
+
+    def logcat_stream(self, args: str = '', maxsize: int = 1024, overflow: str = Overflow.BLOCK) -> LineStream:
+        return self.shell_stream('logcat {}'.format(args).strip(), maxsize, overflow)
+
+    async def forward(self, local: str, remote: str, norebind: bool = False) -> Optional[int]:
+        # sockets as adb spells them (tcp:8080, localabstract:name, jdwp:pid); for tcp:0 the
+        # server picks the port and it is returned
+        return await self._forward_request('host-serial:{}:forward:{}{};{}'.format(
+            self.serial, 'norebind:' if norebind else '', local, remote), local, bind=False)
+
+    async def remove_forward(self, local: str):
+        await self._forward_request('host-serial:{}:killforward:{}'.format(self.serial, local), bind=False)
+
+    async def reverse(self, remote: str, local: str, norebind: bool = False) -> Optional[int]:
+        # the device listens on remote and the adb server connects to local on this host
+        return await self._forward_request('reverse:forward:{}{};{}'.format(
+            'norebind:' if norebind else '', remote, local), remote)
+
+    async def remove_reverse(self, remote: str):
+        await self._forward_request('reverse:killforward:{}'.format(remote))
+
+    async def remove_reverse_all(self):
+        await self._forward_request('reverse:killforward-all')
+
+    async def list_reverse(self) -> Dict[str, str]:
+        async with Client(self.serial, self.tp.pool) as client:
+            await client.call('reverse:list-forward')
+            await client.receive_done()
+            listing = await client.receive()
+        reverses = {}
+        for line in listing.split('\n'):
+            if line:
+                _, remote, local = line.split()
+                reverses[remote] = local
+        return reverses
+
+    async def _forward_request(self, request: str, listener: str = None, bind: bool = True) -> Optional[int]:
+        # the first OKAY accepts the request, the second one reports the listener installed;
+        # host-serial: requests go to the server unbound, reverse: ones to the device
+        async with Client(self.serial if bind else None, self.tp.pool) as client:
+            await client.call(request)
+            await client.receive_done()
+            if listener == 'tcp:0':
+                return int(await client.receive())
+        return None
+
+    async def relay(self, remote: str, port: int = 0, host: str = '127.0.0.1',
+                    buffer_size: int = RELAY_BUFFER_SIZE) -> Relay:
+        # in-process alternative to forward(): each connection to host:port is spliced to its own
+        # device stream, with its traffic counted in Relay.stats()
+        return await Relay(self.serial, remote, host, port, self.tp.pool, buffer_size).start()
+
     @staticmethod
     def __process_install(**kwargs):
         args_dict = {
@@ -221,12 +669,53 @@ class Device(object):
         args = []
         for k, v in args_dict.items():
             if k == 'installer_package_name' and kwargs[k]:
-                args.append('-i {}'.format(v))
+                args.append('{} {}'.format(v, cmd_quote(kwargs[k])))
                 continue
             if kwargs[k]:
                 args.append(v)
         return ' '.join(args)
 
+    async def _streams_install(self, streamed: Optional[bool]) -> bool:
+        # `cmd package` reads the apk from stdin, without it the apk is staged in /data/local/tmp
+        return 'cmd' in await self.features() if streamed is None else streamed
+
+    async def _package_command(self, command: str, path: str = None, progress_func=None) -> str:
+        # `cmd package <command>` over exec:, with the local file at path written to its stdin
+        output = bytearray()
+        async with Client(self.serial, self.tp.pool) as client:
+            await client.call('exec:cmd package {}'.format(command))
+            if path is not None:
+                total_size = os.path.getsize(path)
+                sent_size = 0
+                async with aiofiles.open(path, 'rb') as stream:
+                    while True:
+                        chunk = await stream.read(INSTALL_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        await client.write(chunk)
+                        await client.writer.drain()
+                        sent_size += len(chunk)
+                        if progress_func:
+                            progress_func(total_size, sent_size)
+            await client.receive_raw(output.extend)
+        return output.decode('utf-8', 'replace')
+
+    async def _pm_shell(self, command: str) -> str:
+        lines = []
+        await self.shell(command, pipeline=lines.append)
+        return '\n'.join(lines)
+
+    async def _staged(self, path: str, command: str, progress_func=None) -> str:
+        # legacy path: push to /data/local/tmp, run the pm command on it, always remove the copy
+        dest_path = posixpath.join(INSTALL_STAGING_DIR, os.path.basename(path))
+        pushed = (await self.push(path, dest_path, progress_func))[0]
+        if not pushed.success:
+            raise ConnectionError('push data error: {}'.format(pushed.error))
+        try:
+            return await self._pm_shell(command.format(path=cmd_quote(dest_path)))
+        finally:
+            await self.shell('rm -f {}'.format(cmd_quote(dest_path)))
+
     async def install(self, path: str,
                       forward_lock: bool = False,
                       reinstall: bool = False,
@@ -235,30 +724,85 @@ class Device(object):
                       shared_mass_storage: bool = False,
                       internal_system_memory: bool = False,
                       downgrade: bool = False,
-                      grand_all_permission: bool = False):
-        # push apk to temp first
-        result = None
-        dest_path = os.path.join('/data/local/tmp', os.path.basename(path))
-        await self.push(path, dest_path)
-
-        @tp.shell(command='pm install {} {}'.format(self.__process_install(**(locals())), cmd_quote(dest_path)))
-        async def install_apk(pipeline_func):
-            pass
-
-        def parsing_result_f(line):
-            print(line)
-            nonlocal result
-            result = re.search("(Success|Failure|Error)\s?(.*)", line)
-
-        await install_apk(pipeline_func=parsing_result_f)
+                      grand_all_permission: bool = False,
+                      streamed: Optional[bool] = None,
+                      progress_func=None) -> InstallResult:
+        # streamed None picks the streamed install whenever the device supports it
+        if not os.path.isfile(path):
+            raise FileNotFoundError("Can't find the apk {}".format(path))
+        options = self.__process_install(**(locals()))
+        streamed = await self._streams_install(streamed)
+        try:
+            if streamed:
+                output = await self._package_command(
+                    'install -S {} {}'.format(os.path.getsize(path), options), path, progress_func)
+            else:
+                output = await self._staged(path, 'pm install {} {{path}}'.format(options), progress_func)
+        finally:
+            self.cache.invalidate('packages')
+
+        result = _install_result([path], output, streamed)
+        if not result.success:
+            raise RuntimeError("{} could not be installed - [{}]".format(path, result.message))
+        return result
 
-        if result and result.group(1) == "Success":
-            return True
-        elif result:
-            groups = result.groups()
-            raise RuntimeError("{} could not be installed - [{}]".format(dest_path, groups[1]))
-        else:
-            raise RuntimeError("{} could not be installed - [{}]".format(dest_path, result))
+    async def install_multiple(self, paths: List[str],
+                               forward_lock: bool = False,
+                               reinstall: bool = False,
+                               test: bool = False,
+                               installer_package_name: str = '',
+                               shared_mass_storage: bool = False,
+                               internal_system_memory: bool = False,
+                               downgrade: bool = False,
+                               grand_all_permission: bool = False,
+                               streamed: Optional[bool] = None,
+                               progress_func=None) -> InstallResult:
+        # split apks of one app through an install session: create, one write per apk, commit
+        for path in paths:
+            if not os.path.isfile(path):
+                raise FileNotFoundError("Can't find the apk {}".format(path))
+        options = self.__process_install(**(locals()))
+        streamed = await self._streams_install(streamed)
+        sizes = [os.path.getsize(path) for path in paths]
+        total_size = sum(sizes)
+
+        async def package(command):
+            return await (self._package_command(command) if streamed else self._pm_shell('pm ' + command))
+
+        try:
+            output = await package('install-create -S {} {}'.format(total_size, options))
+            created = re.search(r'\[(\d+)\]', output)
+            if created is None:
+                raise RuntimeError("install session could not be created - [{}]".format(output.strip()))
+            session_id = created.group(1)
+            try:
+                written = 0
+                for index, (path, size) in enumerate(zip(paths, sizes)):
+                    def file_progress(file_size, sent_size, written=written):
+                        if progress_func:
+                            progress_func(total_size, written + sent_size)
+
+                    command = 'install-write -S {} {} {}'.format(
+                        size, session_id, cmd_quote('{}_{}'.format(index, os.path.basename(path))))
+                    if streamed:
+                        output = await self._package_command(command + ' -', path, file_progress)
+                    else:
+                        output = await self._staged(path, 'pm ' + command + ' {path}', file_progress)
+                    result = _install_result([path], output, streamed)
+                    if not result.success:
+                        raise RuntimeError("{} could not be written - [{}]".format(path, result.message))
+                    written += size
+                output = await package('install-commit {}'.format(session_id))
+            except BaseException:
+                await package('install-abandon {}'.format(session_id))
+                raise
+        finally:
+            self.cache.invalidate('packages')
+
+        result = _install_result(list(paths), output, streamed)
+        if not result.success:
+            raise RuntimeError("{} could not be installed - [{}]".format(', '.join(paths), result.message))
+        return result
 
     async def is_installed(self, pkg_name: str) -> bool:
         result = False
@@ -277,7 +821,10 @@ class Device(object):
             nonlocal result
             result = re.search("(Success|Failure.*|.*Unknown package:.*)", line)
 
-        await self.shell('pm uninstall {}'.format(pkg_name), pipeline=parsing_result)
+        try:
+            await self.shell('pm uninstall {}'.format(pkg_name), pipeline=parsing_result)
+        finally:
+            self.cache.invalidate('packages')
         if result and result.group(1) == "Success":
             return True
         return False
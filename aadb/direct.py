@@ -0,0 +1,437 @@
+import asyncio
+import os
+import struct
+from asyncio import StreamReader
+from typing import Dict, List, NamedTuple, Optional
+
+from aadb import events
+from aadb.device import Device
+from aadb.transport import STREAM_LIMIT, Client
+
+try:
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import padding, utils
+except ImportError:
+    serialization = None
+
+A_SYNC = 0x434e5953
+A_CNXN = 0x4e584e43
+A_OPEN = 0x4e45504f
+A_OKAY = 0x59414b4f
+A_CLSE = 0x45534c43
+A_WRTE = 0x45545257
+A_AUTH = 0x48545541
+
+AUTH_TOKEN = 1
+AUTH_SIGNATURE = 2
+AUTH_RSAPUBLICKEY = 3
+
+# from 0x01000001 on both sides leave the payload checksum at 0
+VERSION = 0x01000001
+VERSION_MIN = 0x01000000
+MAX_PAYLOAD = 1 << 20
+# a stream holds back its OKAYs once this much is buffered, adbd then stops writing to it
+STREAM_WINDOW = STREAM_LIMIT
+
+_HEADER = struct.Struct('<6I')
+
+
+def checksum(data) -> int:
+    return sum(data) & 0xffffffff
+
+
+def _framed(data: bytes) -> bytes:
+    return '{0:04X}'.format(len(data)).encode('utf-8') + data
+
+
+class AdbdMessage(NamedTuple):
+    command: int
+    arg0: int
+    arg1: int
+    data: bytes
+
+
+class RsaSigner(object):
+    # signs AUTH tokens with an adb key pair (~/.android/adbkey and adbkey.pub), needs cryptography
+
+    def __init__(self, private_key_path: str = None, public_key_path: str = None):
+        if serialization is None:
+            raise RuntimeError('adb key authentication needs the cryptography package')
+        private_key_path = private_key_path or os.path.join(os.path.expanduser('~'), '.android', 'adbkey')
+        with open(private_key_path, 'rb') as f:
+            self._key = serialization.load_pem_private_key(f.read(), password=None)
+        with open(public_key_path or private_key_path + '.pub', 'rb') as f:
+            self._public_key = f.read().strip()
+
+    def sign(self, token: bytes) -> bytes:
+        # the token is signed as if it already were a SHA-1 digest
+        return self._key.sign(token, padding.PKCS1v15(), utils.Prehashed(hashes.SHA1()))
+
+    def public_key(self) -> bytes:
+        return self._public_key + b'\0'
+
+
+class AdbdStream(object):
+    # one OPEN'd service; the reader pauses this stream alone by holding back its OKAYs, and only one
+    # WRTE is in flight at a time as the protocol requires
+
+    def __init__(self, connection: 'AdbdConnection', local_id: int, service: str, reader: StreamReader = None,
+                 protocol=None, announce: bool = False):
+        self.connection = connection
+        self.local_id = local_id
+        self.remote_id = 0
+        self.service = service
+        self.reader = reader or StreamReader(limit=STREAM_WINDOW, loop=events.get_event_loop())
+        self.reader.set_transport(self)
+        self.protocol = protocol
+        self.announce = announce
+        self.opened = events.get_event_loop().create_future()
+        self.closed = False
+        self._writable = asyncio.Event()
+        self._paused = False
+        self._ack_pending = False
+
+    # the reader sees this stream as its transport
+    def pause_reading(self):
+        self._paused = True
+
+    def resume_reading(self):
+        self._paused = False
+        if self._ack_pending and not self.closed:
+            self._ack_pending = False
+            self.connection.send(A_OKAY, self.local_id, self.remote_id)
+
+    def on_okay(self, remote_id: int):
+        if not self.opened.done():
+            self.remote_id = remote_id
+            if self.announce:
+                self.reader.feed_data(b'OKAY')
+            self.opened.set_result(self)
+        self._writable.set()
+
+    def on_write(self, data: bytes):
+        if self.protocol is not None and self.protocol.record is not None:
+            self.protocol.record.received(len(data))
+        self.reader.feed_data(data)
+        if self._paused:
+            self._ack_pending = True
+        else:
+            self.connection.send(A_OKAY, self.local_id, self.remote_id)
+
+    def on_close(self):
+        self.closed = True
+        self._writable.set()
+        if not self.opened.done():
+            self.opened.set_exception(ConnectionError('{} refused by adbd'.format(self.service)))
+        else:
+            self.reader.feed_eof()
+
+    async def send(self, data):
+        view = memoryview(data)
+        for offset in range(0, len(view), self.connection.max_payload):
+            await self._writable.wait()
+            if self.closed:
+                raise ConnectionError('{} closed by adbd'.format(self.service))
+            self._writable.clear()
+            self.connection.send(A_WRTE, self.local_id, self.remote_id,
+                                 view[offset:offset + self.connection.max_payload])
+            await self.connection.drain()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.connection.send(A_CLSE, self.local_id, self.remote_id)
+        self.connection.forget(self)
+
+
+class _SmartSocket(object):
+    # stands in for the StreamWriter and transport of an adb server socket: smart-socket requests
+    # written to it are answered from the CNXN banner or turned into an OPEN on the adbd connection
+
+    def __init__(self, connection: 'AdbdConnection', serial: str):
+        self.connection = connection
+        self.serial = serial
+        self.reader = StreamReader(limit=STREAM_WINDOW, loop=events.get_event_loop())
+        self.record = None
+        self.stream: AdbdStream = None
+        self._request = bytearray()
+        self._pending = bytearray()
+        self._opening = None
+        self._flushing = None
+        self._finishing = None
+        self._closing = False
+
+    @property
+    def transport(self):
+        return self
+
+    def set_write_buffer_limits(self, high: int = None, low: int = None):
+        pass
+
+    def is_closing(self) -> bool:
+        return self._closing or (self.stream is not None and self.stream.closed)
+
+    def write(self, data):
+        if self._closing:
+            return
+        if self.stream is None and self._opening is None:
+            self._request += data
+            self._parse_requests()
+        else:
+            self._pending += data
+            self._flush()
+
+    def _parse_requests(self):
+        while len(self._request) >= 4:
+            length = int(self._request[:4], 16)
+            if len(self._request) < 4 + length:
+                return
+            request = self._request[4:4 + length].decode('utf-8')
+            rest = self._request[4 + length:]
+            self._request = bytearray()
+            if not request.startswith('host'):
+                self._pending += rest
+                self._opening = events.get_event_loop().create_task(self._open(request))
+                return
+            self._answer(request)
+            self._request = rest
+
+    def _answer(self, request: str):
+        connection = self.connection
+        command = request.rpartition(':')[2] if request.startswith('host-serial:') else request[len('host:'):]
+        if request.startswith(('host:transport', 'host:tport')):
+            self.reader.feed_data(b'OKAY')
+        elif command == 'version':
+            self.reader.feed_data(b'OKAY' + _framed(b'0029'))
+        elif command == 'features':
+            self.reader.feed_data(b'OKAY' + _framed(','.join(connection.features).encode('utf-8')))
+        elif command == 'get-state':
+            self.reader.feed_data(b'OKAY' + _framed(connection.state.encode('utf-8')))
+        elif command in ('devices', 'devices-l'):
+            self.reader.feed_data(b'OKAY' + _framed(connection.listing(command == 'devices-l').encode('utf-8')))
+        else:
+            self._fail('{} is not available over a direct adbd connection'.format(request))
+
+    def _fail(self, message: str):
+        self._closing = True
+        self.reader.feed_data(b'FAIL' + _framed(message.encode('utf-8')))
+        self.reader.feed_eof()
+
+    async def _open(self, service: str):
+        try:
+            self.stream = await self.connection.open(service, self.reader, protocol=self, announce=True)
+        except ConnectionError as e:
+            self._fail(str(e))
+            return
+        if self._closing:
+            self.stream.close()
+        else:
+            self._flush()
+
+    def _flush(self):
+        if self.stream is not None and self._pending and (self._flushing is None or self._flushing.done()):
+            self._flushing = events.get_event_loop().create_task(self._send_pending())
+
+    async def _send_pending(self):
+        while self._pending:
+            data, self._pending = self._pending, bytearray()
+            await self.stream.send(data)
+
+    async def drain(self):
+        if self._opening is not None:
+            await self._opening
+        if self._flushing is not None:
+            await asyncio.shield(self._flushing)
+
+    def close(self):
+        if self._finishing is None:
+            self._finishing = events.get_event_loop().create_task(self._finish())
+        self._closing = True
+
+    async def _finish(self):
+        # what was written before close still goes out, like on a real socket
+        try:
+            await self.drain()
+        except ConnectionError:
+            pass
+        if self.stream is not None:
+            self.stream.close()
+
+    async def wait_closed(self):
+        if self._finishing is not None:
+            await self._finishing
+
+
+class AdbdConnection(object):
+    # one TCP connection to adbd (wireless adb or `adb tcpip`) carrying any number of streams; it has
+    # the acquire() of a ConnectionPool, so Device, SyncSession and LineStream run over it unchanged
+
+    def __init__(self, host: str, port: int = 5555, signer=None, max_payload: int = MAX_PAYLOAD):
+        self.host = host
+        self.port = port
+        self.serial = '{}:{}'.format(host, port)
+        self.signer = signer
+        self.version = VERSION_MIN
+        self.max_payload = max_payload
+        self.state = 'offline'
+        self.features: List[str] = []
+        self.properties: Dict[str, str] = {}
+        self._streams: Dict[int, AdbdStream] = {}
+        self._next_id = 1
+        self._reader: StreamReader = None
+        self._writer = None
+        self._task = None
+        self.error: Optional[BaseException] = None
+
+    def __len__(self):
+        return len(self._streams)
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def connect(self) -> 'AdbdConnection':
+        loop = events.get_event_loop()
+        self._reader = StreamReader(limit=STREAM_LIMIT, loop=loop)
+        protocol = asyncio.StreamReaderProtocol(self._reader, loop=loop)
+        transport, _ = await loop.create_connection(lambda: protocol, self.host, self.port)
+        self._writer = asyncio.StreamWriter(transport, protocol, self._reader, loop)
+        try:
+            await self._handshake()
+        except BaseException:
+            self._writer.close()
+            raise
+        self._task = loop.create_task(self._dispatch())
+        return self
+
+    async def _handshake(self):
+        self.send(A_CNXN, VERSION, self.max_payload, b'host::\0')
+        signed = False
+        while True:
+            message = await self._read_message()
+            if message.command == A_CNXN:
+                self._connected(message)
+                return
+            if message.command != A_AUTH or message.arg0 != AUTH_TOKEN:
+                raise ConnectionError('unexpected message {:08x} during the handshake'.format(message.command))
+            if self.signer is None:
+                raise ConnectionError('{} requires adb key authentication'.format(self.serial))
+            if not signed:
+                self.send(A_AUTH, AUTH_SIGNATURE, 0, self.signer.sign(message.data))
+                signed = True
+            else:
+                # the key is unknown to the device, it is accepted there and CNXN follows
+                self.send(A_AUTH, AUTH_RSAPUBLICKEY, 0, self.signer.public_key())
+
+    def _connected(self, message: AdbdMessage):
+        # banner: "device::ro.product.name=x;ro.product.model=y;ro.product.device=z;features=a,b"
+        self.version = min(VERSION, message.arg0)
+        self.max_payload = min(self.max_payload, message.arg1)
+        banner = message.data.rstrip(b'\0').decode('utf-8', 'replace')
+        self.state, _, props = banner.partition('::')
+        for prop in filter(None, props.split(';')):
+            key, _, value = prop.partition('=')
+            self.properties[key] = value
+        self.features = list(filter(None, self.properties.pop('features', '').split(',')))
+
+    def listing(self, long: bool = False) -> str:
+        if not long:
+            return '{}\t{}\n'.format(self.serial, self.state)
+        return '{} {} product:{} model:{} device:{}\n'.format(
+            self.serial, self.state, self.properties.get('ro.product.name', ''),
+            self.properties.get('ro.product.model', ''), self.properties.get('ro.product.device', ''))
+
+    async def _read_message(self) -> AdbdMessage:
+        command, arg0, arg1, length, check, magic = _HEADER.unpack(await self._reader.readexactly(_HEADER.size))
+        if magic != command ^ 0xffffffff:
+            raise ConnectionError('corrupt message header from {}'.format(self.serial))
+        data = await self._reader.readexactly(length) if length else b''
+        if check and checksum(data) != check:
+            raise ConnectionError('payload checksum mismatch from {}'.format(self.serial))
+        return AdbdMessage(command, arg0, arg1, data)
+
+    def send(self, command: int, arg0: int, arg1: int, data=b''):
+        check = checksum(data) if self.version < VERSION and data else 0
+        self._writer.write(_HEADER.pack(command, arg0, arg1, len(data), check, command ^ 0xffffffff))
+        if data:
+            self._writer.write(data)
+
+    async def drain(self):
+        await self._writer.drain()
+
+    async def _dispatch(self):
+        try:
+            while True:
+                message = await self._read_message()
+                stream = self._streams.get(message.arg1)
+                if message.command == A_OKAY:
+                    if stream is not None:
+                        stream.on_okay(message.arg0)
+                elif message.command == A_WRTE:
+                    if stream is not None:
+                        stream.on_write(message.data)
+                    else:
+                        self.send(A_CLSE, 0, message.arg0)
+                elif message.command == A_CLSE:
+                    if stream is not None:
+                        self._streams.pop(message.arg1, None)
+                        stream.on_close()
+                elif message.command == A_OPEN:
+                    # services opened from the device side (reverse forwards) are not offered
+                    self.send(A_CLSE, 0, message.arg0)
+                elif message.command == A_CNXN:
+                    raise ConnectionError('{} restarted its transport'.format(self.serial))
+        except (ConnectionError, OSError, asyncio.IncompleteReadError) as e:
+            self.error = e
+        finally:
+            self.state = 'offline'
+            streams, self._streams = self._streams, {}
+            for stream in streams.values():
+                stream.on_close()
+
+    def forget(self, stream: AdbdStream):
+        if self._streams.get(stream.local_id) is stream:
+            del self._streams[stream.local_id]
+
+    async def open(self, service: str, reader: StreamReader = None, protocol=None,
+                   announce: bool = False) -> AdbdStream:
+        if self._task is None or self._task.done():
+            raise ConnectionError('{} is not connected'.format(self.serial))
+        local_id = self._next_id
+        self._next_id = self._next_id % 0xffffffff + 1
+        stream = AdbdStream(self, local_id, service, reader, protocol, announce)
+        self._streams[local_id] = stream
+        self.send(A_OPEN, local_id, 0, service.encode('utf-8') + b'\0')
+        return await stream.opened
+
+    async def acquire(self, serial: str = None) -> Client:
+        client = Client(serial)
+        socket = _SmartSocket(self, serial)
+        client.reader, client.writer, client.transport, client.protocol = socket.reader, socket, socket, socket
+        client.bound = serial
+        return client
+
+    def stats(self) -> Dict[str, int]:
+        return {'streams': len(self._streams), 'max_payload': self.max_payload, 'version': self.version}
+
+    async def close(self):
+        if self._writer is None:
+            return
+        for stream in list(self._streams.values()):
+            stream.close()
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except ConnectionError:
+            pass
+        if self._task is not None:
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._writer = None
+
+
+async def connect(host: str, port: int = 5555, signer=None, compression: Optional[str] = 'any') -> Device:
+    # a Device whose operations run as streams of one adbd connection, close it with device.tp.pool.close()
+    connection = await AdbdConnection(host, port, signer).connect()
+    return Device(connection.serial, connection, compression)
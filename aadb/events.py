@@ -8,19 +8,23 @@ _event_loop_policy: 'DefaultPolicy' = None
 
 
 class DefaultPolicy(object):
-    class _Local(object):
+    # the loop is kept per thread, so threads running their own loop (see aadb.shard) don't see each other's
+    class _Local(threading.local):
         _loop: AbstractEventLoop = None
         _called = False
 
+    def __init__(self):
+        self._local = self._Local()
+
     def set_event_loop(self, loop: AbstractEventLoop):
-        self._Local._called = True
-        self._Local._loop = loop
+        self._local._called = True
+        self._local._loop = loop
 
     def get_event_loop(self) -> AbstractEventLoop:
-        if self._Local._loop is None and not self._Local._called:
+        if self._local._loop is None and not self._local._called:
             self.set_event_loop(asyncio.new_event_loop() if threading.current_thread() != threading.main_thread()
                                 else asyncio.get_event_loop())
-        return self._Local._loop
+        return self._local._loop
 
 
 def _init_event_loop_policy():
@@ -0,0 +1,96 @@
+import asyncio
+import mmap
+import os
+import time
+from typing import Iterable, List, NamedTuple, Optional
+
+from aadb.sync import SYNC_DATA_MAX, SyncSession
+from aadb.transport import Signal
+
+
+class FleetResult(NamedTuple):
+    serial: str
+    success: bool
+    size: int
+    elapsed: float
+    error: Optional[str] = None
+
+
+class _MappedFile(object):
+    # the source is mapped once and shared read-only by every session, the page cache holds it once
+
+    def __init__(self, path: str):
+        self.path = path
+        self.size = 0
+        self.mtime = 0
+        self.view = memoryview(b'')
+        self._fd = None
+        self._map = None
+
+    def __enter__(self):
+        self._fd = os.open(self.path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        stat = os.fstat(self._fd)
+        self.size = stat.st_size
+        self.mtime = int(stat.st_mtime)
+        if self.size:
+            self._map = mmap.mmap(self._fd, 0, access=mmap.ACCESS_READ)
+            self.view = memoryview(self._map)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.view.release()
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # a transport still holds a slice, the mapping goes away with it
+                pass
+        os.close(self._fd)
+
+
+class Fleet(object):
+    # one artifact to many devices: every device gets its own sync session fed with slices of the
+    # same mapping, and a slow device only ever waits on its own socket
+
+    def __init__(self, devices: Iterable, pool=None, concurrency: int = None, timeout: float = None):
+        # devices are Device objects or serials
+        self.serials = [device if isinstance(device, str) else device.serial for device in devices]
+        self.pool = pool
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+    async def push(self, src: str, dest: str, mode: int = 0o644, progress_func=None) -> List[FleetResult]:
+        # progress_func(serial, total_size, sent_size), results come back in the order of the devices
+        if not os.path.isfile(src):
+            raise FileNotFoundError("Can't find the source file {}".format(src))
+
+        limit = asyncio.Semaphore(self.concurrency or max(len(self.serials), 1))
+        with _MappedFile(src) as source:
+            async def push_one(serial):
+                async with limit:
+                    started = time.perf_counter()
+                    sent = [0]
+
+                    def on_progress(total_size, sent_size):
+                        sent[0] = sent_size
+                        if progress_func:
+                            progress_func(serial, total_size, sent_size)
+
+                    try:
+                        await asyncio.wait_for(self._push_one(serial, source, dest, mode, on_progress), self.timeout)
+                    except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError, OSError) as e:
+                        return FleetResult(serial, False, sent[0], time.perf_counter() - started,
+                                           str(e) or type(e).__name__)
+                    return FleetResult(serial, True, source.size, time.perf_counter() - started)
+
+            return list(await asyncio.gather(*[push_one(serial) for serial in self.serials]))
+
+    async def _push_one(self, serial: str, source: _MappedFile, dest: str, mode: int, progress_func):
+        # uncompressed sync: compressing would cost a private copy per device, which is what we avoid here
+        async with SyncSession(serial, self.pool) as session:
+            # keep at most about one chunk queued in the transport of each device
+            session.client.writer.transport.set_write_buffer_limits(high=SYNC_DATA_MAX)
+            await session.send_buffer(source.view, dest, mode, source.mtime, progress_func)
+            flag, error = await session.read_status()
+            if flag != Signal.OKAY:
+                raise ConnectionError('push data error: {}'.format(error))
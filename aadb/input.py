@@ -0,0 +1,236 @@
+import asyncio
+import re
+import struct
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from aadb.transport import Client
+
+try:
+    from shlex import quote as cmd_quote
+except ImportError:
+    from pipes import quote as cmd_quote
+
+# linux/input-event-codes.h
+EV_SYN = 0x00
+EV_KEY = 0x01
+EV_ABS = 0x03
+SYN_REPORT = 0x00
+BTN_TOUCH = 0x14a
+ABS_MT_SLOT = 0x2f
+ABS_MT_POSITION_X = 0x35
+ABS_MT_POSITION_Y = 0x36
+ABS_MT_TRACKING_ID = 0x39
+
+# struct input_event, the kernel stamps the time of written events itself
+_EVENT_64 = struct.Struct('<qqHHi')
+_EVENT_32 = struct.Struct('<llHHi')
+
+
+def _keycode(key) -> str:
+    # KeyCode members, their values or names like 'KEYCODE_HOME' / 'HOME'
+    return str(getattr(key, 'value', key))
+
+
+def _text(text: str) -> str:
+    # `input text` takes %s for a space, everything else is protected from the device shell
+    return cmd_quote(text.replace(' ', '%s'))
+
+
+class InputScript(object):
+    # a batch of input actions compiled into one shell invocation on the device; consecutive keys
+    # share a single `input keyevent`, so a key sequence costs one process start instead of one each
+
+    def __init__(self, source: str = None):
+        self.source = source
+        self._steps: List[Tuple[str, list]] = []
+
+    def __len__(self):
+        return len(self._steps)
+
+    def key(self, *keys, longpress: bool = False) -> 'InputScript':
+        kind = 'longpress' if longpress else 'keyevent'
+        codes = [_keycode(key) for key in keys]
+        if self._steps and self._steps[-1][0] == kind:
+            self._steps[-1][1].extend(codes)
+        elif codes:
+            self._steps.append((kind, codes))
+        return self
+
+    def text(self, text: str) -> 'InputScript':
+        self._steps.append(('text', [_text(text)]))
+        return self
+
+    def tap(self, x: int, y: int) -> 'InputScript':
+        self._steps.append(('tap', [int(x), int(y)]))
+        return self
+
+    def swipe(self, x1: int, y1: int, x2: int, y2: int, duration: int = 300) -> 'InputScript':
+        # duration in milliseconds
+        self._steps.append(('swipe', [int(x1), int(y1), int(x2), int(y2), int(duration)]))
+        return self
+
+    def sleep(self, seconds: float) -> 'InputScript':
+        self._steps.append(('sleep', [seconds]))
+        return self
+
+    def commands(self) -> List[str]:
+        source = '{} '.format(self.source) if self.source else ''
+        commands = []
+        for kind, args in self._steps:
+            args = ' '.join(str(arg) for arg in args)
+            if kind == 'sleep':
+                commands.append('sleep {}'.format(args))
+            elif kind == 'longpress':
+                commands.append('input {}keyevent --longpress {}'.format(source, args))
+            else:
+                commands.append('input {}{} {}'.format(source, kind, args))
+        return commands
+
+    def script(self) -> str:
+        return '; '.join(self.commands())
+
+
+class AbsAxis(NamedTuple):
+    minimum: int
+    maximum: int
+
+
+class InputDevice(NamedTuple):
+    path: str
+    name: str
+    axes: Dict[int, AbsAxis]
+
+    @property
+    def multitouch(self) -> bool:
+        return ABS_MT_POSITION_X in self.axes and ABS_MT_POSITION_Y in self.axes
+
+
+def parse_input_devices(listing: str) -> List[InputDevice]:
+    # output of `getevent -p`
+    devices = []
+    path, name, axes, section = None, '', {}, None
+    for line in listing.splitlines():
+        added = re.match(r'^add device \d+: (\S+)', line)
+        if added:
+            if path is not None:
+                devices.append(InputDevice(path, name, axes))
+            path, name, axes, section = added.group(1), '', {}, None
+            continue
+        named = re.match(r'^\s+name:\s+"(.*)"', line)
+        if named:
+            name = named.group(1)
+            continue
+        kind = re.match(r'^\s+([A-Z]+) \([0-9a-f]{4}\):', line)
+        if kind:
+            section = kind.group(1)
+        elif not line.startswith('      '):
+            section = None
+        if section == 'ABS':
+            axis = re.search(r'([0-9a-f]{4})\s*: value -?\d+, min (-?\d+), max (-?\d+)', line)
+            if axis:
+                axes[int(axis.group(1), 16)] = AbsAxis(int(axis.group(2)), int(axis.group(3)))
+    if path is not None:
+        devices.append(InputDevice(path, name, axes))
+    return devices
+
+
+class TouchWriter(object):
+    # writes multi-touch (protocol B) events straight into a /dev/input node through one long-lived
+    # `cat`, which the shell user may do as a member of the input group; no process per event, so a
+    # gesture of hundreds of points takes milliseconds. Coordinates are in screen pixels
+
+    def __init__(self, serial: str, device: InputDevice, screen: Tuple[int, int], pool=None, wide: bool = True):
+        self.serial = serial
+        self.device = device
+        self.screen = screen
+        self.pool = pool
+        self.events = 0
+        self._event = _EVENT_64 if wide else _EVENT_32
+        self._client: Optional[Client] = None
+        self._tracking_id = 0
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def open(self) -> 'TouchWriter':
+        if self._client is None:
+            client = Client(self.serial, self.pool)
+            await client.__aenter__()
+            try:
+                await client.call('exec:cat > {}'.format(cmd_quote(self.device.path)))
+            except BaseException as e:
+                await client.__aexit__(type(e), e, e.__traceback__)
+                raise
+            self._client = client
+        return self
+
+    def _scale(self, axis: int, value: float, size: int) -> int:
+        limits = self.device.axes[axis]
+        return limits.minimum + int(round(value * (limits.maximum - limits.minimum) / max(size - 1, 1)))
+
+    def _pack(self, events: Sequence[Tuple[int, int, int]]) -> bytes:
+        self.events += len(events)
+        return b''.join(self._event.pack(0, 0, kind, code, value) for kind, code, value in events)
+
+    def _frame(self, fingers: Dict[int, Optional[Tuple[float, float]]], down: bool, up: bool):
+        # one SYN_REPORT worth of events: a position per finger slot, None lifts the finger
+        events = []
+        width, height = self.screen
+        for slot, point in sorted(fingers.items()):
+            events.append((EV_ABS, ABS_MT_SLOT, slot))
+            if point is None:
+                events.append((EV_ABS, ABS_MT_TRACKING_ID, -1))
+                continue
+            if down:
+                self._tracking_id = (self._tracking_id + 1) & 0xffff
+                events.append((EV_ABS, ABS_MT_TRACKING_ID, self._tracking_id))
+            events.append((EV_ABS, ABS_MT_POSITION_X, self._scale(ABS_MT_POSITION_X, point[0], width)))
+            events.append((EV_ABS, ABS_MT_POSITION_Y, self._scale(ABS_MT_POSITION_Y, point[1], height)))
+        if down or up:
+            events.append((EV_KEY, BTN_TOUCH, 1 if down else 0))
+        events.append((EV_SYN, SYN_REPORT, 0))
+        return self._pack(events)
+
+    async def gesture(self, strokes: Sequence[Sequence[Tuple[float, float]]], interval: float = 0.005):
+        # one stroke of points per finger, all moving together; interval seconds between frames
+        # lets the framework see the motion, 0 sends the whole gesture in one write
+        if not strokes or not all(strokes):
+            raise ValueError('gesture needs at least one stroke, each with a point')
+        if self._client is None:
+            await self.open()
+        frames = max(len(stroke) for stroke in strokes)
+        for index in range(frames):
+            fingers = {slot: stroke[min(index, len(stroke) - 1)] for slot, stroke in enumerate(strokes)}
+            await self._client.write(self._frame(fingers, index == 0, False))
+            await self._client.writer.drain()
+            if interval:
+                await asyncio.sleep(interval)
+        await self._client.write(self._frame({slot: None for slot in range(len(strokes))}, False, True))
+        await self._client.writer.drain()
+
+    async def tap(self, x: float, y: float):
+        await self.gesture([[(x, y)]], interval=0)
+
+    async def swipe(self, x1: float, y1: float, x2: float, y2: float, steps: int = 20, interval: float = 0.005):
+        await self.gesture([_line((x1, y1), (x2, y2), steps)], interval)
+
+    async def pinch(self, center: Tuple[float, float], start: float, end: float, steps: int = 20,
+                    interval: float = 0.005):
+        # two fingers on a horizontal line through center, start and end are their distances
+        x, y = center
+        await self.gesture([_line((x - start / 2, y), (x - end / 2, y), steps),
+                            _line((x + start / 2, y), (x + end / 2, y), steps)], interval)
+
+    async def close(self):
+        if self._client is not None:
+            client, self._client = self._client, None
+            await client.__aexit__(None, None, None)
+
+
+def _line(start: Tuple[float, float], end: Tuple[float, float], steps: int) -> List[Tuple[float, float]]:
+    steps = max(steps, 1)
+    return [(start[0] + (end[0] - start[0]) * i / steps, start[1] + (end[1] - start[1]) * i / steps)
+            for i in range(steps + 1)]
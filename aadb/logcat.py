@@ -0,0 +1,112 @@
+import struct
+from shlex import quote as cmd_quote
+from typing import Dict, Iterable, List, NamedTuple, Union
+
+
+class Priority(object):
+    VERBOSE = 2
+    DEBUG = 3
+    INFO = 4
+    WARN = 5
+    ERROR = 6
+    FATAL = 7
+    SILENT = 8
+
+    LETTERS = {2: 'V', 3: 'D', 4: 'I', 5: 'W', 6: 'E', 7: 'F', 8: 'S'}
+
+    @classmethod
+    def letter(cls, priority: Union[int, str]) -> str:
+        if isinstance(priority, str):
+            return priority.upper()[:1]
+        return cls.LETTERS[priority]
+
+
+class LogRecord(NamedTuple):
+    pid: int
+    tid: int
+    sec: int
+    nsec: int
+    lid: int
+    uid: int
+    priority: int
+    tag: str
+    message: str
+
+
+# struct logger_entry: len and hdr_size are read first to find the record boundaries, the
+# rest of the header is then decoded for a whole run of records with one iter_unpack call
+_PREFIX = struct.Struct('<HH')
+_HEADERS = {
+    20: struct.Struct('<4xiIII'),
+    24: struct.Struct('<4xiIIII'),
+    28: struct.Struct('<4xiIIIII'),
+}
+
+
+class LogcatParser(object):
+
+    def __init__(self):
+        self._pending = b''
+
+    def feed(self, data: bytes) -> List[LogRecord]:
+        buffer = self._pending + data if self._pending else data
+        records = []
+        offset = 0
+        size = len(buffer)
+        while offset + 4 <= size:
+            # one run of records sharing the same header layout
+            payloads = []
+            header_size = None
+            while offset + 4 <= size:
+                payload_size, hdr_size = _PREFIX.unpack_from(buffer, offset)
+                hdr_size = hdr_size or 20
+                if header_size is None:
+                    header_size = hdr_size
+                elif hdr_size != header_size:
+                    break
+                end = offset + hdr_size + payload_size
+                if end > size:
+                    break
+                payloads.append((offset, end))
+                offset = end
+            if not payloads:
+                break
+            self._decode(buffer, payloads, header_size, records)
+        self._pending = buffer[offset:]
+        return records
+
+    @staticmethod
+    def _decode(buffer: bytes, payloads, header_size: int, records: List[LogRecord]):
+        # newer headers only append fields, decode the largest layout we know that fits
+        known = max(size for size in _HEADERS if size <= max(header_size, 20))
+        layout = _HEADERS[known]
+        headers = layout.iter_unpack(b''.join(buffer[start:start + layout.size] for start, _ in payloads))
+        for (start, end), header in zip(payloads, headers):
+            lid = header[4] if known >= 24 else 0
+            uid = header[5] if known >= 28 else -1
+            payload = buffer[start + header_size:end]
+            tag_end = payload.find(b'\0', 1)
+            if tag_end < 0:
+                tag_end = len(payload)
+            records.append(LogRecord(header[0], header[1], header[2], header[3], lid, uid,
+                                     payload[0] if payload else 0,
+                                     payload[1:tag_end].decode('utf-8', 'replace'),
+                                     payload[tag_end + 1:].rstrip(b'\0').decode('utf-8', 'replace')))
+
+
+def build_command(tags: Union[Iterable[str], Dict[str, Union[int, str]]] = None, priority: Union[int, str] = None,
+                  pid: int = None, buffers: Iterable[str] = None, dump: bool = False) -> str:
+    args = ['logcat', '-B']
+    if dump:
+        args.append('-d')
+    for buffer in buffers or ():
+        args.extend(['-b', buffer])
+    if pid is not None:
+        args.append('--pid={}'.format(int(pid)))
+    if tags:
+        levels = tags if isinstance(tags, dict) else {tag: priority or Priority.VERBOSE for tag in tags}
+        args.extend(cmd_quote('{}:{}'.format(tag, Priority.letter(level))) for tag, level in levels.items())
+        args.append("'*:S'")
+    elif priority is not None:
+        args.append("'*:{}'".format(Priority.letter(priority)))
+    return ' '.join(args)
@@ -0,0 +1,177 @@
+import bisect
+import time
+from typing import Dict, List, Optional, Tuple
+
+# seconds, roughly the spread between a local emulator and a busy usb hub
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# request hooks get every finished RequestRecord, slow pipeline hooks get (record, pipeline, elapsed);
+# with no hooks installed the client does not even allocate a record
+request_hooks = []
+slow_pipeline_hooks = []
+slow_pipeline_threshold: Optional[float] = None
+
+
+def enabled() -> bool:
+    return bool(request_hooks)
+
+
+def add_hook(callback):
+    request_hooks.append(callback)
+
+
+def remove_hook(callback):
+    if callback in request_hooks:
+        request_hooks.remove(callback)
+
+
+def watch_pipelines(threshold: Optional[float], callback=None):
+    # flags pipeline callbacks holding the event loop for longer than threshold seconds, None turns it off
+    global slow_pipeline_threshold
+    slow_pipeline_threshold = threshold
+    slow_pipeline_hooks.clear()
+    if threshold is not None and callback is not None:
+        slow_pipeline_hooks.append(callback)
+
+
+def service_kind(request: str) -> str:
+    # 'shell:ls' -> 'shell', 'host-serial:emulator-5554:features' -> 'host-serial'
+    return request.split(':', 1)[0]
+
+
+class RequestRecord(object):
+    __slots__ = ('serial', 'service', 'started', 'connect_time', 'handshake_time', 'first_byte_time',
+                 'duration', 'bytes_in', 'bytes_out', 'lines', 'outcome', 'error', 'handshake_done',
+                 'handshake_bytes')
+
+    def __init__(self, serial: str = None):
+        self.serial = serial
+        self.service = ''
+        self.started = time.perf_counter()
+        self.connect_time = None
+        self.handshake_time = 0.0
+        self.first_byte_time = None
+        self.duration = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.lines = 0
+        self.outcome = None
+        self.error = None
+        self.handshake_done = False
+        self.handshake_bytes = 0
+
+    @property
+    def kind(self) -> str:
+        return service_kind(self.service)
+
+    def received(self, size: int):
+        self.bytes_in += size
+        if self.first_byte_time is None and self.handshake_done:
+            self.first_byte_time = time.perf_counter() - self.started
+
+    def handshake(self, request: str, elapsed: float):
+        # payload that came in the same segment as the OKAY counts as arriving with it
+        self.handshake_time += elapsed
+        self.handshake_bytes += 4
+        if not request.startswith('host:transport:'):
+            self.handshake_done = True
+            if self.first_byte_time is None and self.bytes_in > self.handshake_bytes:
+                self.first_byte_time = time.perf_counter() - self.started
+
+    def finish(self, outcome: str, error: BaseException = None):
+        self.duration = time.perf_counter() - self.started
+        self.outcome = outcome
+        self.error = None if error is None else '{}: {}'.format(type(error).__name__, error)
+        for hook in request_hooks:
+            hook(self)
+
+    def __repr__(self):
+        return '<RequestRecord {} {} {} {:.6f}s in={} out={}>'.format(
+            self.serial, self.service, self.outcome, self.duration or 0.0, self.bytes_in, self.bytes_out)
+
+
+def slow_pipeline(record: Optional[RequestRecord], pipeline, elapsed: float):
+    for hook in slow_pipeline_hooks:
+        hook(record, pipeline, elapsed)
+
+
+class Histogram(object):
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry(object):
+    # aggregates records per service kind and renders them in the Prometheus text format;
+    # install with add_hook(registry.observe)
+
+    HISTOGRAMS = (
+        ('aadb_connect_seconds', 'Time to obtain a server connection', 'connect_time'),
+        ('aadb_handshake_seconds', 'Time spent in transport and service requests', 'handshake_time'),
+        ('aadb_first_byte_seconds', 'Time from the start of a request to its first payload byte', 'first_byte_time'),
+        ('aadb_request_seconds', 'Total request duration', 'duration'),
+    )
+    COUNTERS = (
+        ('aadb_bytes_in_total', 'Bytes received', 'bytes_in'),
+        ('aadb_bytes_out_total', 'Bytes sent', 'bytes_out'),
+        ('aadb_lines_total', 'Lines handed to pipelines', 'lines'),
+    )
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.histograms: Dict[Tuple[str, str], Histogram] = {}
+        self.counters: Dict[Tuple[str, str], float] = {}
+        self.outcomes: Dict[Tuple[str, str], int] = {}
+
+    def observe(self, record: RequestRecord):
+        kind = record.kind
+        for name, _, field in self.HISTOGRAMS:
+            value = getattr(record, field)
+            if value is not None:
+                key = (name, kind)
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram(self.buckets)
+                self.histograms[key].observe(value)
+        for name, _, field in self.COUNTERS:
+            self.counters[(name, kind)] = self.counters.get((name, kind), 0) + getattr(record, field)
+        key = (kind, record.outcome)
+        self.outcomes[key] = self.outcomes.get(key, 0) + 1
+
+    def export(self) -> str:
+        lines: List[str] = []
+        for name, help_text, _ in self.HISTOGRAMS:
+            series = sorted((kind, histogram) for (metric, kind), histogram in self.histograms.items()
+                            if metric == name)
+            if not series:
+                continue
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} histogram'.format(name))
+            for kind, histogram in series:
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append('{}_bucket{{service="{}",le="{}"}} {}'.format(name, kind, le, cumulative))
+                lines.append('{}_sum{{service="{}"}} {}'.format(name, kind, repr(histogram.sum)))
+                lines.append('{}_count{{service="{}"}} {}'.format(name, kind, histogram.count))
+        for name, help_text, _ in self.COUNTERS:
+            series = sorted((kind, value) for (metric, kind), value in self.counters.items() if metric == name)
+            if not series:
+                continue
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} counter'.format(name))
+            lines.extend('{}{{service="{}"}} {}'.format(name, kind, value) for kind, value in series)
+        if self.outcomes:
+            lines.append('# HELP aadb_requests_total Finished requests by outcome')
+            lines.append('# TYPE aadb_requests_total counter')
+            lines.extend('aadb_requests_total{{service="{}",outcome="{}"}} {}'.format(kind, outcome, count)
+                         for (kind, outcome), count in sorted(self.outcomes.items()))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,123 @@
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+import aadb
+from aadb import events
+from aadb.transport import Client
+
+
+class ConnectionPool(object):
+    # adb server sockets are consumed by the service they carry, so the pool keeps
+    # pre-connected (and optionally pre-bound to a device transport) sockets warm
+    # and refills them in the background instead of taking sockets back.
+
+    def __init__(self, host: str = None, port: int = None, size: int = 4, max_size: int = 64,
+                 idle_timeout: float = 30.0):
+        self.host = aadb.inner_host if host is None else host
+        self.port = aadb.inner_port if port is None else port
+        self.size = size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # background refills that failed, the last failure is kept in error
+        self.refill_errors = 0
+        self.error: Optional[BaseException] = None
+        self._idle: Dict[Optional[str], Deque[Tuple[float, Client]]] = {}
+        self._refilling = set()
+        self._tasks = set()
+        self._closed = False
+
+    def __len__(self):
+        return sum(len(idle) for idle in self._idle.values())
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'idle': len(self),
+                'refill_errors': self.refill_errors}
+
+    @staticmethod
+    def _healthy(client: Client) -> bool:
+        return client.transport is not None and not client.transport.is_closing() and not client.reader.at_eof()
+
+    @staticmethod
+    def _discard(client: Client):
+        if client.transport is not None:
+            client.transport.close()
+
+    def _evict_idle(self):
+        deadline = time.monotonic() - self.idle_timeout
+        for idle in self._idle.values():
+            while idle and idle[0][0] < deadline:
+                self._discard(idle.popleft()[1])
+                self.evictions += 1
+
+    async def _open(self, serial: str = None) -> Client:
+        client = Client()
+        client.host, client.port = self.host, self.port
+        await client.connect()
+        if serial is not None:
+            try:
+                await client.bind(serial)
+            except BaseException:
+                self._discard(client)
+                raise
+        return client
+
+    async def acquire(self, serial: str = None) -> Client:
+        self._evict_idle()
+        idle = self._idle.get(serial)
+        while idle:
+            _, client = idle.pop()
+            if self._healthy(client):
+                self.hits += 1
+                self._schedule_refill(serial)
+                return client
+            self._discard(client)
+            self.evictions += 1
+
+        self.misses += 1
+        self._schedule_refill(serial)
+        # left unbound, the borrowing Client binds it and so records the transport handshake
+        return await self._open()
+
+    async def warm(self, serial: str = None, count: int = None):
+        count = self.size if count is None else count
+        idle = self._idle.setdefault(serial, deque())
+        while not self._closed and len(idle) < count and len(self) < self.max_size:
+            client = await self._open(serial)
+            if self._closed:
+                self._discard(client)
+                break
+            idle.append((time.monotonic(), client))
+
+    def _schedule_refill(self, serial: str = None):
+        if self._closed or self.size <= 0 or serial in self._refilling:
+            return
+
+        async def refill():
+            try:
+                await self.warm(serial)
+            except (ConnectionError, OSError) as e:
+                self.refill_errors += 1
+                self.error = e
+            finally:
+                self._refilling.discard(serial)
+
+        self._refilling.add(serial)
+        task = events.get_event_loop().create_task(refill())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def close(self):
+        self._closed = True
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        for idle in self._idle.values():
+            while idle:
+                self._discard(idle.popleft()[1])
+        self._idle.clear()
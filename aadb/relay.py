@@ -0,0 +1,128 @@
+import asyncio
+import time
+from typing import NamedTuple
+
+from aadb.transport import Client
+
+# per direction and connection; StreamReader pauses the socket at twice this
+RELAY_BUFFER_SIZE = 1 << 18
+
+
+class TunnelStats(NamedTuple):
+    connections: int
+    active: int
+    failed: int
+    bytes_up: int
+    bytes_down: int
+    # bytes/s since the previous stats() call, or since the start for the first one
+    up_rate: float
+    down_rate: float
+
+
+class Relay(object):
+    # an in-process forward: every local connection gets its own device stream (tcp:, localabstract:
+    # or anything else adbd can open) and the two are spliced; a full socket on either side stops the
+    # reads on the other, so backpressure reaches both peers
+
+    def __init__(self, serial: str, remote: str, host: str = '127.0.0.1', port: int = 0, pool=None,
+                 buffer_size: int = RELAY_BUFFER_SIZE):
+        self.serial = serial
+        self.remote = remote
+        self.host = host
+        self.port = port
+        self.pool = pool
+        self.buffer_size = buffer_size
+        self.connections = 0
+        self.active = 0
+        self.failed = 0
+        self.bytes_up = 0
+        self.bytes_down = 0
+        self._server = None
+        self._tasks = set()
+        self._sampled = (time.monotonic(), 0, 0)
+
+    async def __aenter__(self):
+        return self if self._server is not None else await self.start()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def start(self) -> 'Relay':
+        self._server = await asyncio.start_server(self._accept, self.host, self.port, limit=self.buffer_size)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._sampled = (time.monotonic(), 0, 0)
+        return self
+
+    def stats(self) -> TunnelStats:
+        now = time.monotonic()
+        then, up, down = self._sampled
+        elapsed = max(now - then, 1e-9)
+        self._sampled = (now, self.bytes_up, self.bytes_down)
+        return TunnelStats(self.connections, self.active, self.failed, self.bytes_up, self.bytes_down,
+                           (self.bytes_up - up) / elapsed, (self.bytes_down - down) / elapsed)
+
+    async def _accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        self.connections += 1
+        self.active += 1
+        try:
+            async with Client(self.serial, self.pool) as client:
+                await client.call(self.remote)
+                up = asyncio.ensure_future(self._splice(reader, client.writer, True))
+                down = asyncio.ensure_future(self._splice(client.reader, writer, False))
+                try:
+                    await asyncio.wait([up, down], return_when=asyncio.FIRST_COMPLETED)
+                    # like adb's own forward: a half close from the local peer is passed on and the
+                    # answer may still be on its way, a closed device stream ends the connection
+                    if up.done() and up.exception() is None and _write_eof(client.writer):
+                        await down
+                finally:
+                    for pump in up, down:
+                        pump.cancel()
+                    await asyncio.gather(up, down, return_exceptions=True)
+                for pump in up, down:
+                    if not pump.cancelled() and pump.exception() is not None:
+                        raise pump.exception()
+        except (ConnectionError, OSError, asyncio.IncompleteReadError):
+            self.failed += 1
+        finally:
+            self.active -= 1
+            self._tasks.discard(task)
+            writer.close()
+
+    async def _splice(self, reader: asyncio.StreamReader, writer, up: bool):
+        # drain() blocks while the peer's socket is full, the reader stops reading meanwhile and
+        # the StreamReader pauses its socket once buffer_size * 2 is queued
+        while True:
+            data = await reader.read(self.buffer_size)
+            if not data:
+                break
+            writer.write(data)
+            if up:
+                self.bytes_up += len(data)
+            else:
+                self.bytes_down += len(data)
+            await writer.drain()
+
+    async def close(self):
+        if self._server is None:
+            return
+        self._server.close()
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._server.wait_closed()
+        self._server = None
+
+
+def _write_eof(writer) -> bool:
+    can_write_eof = getattr(writer, 'can_write_eof', None)
+    if can_write_eof is None or not can_write_eof():
+        return False
+    try:
+        writer.write_eof()
+    except OSError:
+        return False
+    return True
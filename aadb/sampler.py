@@ -0,0 +1,278 @@
+import asyncio
+import re
+import time
+import warnings
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from aadb import events
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MEMORY_FIELDS = ('MemTotal', 'MemAvailable', 'MemFree', 'Cached', 'SwapFree')
+GFX_PERCENTILES = ('50', '90', '95', '99')
+
+
+def _need_numpy():
+    if np is None:
+        raise RuntimeError('the sampler needs the numpy package')
+
+
+class RingBuffer(object):
+    # the last capacity rows of a metric, each with its timestamp; appending overwrites in place
+
+    def __init__(self, capacity: int, columns: Sequence[str]):
+        _need_numpy()
+        self.capacity = capacity
+        self.columns = list(columns)
+        self.times = np.zeros(capacity)
+        self.data = np.full((capacity, len(self.columns)), np.nan)
+        self.head = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp: float, values):
+        self.times[self.head] = timestamp
+        self.data[self.head] = values
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def ordered(self) -> Tuple['np.ndarray', 'np.ndarray']:
+        # oldest first; views until the buffer has wrapped, a copy after that
+        if self.count < self.capacity:
+            return self.times[:self.count], self.data[:self.count]
+        return (np.concatenate((self.times[self.head:], self.times[:self.head])),
+                np.concatenate((self.data[self.head:], self.data[:self.head])))
+
+    def window(self, seconds: float = None) -> Tuple['np.ndarray', 'np.ndarray']:
+        # the rows of the last seconds before the newest one, everything without seconds
+        times, data = self.ordered()
+        if seconds is None or not len(times):
+            return times, data
+        start = np.searchsorted(times, times[-1] - seconds, side='left')
+        return times[start:], data[start:]
+
+    def mean(self, seconds: float = None) -> Dict[str, float]:
+        return self._aggregate(np.nanmean, seconds)
+
+    def percentile(self, q: float, seconds: float = None) -> Dict[str, float]:
+        return self._aggregate(lambda data, axis: np.nanpercentile(data, q, axis=axis), seconds)
+
+    def p95(self, seconds: float = None) -> Dict[str, float]:
+        return self.percentile(95, seconds)
+
+    def _aggregate(self, func, seconds: float) -> Dict[str, float]:
+        _, data = self.window(seconds)
+        if not len(data):
+            return {column: float('nan') for column in self.columns}
+        with warnings.catch_warnings():
+            # a column the device never reported is all nan and stays nan
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return dict(zip(self.columns, (float(value) for value in func(data, axis=0))))
+
+
+def parse_proc_stat(text: str) -> 'np.ndarray':
+    # jiffies of the cpu lines, the aggregate first then one row per core: user nice system idle iowait ...
+    rows = [line.split()[1:8] for line in text.splitlines() if line.startswith('cpu')]
+    return np.array(rows, dtype=np.int64)
+
+
+def cpu_usage(previous: 'np.ndarray', current: 'np.ndarray') -> 'np.ndarray':
+    # busy fraction per row between two /proc/stat readings, idle and iowait count as idle
+    delta = (current - previous).astype(np.float64)
+    total = delta.sum(axis=1)
+    idle = delta[:, 3] + delta[:, 4]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(total > 0, 1.0 - idle / total, np.nan)
+
+
+def parse_meminfo(text: str) -> 'np.ndarray':
+    # MEMORY_FIELDS in kB, nan where the kernel doesn't report one
+    values = dict(re.findall(r'^(\w+):\s+(\d+)', text, re.M))
+    return np.array([float(values.get(field, 'nan')) for field in MEMORY_FIELDS])
+
+
+def parse_pid_stat(text: str) -> Tuple[int, int]:
+    # (utime + stime jiffies, rss pages) of /proc/<pid>/stat; comm may hold spaces and parentheses
+    fields = text[text.rindex(')') + 2:].split()
+    return int(fields[11]) + int(fields[12]), int(fields[21])
+
+
+def parse_gfxinfo(text: str) -> 'np.ndarray':
+    # total frames, janky frames and the frame time percentiles in ms
+    frames = re.search(r'Total frames rendered: (\d+)', text)
+    janky = re.search(r'Janky frames: (\d+)', text)
+    percentiles = dict(re.findall(r'(\d+)th percentile: (\d+)ms', text))
+    return np.array([float(frames.group(1)) if frames else np.nan, float(janky.group(1)) if janky else np.nan] +
+                    [float(percentiles.get(p, 'nan')) for p in GFX_PERCENTILES])
+
+
+def parse_battery(text: str) -> 'np.ndarray':
+    # level %, temperature in degrees and voltage in volts from `dumpsys battery`
+    values = dict(re.findall(r'^\s*(level|temperature|voltage): (-?\d+)', text, re.M))
+    return np.array([float(values.get('level', 'nan')), float(values.get('temperature', 'nan')) / 10,
+                     float(values.get('voltage', 'nan')) / 1000])
+
+
+class Sampler(object):
+    # polls one device every interval seconds over its persistent shell session (Device.session), the
+    # commands of a tick are pipelined together; every metric lands in a RingBuffer of capacity rows.
+    # Metrics: 'cpu' (total and per core), 'memory', 'battery', 'process:<package>' and 'gfx:<package>'
+
+    def __init__(self, device, interval: float = 1.0, capacity: int = 3600, packages: Iterable[str] = (),
+                 gfx: bool = True, battery: bool = True, page_size: int = 4096):
+        _need_numpy()
+        self.device = device
+        self.interval = interval
+        self.capacity = capacity
+        self.packages = list(packages)
+        self.gfx = gfx
+        self.battery = battery
+        self.page_size = page_size
+        self.buffers: Dict[str, RingBuffer] = {}
+        self.samples = 0
+        self.errors = 0
+        self.error: Optional[BaseException] = None
+        self._cpu: Optional[Tuple[float, 'np.ndarray']] = None
+        self._processes: Dict[str, Tuple[int, int]] = {}
+        self._frames: Dict[str, Tuple[float, 'np.ndarray']] = {}
+        self._task = None
+
+    async def __aenter__(self):
+        return self.start()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.stop()
+
+    def _append(self, metric: str, columns: Sequence[str], timestamp: float, values):
+        if metric not in self.buffers:
+            self.buffers[metric] = RingBuffer(self.capacity, columns)
+        self.buffers[metric].append(timestamp, values)
+
+    async def _read(self, command: str) -> Optional[str]:
+        result = await self.device.session().run(command)
+        return result.output if result.success else None
+
+    async def sample(self) -> float:
+        # one tick, returns its timestamp
+        commands = ['cat /proc/stat', 'cat /proc/meminfo']
+        if self.battery:
+            commands.append('dumpsys battery')
+        for package in self.packages:
+            commands.append('pidof {}'.format(package))
+            if self.gfx:
+                commands.append('dumpsys gfxinfo {}'.format(package))
+        outputs = dict(zip(commands, await asyncio.gather(*[self._read(command) for command in commands])))
+        timestamp = time.time()
+
+        # a command that failed leaves its metric out of this tick, the counters of the last good
+        # /proc/stat stay as the base of the next cpu delta
+        busy_jiffies = None
+        if outputs['cat /proc/stat']:
+            jiffies = parse_proc_stat(outputs['cat /proc/stat'])
+            if self._cpu is not None and self._cpu[1].shape == jiffies.shape:
+                usage = cpu_usage(self._cpu[1], jiffies)
+                self._append('cpu', ['total'] + ['cpu{}'.format(i) for i in range(len(usage) - 1)], timestamp,
+                             usage)
+                # jiffies of one core over the interval, what a fully busy single thread would use
+                busy_jiffies = float((jiffies[0] - self._cpu[1][0]).sum()) / max(len(jiffies) - 1, 1)
+            self._cpu = timestamp, jiffies
+        if outputs['cat /proc/meminfo']:
+            self._append('memory', MEMORY_FIELDS, timestamp, parse_meminfo(outputs['cat /proc/meminfo']))
+        if self.battery and outputs['dumpsys battery']:
+            self._append('battery', ('level', 'temperature', 'voltage'), timestamp,
+                         parse_battery(outputs['dumpsys battery']))
+
+        pids = {package: (outputs['pidof {}'.format(package)] or '').split()[:1] for package in self.packages}
+        stats = await asyncio.gather(*[self._read('cat /proc/{}/stat'.format(pid[0])) if pid else _none()
+                                       for pid in pids.values()])
+        for package, pid, stat in zip(self.packages, pids.values(), stats):
+            self._sample_process(package, pid[0] if pid else None, stat, busy_jiffies, timestamp)
+            if self.gfx:
+                self._sample_gfx(package, outputs['dumpsys gfxinfo {}'.format(package)], timestamp)
+        self.samples += 1
+        return timestamp
+
+    def _sample_process(self, package: str, pid: Optional[str], stat: Optional[str], busy_jiffies: Optional[float],
+                        timestamp: float):
+        if pid is None or not stat:
+            self._processes.pop(package, None)
+            return
+        used, rss = parse_pid_stat(stat)
+        previous = self._processes.get(package)
+        self._processes[package] = int(pid), used
+        cpu = np.nan
+        if previous is not None and previous[0] == int(pid) and busy_jiffies:
+            cpu = (used - previous[1]) / busy_jiffies
+        self._append('process:{}'.format(package), ('pid', 'cpu', 'rss_kb'), timestamp,
+                     (int(pid), cpu, rss * self.page_size / 1024))
+
+    def _sample_gfx(self, package: str, text: Optional[str], timestamp: float):
+        if not text:
+            return
+        values = parse_gfxinfo(text)
+        previous = self._frames.get(package)
+        self._frames[package] = timestamp, values
+        fps = janky = np.nan
+        if previous is not None and values[0] >= previous[1][0]:
+            frames = values[0] - previous[1][0]
+            fps = frames / max(timestamp - previous[0], 1e-9)
+            janky = (values[1] - previous[1][1]) / frames if frames else 0.0
+        self._append('gfx:{}'.format(package), ('fps', 'janky') + tuple('p' + p for p in GFX_PERCENTILES),
+                     timestamp, np.concatenate(([fps, janky], values[2:])))
+
+    def start(self) -> 'Sampler':
+        if self._task is None or self._task.done():
+            self._task = events.get_event_loop().create_task(self._run())
+        return self
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            try:
+                await self.sample()
+            except Exception as e:
+                # a tick lost to a respawning session or odd output, the next one carries on
+                self.errors += 1
+                self.error = e
+            await asyncio.sleep(max(self.interval - (time.monotonic() - started), 0))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def mean(self, metric: str, seconds: float = None) -> Dict[str, float]:
+        return self.buffers[metric].mean(seconds)
+
+    def p95(self, metric: str, seconds: float = None) -> Dict[str, float]:
+        return self.buffers[metric].p95(seconds)
+
+    def export(self, path: str):
+        export([self], path)
+
+
+async def _none():
+    return None
+
+
+def export(samplers: List[Sampler], path: str):
+    # one .npz with a column per array: '<serial>/<metric>/time' and '<serial>/<metric>/<column>'
+    _need_numpy()
+    arrays = {}
+    for sampler in samplers:
+        for metric, buffer in sampler.buffers.items():
+            times, data = buffer.ordered()
+            prefix = '{}/{}/'.format(sampler.device.serial, metric)
+            arrays[prefix + 'time'] = times
+            for index, column in enumerate(buffer.columns):
+                arrays[prefix + column] = data[:, index]
+    np.savez_compressed(path, **arrays)
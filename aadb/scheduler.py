@@ -0,0 +1,165 @@
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Iterable, List, NamedTuple, Optional
+
+from aadb.sync import PullResult, PushResult, SyncSession
+
+
+class Order(object):
+    LARGEST = 'largest'
+    BUCKETS = 'buckets'
+    NONE = 'none'
+
+
+class TransferJob(NamedTuple):
+    src: str
+    dest: str
+    size: int
+
+
+class TransferProgress(NamedTuple):
+    done_files: int
+    total_files: int
+    done_bytes: int
+    total_bytes: int
+    rate: float
+    eta: Optional[float]
+
+
+def order_jobs(jobs: Iterable[TransferJob], order: str = Order.LARGEST) -> List[TransferJob]:
+    # largest first keeps a big file from starting last and leaving the other sessions idle;
+    # buckets take one file of every size class in turn so small files ride alongside the bulk ones
+    if order == Order.NONE:
+        return list(jobs)
+    ordered = sorted(jobs, key=lambda job: job.size, reverse=True)
+    if order == Order.LARGEST:
+        return ordered
+    if order != Order.BUCKETS:
+        raise ValueError('unknown transfer order {}'.format(order))
+
+    buckets = {}
+    for job in ordered:
+        # size classes are powers of 16
+        buckets.setdefault(job.size.bit_length() // 4, deque()).append(job)
+    queues = [buckets[size_class] for size_class in sorted(buckets, reverse=True)]
+    interleaved = []
+    while queues:
+        for queue in queues:
+            interleaved.append(queue.popleft())
+        queues = [queue for queue in queues if queue]
+    return interleaved
+
+
+class _Progress(object):
+
+    def __init__(self, jobs: List[TransferJob], progress_func, interval: float):
+        self.progress_func = progress_func
+        self.interval = interval
+        self.total_files = len(jobs)
+        self.total_bytes = sum(job.size for job in jobs)
+        self.done_files = 0
+        self.done_bytes = 0
+        self.started = time.monotonic()
+        self._reported = 0.0
+
+    def snapshot(self) -> TransferProgress:
+        elapsed = time.monotonic() - self.started
+        rate = self.done_bytes / elapsed if elapsed > 0 else 0.0
+        eta = (self.total_bytes - self.done_bytes) / rate if rate else None
+        return TransferProgress(self.done_files, self.total_files, self.done_bytes, self.total_bytes, rate, eta)
+
+    def add(self, size: int, finished: bool = False):
+        self.done_bytes += size
+        if finished:
+            self.done_files += 1
+        if self.progress_func is None:
+            return
+        now = time.monotonic()
+        if finished or now - self._reported >= self.interval:
+            self._reported = now
+            self.progress_func(self.snapshot())
+
+    def fail(self, job: TransferJob, transferred: int):
+        # what never made it is taken out of the total so the eta stays honest
+        self.total_bytes -= max(job.size - transferred, 0)
+        self.add(0, finished=True)
+
+
+class TransferScheduler(object):
+    # spreads files over several sync sessions of one device, every session takes the next
+    # file off a shared queue as soon as it is done with the previous one
+
+    def __init__(self, serial: str, pool=None, compression: str = None, sessions: int = 4,
+                 order: str = Order.LARGEST, progress_func=None, interval: float = 0.1):
+        if sessions <= 0:
+            raise ValueError('sessions must be positive')
+        self.serial = serial
+        self.pool = pool
+        self.compression = compression
+        self.sessions = sessions
+        self.order = order
+        self.progress_func = progress_func
+        self.interval = interval
+
+    async def push(self, jobs: List[TransferJob], mode: int = 0o644) -> List[PushResult]:
+        async def push_file(session, job, on_bytes):
+            await session.push(job.src, job.dest, mode, lambda total_size, sent_size: on_bytes(sent_size))
+
+        outcomes = await self._run(jobs, push_file)
+        return [PushResult(job.src, job.dest, job.size if success else sent, success, error)
+                for job, (success, sent, error) in zip(jobs, outcomes)]
+
+    async def pull(self, jobs: List[TransferJob]) -> List[PullResult]:
+        async def pull_file(session, job, on_bytes):
+            try:
+                await session.pull_file(job.src, job.dest, progress_func=on_bytes)
+            except BaseException:
+                if os.path.exists(job.dest):
+                    os.remove(job.dest)
+                raise
+
+        outcomes = await self._run(jobs, pull_file)
+        return [PullResult(job.src, job.dest, job.size if success else received, success, error)
+                for job, (success, received, error) in zip(jobs, outcomes)]
+
+    async def _run(self, jobs: List[TransferJob], transfer):
+        # outcomes come back in the order of jobs whatever order they were scheduled in
+        outcomes = [None] * len(jobs)
+        progress = _Progress(jobs, self.progress_func, self.interval)
+        indexes = {id(job): index for index, job in enumerate(jobs)}
+        queue = deque((indexes[id(job)], job) for job in order_jobs(jobs, self.order))
+        workers = [self._worker(queue, transfer, outcomes, progress) for _ in range(min(self.sessions, len(jobs)))]
+        await asyncio.gather(*workers)
+        return outcomes
+
+    async def _worker(self, queue: deque, transfer, outcomes: list, progress: _Progress):
+        session = None
+        try:
+            while queue:
+                index, job = queue.popleft()
+                done = [0]
+
+                def on_bytes(size):
+                    progress.add(size - done[0])
+                    done[0] = size
+
+                try:
+                    if session is None:
+                        session = SyncSession(self.serial, self.pool, self.compression)
+                        await session.__aenter__()
+                    await transfer(session, job, on_bytes)
+                except (ConnectionError, asyncio.IncompleteReadError, OSError) as e:
+                    outcomes[index] = (False, done[0], str(e) or type(e).__name__)
+                    progress.fail(job, done[0])
+                    # adbd ends the sync session after a failure, the next file gets a new one
+                    if session is not None:
+                        await session.__aexit__(type(e), e, None)
+                        session = None
+                else:
+                    outcomes[index] = (True, job.size, None)
+                    progress.add(job.size - done[0], finished=True)
+        finally:
+            if session is not None:
+                await session.__aexit__(None, None, None)
@@ -0,0 +1,164 @@
+import asyncio
+import os
+from collections import deque
+from typing import NamedTuple
+
+from aadb import events
+from aadb.transport import Client
+
+try:
+    from shlex import quote as cmd_quote
+except ImportError:
+    from pipes import quote as cmd_quote
+
+SESSION_READ_SIZE = 1 << 16
+
+
+class ShellResult(NamedTuple):
+    command: str
+    output: str
+    exit_code: int
+
+    @property
+    def success(self) -> bool:
+        return self.exit_code == 0
+
+
+class ShellSession(object):
+    # one long-lived `sh` on the device running commands written to its stdin one after the other;
+    # every command is followed by a sentinel line carrying its exit code, so any number of them can
+    # be in flight and their results are matched up in order. A dead shell fails what was in flight
+    # and is respawned by the next run()
+
+    def __init__(self, serial: str, pool=None, service: str = 'exec:sh', encoding: str = 'utf-8'):
+        self.serial = serial
+        self.pool = pool
+        self.service = service
+        self.encoding = encoding
+        self.commands = 0
+        self.spawns = 0
+        self._token = None
+        self._sequence = 0
+        self._pending = deque()
+        self._writer = None
+        self._task = None
+        self._lock = asyncio.Lock()
+        self._closed = False
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    @property
+    def alive(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self) -> 'ShellSession':
+        self._closed = False
+        async with self._lock:
+            if not self.alive:
+                ready = events.get_event_loop().create_future()
+                self._task = events.get_event_loop().create_task(self._run(ready))
+                await ready
+        return self
+
+    async def run(self, command: str, timeout: float = None) -> ShellResult:
+        if self._closed:
+            raise ConnectionError('shell session is closed')
+        if self._writer is None:
+            await self.start()
+        self._sequence += 1
+        marker = '{}:{}'.format(self._token, self._sequence)
+        # stdin stays ours, the echo before the marker ends output that has no trailing newline
+        line = 'eval {} </dev/null 2>&1; __aadb=$?; echo; echo {} $__aadb\n'.format(cmd_quote(command), marker)
+        future = events.get_event_loop().create_future()
+        self._pending.append((('\n' + marker + ' ').encode('utf-8'), command, future))
+        self.commands += 1
+        writer = self._writer
+        writer.write(line.encode(self.encoding))
+        try:
+            await writer.drain()
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            # the command may still be running on the device, only a new shell gets rid of it
+            future.cancel()
+            await self._kill()
+            raise
+        return future.result()
+
+    async def check(self, command: str, timeout: float = None) -> str:
+        result = await self.run(command, timeout)
+        if not result.success:
+            raise RuntimeError('{} exited with {} - [{}]'.format(command, result.exit_code, result.output.strip()))
+        return result.output
+
+    async def _run(self, ready: asyncio.Future):
+        error = None
+        try:
+            async with Client(self.serial, self.pool) as client:
+                await client.call(self.service)
+                self._token = '__aadb_{}__'.format(os.urandom(8).hex())
+                self._writer = client.writer
+                self.spawns += 1
+                ready.set_result(True)
+                await self._receive(client.reader)
+        except asyncio.CancelledError:
+            error = ConnectionError('shell session was closed')
+            raise
+        except Exception as e:
+            error = e
+            if not ready.done():
+                ready.set_exception(e)
+        finally:
+            self._writer = None
+            if not ready.done():
+                ready.cancel()
+            self._fail(error or ConnectionError('shell session ended'))
+
+    async def _receive(self, reader: asyncio.StreamReader):
+        buffer = bytearray()
+        searched = 0
+        while True:
+            data = await reader.read(SESSION_READ_SIZE)
+            if not data:
+                return
+            buffer += data
+            while self._pending:
+                marker, command, future = self._pending[0]
+                found = buffer.find(marker, searched)
+                end = buffer.find(b'\n', found + len(marker)) if found >= 0 else -1
+                if end < 0:
+                    # a marker may be cut by the end of the buffer, search its tail again next time
+                    searched = max(0, len(buffer) - len(marker) - 32)
+                    break
+                self._pending.popleft()
+                exit_code = int(buffer[found + len(marker):end])
+                if not future.done():
+                    future.set_result(ShellResult(command, buffer[:found].decode(self.encoding, 'replace'), exit_code))
+                del buffer[:end + 1]
+                searched = 0
+
+    def _fail(self, error: BaseException):
+        while self._pending:
+            _, _, future = self._pending.popleft()
+            if not future.done():
+                future.set_exception(error)
+
+    async def _kill(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def close(self):
+        self._closed = True
+        await self._kill()
+        self._task = None
@@ -0,0 +1,378 @@
+import asyncio
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import aadb
+from aadb import events
+from aadb.adb import AndroidDebugBridge
+from aadb.pool import ConnectionPool
+
+# events of a stream are handed to the parent in lists of at most this many items
+SHARD_BATCH = 512
+
+
+class Mode(object):
+    # threads give every shard its own loop but share the GIL, processes scale with the cores
+    THREAD = 'thread'
+    PROCESS = 'process'
+
+
+class ShardEvent(NamedTuple):
+    shard: int
+    serial: str
+    stream: int
+    items: list
+
+
+class ShardStream(object):
+    # a running stream; `done` resolves with the device method's return value when it ends
+
+    def __init__(self, runtime: 'ShardedRuntime', stream_id: int, serial: str, shard: int, done: asyncio.Future):
+        self.runtime = runtime
+        self.id = stream_id
+        self.serial = serial
+        self.shard = shard
+        self.done = done
+
+    def __await__(self):
+        return self.done.__await__()
+
+    def cancel(self):
+        self.runtime._send(self.shard, ('cancel', self.id))
+
+
+class _Emitter(object):
+    # the pipeline of a streamed device method; items collected during one loop iteration leave
+    # the shard together, so a socket read costs one message rather than one per line
+
+    def __init__(self, reply, stream_id: int, serial: str, batch: int):
+        self.reply = reply
+        self.stream_id = stream_id
+        self.serial = serial
+        self.batch = batch
+        self.items = []
+        self.scheduled = False
+
+    def put(self, item):
+        if isinstance(item, list):
+            self.items.extend(item)
+        else:
+            self.items.append(item)
+        if len(self.items) >= self.batch:
+            self.flush()
+        elif not self.scheduled:
+            self.scheduled = True
+            events.get_event_loop().call_soon(self.flush)
+
+    def flush(self):
+        self.scheduled = False
+        if self.items:
+            items, self.items = self.items, []
+            self.reply(('events', self.stream_id, self.serial, items))
+
+
+class _Worker(object):
+    # runs inside a shard: executes device methods on the shard's own bridge and loop
+
+    def __init__(self, host: str, port: int, pool_size: int, reply, batch: int):
+        # not create_bridge(), which would repoint the module wide default server of every other thread
+        self.bridge = AndroidDebugBridge(ConnectionPool(host, port, size=pool_size))
+        self.reply = reply
+        self.batch = batch
+        self.tasks: Dict[int, asyncio.Task] = {}
+        self.closed = events.get_event_loop().create_future()
+
+    def handle(self, message: tuple):
+        kind = message[0]
+        if kind in ('call', 'stream'):
+            self.tasks[message[1]] = events.get_event_loop().create_task(self._run(*message))
+        elif kind == 'cancel' and message[1] in self.tasks:
+            self.tasks[message[1]].cancel()
+        elif kind == 'close':
+            events.get_event_loop().create_task(self._close())
+
+    async def _run(self, kind: str, request_id: int, serial: str, method: str, args: tuple, kwargs: dict):
+        emitter = None
+        try:
+            if kind == 'stream':
+                emitter = _Emitter(self.reply, request_id, serial, self.batch)
+                kwargs = dict(kwargs, pipeline=emitter.put)
+            result = await getattr(self.bridge._device(serial), method)(*args, **kwargs)
+            if emitter is not None:
+                emitter.flush()
+            self.reply(('result', request_id, result))
+        except asyncio.CancelledError:
+            if emitter is not None:
+                emitter.flush()
+            self.reply(('result', request_id, None))
+        except Exception as e:
+            self.reply(('error', request_id, e))
+        finally:
+            self.tasks.pop(request_id, None)
+
+    async def _close(self):
+        for task in list(self.tasks.values()):
+            task.cancel()
+        if self.tasks:
+            await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        await self.bridge.close()
+        self.reply(('closed',))
+        self.closed.set_result(True)
+
+
+def _serve(host: str, port: int, pool_size: int, batch: int, send, receive):
+    # body of a shard thread or process: its own loop, messages arrive through receive() on a helper thread
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    events.set_event_loop(loop)
+    worker = _Worker(host, port, pool_size, send, batch)
+
+    def pump():
+        while True:
+            try:
+                message = receive()
+            except (EOFError, OSError):
+                message = ('close',)
+            loop.call_soon_threadsafe(worker.handle, message)
+            if message[0] == 'close':
+                return
+
+    threading.Thread(target=pump, daemon=True).start()
+    try:
+        loop.run_until_complete(worker.closed)
+    finally:
+        loop.close()
+
+
+def _serve_process(host: str, port: int, pool_size: int, batch: int, connection):
+    lock = threading.Lock()
+
+    def send(message):
+        try:
+            with lock:
+                connection.send(message)
+        except Exception as e:
+            # results that can't be pickled still come back as an error
+            if message[0] != 'result':
+                raise
+            with lock:
+                connection.send(('error', message[1], RuntimeError('unpicklable result: {!r}'.format(e))))
+
+    _serve(host, port, pool_size, batch, send, connection.recv)
+
+
+class _ThreadShard(object):
+
+    def __init__(self, index: int, runtime: 'ShardedRuntime'):
+        self.index = index
+        self.runtime = runtime
+        self.inbox = queue.SimpleQueue()
+        self.thread = threading.Thread(target=_serve, name='aadb-shard-{}'.format(index), daemon=True,
+                                       args=(runtime.host, runtime.port, runtime.pool_size, runtime.batch,
+                                             self._reply, self.inbox.get))
+
+    def start(self):
+        self.thread.start()
+
+    def _reply(self, message):
+        self.runtime._loop.call_soon_threadsafe(self.runtime._on_message, self.index, message)
+
+    def send(self, message):
+        self.inbox.put(message)
+
+    def join(self, timeout: float = None):
+        self.thread.join(timeout)
+
+
+class _ProcessShard(object):
+
+    def __init__(self, index: int, runtime: 'ShardedRuntime', context):
+        self.index = index
+        self.runtime = runtime
+        self.connection, self._child = context.Pipe()
+        self.process = context.Process(target=_serve_process, name='aadb-shard-{}'.format(index), daemon=True,
+                                       args=(runtime.host, runtime.port, runtime.pool_size, runtime.batch,
+                                             self._child))
+        self.reader = threading.Thread(target=self._pump, daemon=True)
+        self._lock = threading.Lock()
+
+    def start(self):
+        self.process.start()
+        # only the child holds its end now, so its exit reads as EOF here
+        self._child.close()
+        self.reader.start()
+
+    def _pump(self):
+        while True:
+            try:
+                message = self.connection.recv()
+            except (EOFError, OSError):
+                message = ('closed',)
+            self.runtime._loop.call_soon_threadsafe(self.runtime._on_message, self.index, message)
+            if message[0] == 'closed':
+                return
+
+    def send(self, message):
+        with self._lock:
+            self.connection.send(message)
+
+    def join(self, timeout: float = None):
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.connection.close()
+
+
+class ShardedRuntime(object):
+    # devices partitioned over N shards, each a thread or process with its own loop, bridge and
+    # clients; call() routes a Device method to the shard owning the serial and stream() runs one
+    # with its pipeline output coming back through events(), merged from every shard
+
+    def __init__(self, serials: Iterable[str] = (), shards: int = None, mode: str = Mode.PROCESS,
+                 host: str = None, port: int = None, pool_size: int = 0, batch: int = SHARD_BATCH,
+                 start_method: str = 'spawn'):
+        if mode not in (Mode.THREAD, Mode.PROCESS):
+            raise ValueError('unknown shard mode {}'.format(mode))
+        self.mode = mode
+        self.shards = shards or os.cpu_count() or 1
+        self.host = (aadb.inner_host or '127.0.0.1') if host is None else host
+        self.port = (aadb.inner_port or 5037) if port is None else port
+        self.pool_size = pool_size
+        self.batch = batch
+        self.start_method = start_method
+        self.owners: Dict[str, int] = {}
+        self._workers: List[Any] = []
+        self._ids = itertools.count(1)
+        # request id -> (shard, future)
+        self._futures: Dict[int, Tuple[int, asyncio.Future]] = {}
+        self._closing: Dict[int, asyncio.Future] = {}
+        self._events: Optional[asyncio.Queue] = None
+        self._loop = None
+        for serial in serials:
+            self.add(serial)
+
+    async def __aenter__(self):
+        return self.start()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def __len__(self):
+        return len(self.owners)
+
+    def add(self, serial: str) -> int:
+        # a new serial goes to the shard owning the fewest
+        if serial not in self.owners:
+            load = [0] * self.shards
+            for index in self.owners.values():
+                load[index] += 1
+            self.owners[serial] = load.index(min(load))
+        return self.owners[serial]
+
+    def remove(self, serial: str):
+        self.owners.pop(serial, None)
+
+    def serials(self, shard: int) -> List[str]:
+        return [serial for serial, index in self.owners.items() if index == shard]
+
+    def start(self) -> 'ShardedRuntime':
+        if self._workers:
+            return self
+        self._loop = events.get_event_loop()
+        self._events = asyncio.Queue()
+        if self.mode == Mode.THREAD:
+            self._workers = [_ThreadShard(index, self) for index in range(self.shards)]
+        else:
+            context = multiprocessing.get_context(self.start_method)
+            self._workers = [_ProcessShard(index, self, context) for index in range(self.shards)]
+        for worker in self._workers:
+            worker.start()
+        return self
+
+    def _send(self, shard: int, message: tuple):
+        if not self._workers:
+            raise RuntimeError('sharded runtime is not running')
+        self._workers[shard].send(message)
+
+    def _request(self, kind: str, serial: str, method: str, args: tuple, kwargs: dict):
+        if serial not in self.owners:
+            raise KeyError('{} is not assigned to a shard'.format(serial))
+        request_id = next(self._ids)
+        future = self._loop.create_future()
+        self._futures[request_id] = (self.owners[serial], future)
+        try:
+            self._send(self.owners[serial], (kind, request_id, serial, method, args, kwargs))
+        except BaseException:
+            del self._futures[request_id]
+            raise
+        return request_id, future
+
+    async def call(self, serial: str, method: str, *args, **kwargs):
+        # the Device method of the owning shard; in process mode arguments and result are pickled
+        _, future = self._request('call', serial, method, args, kwargs)
+        return await future
+
+    async def call_all(self, method: str, *args, **kwargs) -> Dict[str, Any]:
+        # every serial, a failure is returned as its exception
+        serials = list(self.owners)
+        results = await asyncio.gather(*[self.call(serial, method, *args, **kwargs) for serial in serials],
+                                       return_exceptions=True)
+        return dict(zip(serials, results))
+
+    def stream(self, serial: str, method: str, *args, **kwargs) -> ShardStream:
+        # a Device method taking a `pipeline` (shell, logcat, logcat_records...) whose items
+        # arrive as ShardEvent batches in events()
+        request_id, future = self._request('stream', serial, method, args, kwargs)
+        return ShardStream(self, request_id, serial, self.owners[serial], future)
+
+    async def events(self):
+        while True:
+            event = await self._events.get()
+            if event is None:
+                return
+            yield event
+
+    def _on_message(self, shard: int, message: tuple):
+        kind = message[0]
+        if kind == 'events':
+            self._events.put_nowait(ShardEvent(shard, message[2], message[1], message[3]))
+        elif kind in ('result', 'error'):
+            _, future = self._futures.pop(message[1], (None, None))
+            if future is not None and not future.done():
+                if kind == 'result':
+                    future.set_result(message[2])
+                else:
+                    future.set_exception(message[2])
+        elif kind == 'closed':
+            closing = self._closing.get(shard)
+            if closing is not None and not closing.done():
+                closing.set_result(True)
+            # a shard that went away on its own takes its requests with it
+            for request_id, (owner, future) in list(self._futures.items()):
+                if owner == shard:
+                    del self._futures[request_id]
+                    if not future.done():
+                        future.set_exception(ConnectionError('shard {} exited'.format(shard)))
+
+    async def close(self, timeout: float = 10.0):
+        if not self._workers:
+            return
+        workers, self._workers = self._workers, []
+        for index, worker in enumerate(workers):
+            self._closing[index] = self._loop.create_future()
+            try:
+                worker.send(('close',))
+            except (OSError, EOFError):
+                self._closing[index].set_result(False)
+        await asyncio.wait(list(self._closing.values()), timeout=timeout)
+        await self._loop.run_in_executor(None, lambda: [worker.join(timeout) for worker in workers])
+        for _, future in self._futures.values():
+            if not future.done():
+                future.set_exception(ConnectionError('sharded runtime closed'))
+        self._futures.clear()
+        self._closing.clear()
+        self._events.put_nowait(None)
@@ -0,0 +1,122 @@
+import asyncio
+from collections import deque
+
+from aadb import events
+from aadb.transport import Client
+
+
+class Overflow(object):
+    BLOCK = 'block'
+    DROP_OLDEST = 'drop-oldest'
+    DROP_NEWEST = 'drop-newest'
+
+
+class LineStream(object):
+    # lines of a device service behind a bounded buffer; with Overflow.BLOCK a full buffer
+    # stops the socket reads so the backpressure reaches adbd over TCP, the drop policies
+    # keep reading and count what they throw away
+
+    def __init__(self, serial: str, service: str, pool=None, maxsize: int = 1024, overflow: str = Overflow.BLOCK):
+        if overflow not in (Overflow.BLOCK, Overflow.DROP_OLDEST, Overflow.DROP_NEWEST):
+            raise ValueError('unknown overflow policy {}'.format(overflow))
+        if maxsize <= 0:
+            raise ValueError('maxsize must be positive')
+        self.serial = serial
+        self.service = service
+        self.pool = pool
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.received = 0
+        self.dropped = 0
+        self._lines = deque()
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._task = None
+        self._error = None
+        self._finished = False
+
+    def __len__(self):
+        return len(self._lines)
+
+    def start(self):
+        if self._task is None:
+            self._task = events.get_event_loop().create_task(self._run())
+        return self
+
+    async def __aenter__(self):
+        return self.start()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
+
+    def __aiter__(self):
+        # each async for gets a generator whose exit, a break or a cancelled consumer included, closes the stream
+        return self._iterate()
+
+    async def _iterate(self):
+        try:
+            while True:
+                try:
+                    line = await self.__anext__()
+                except StopAsyncIteration:
+                    return
+                yield line
+        finally:
+            await self.aclose()
+
+    async def __anext__(self):
+        self.start()
+        while not self._lines:
+            if self._finished:
+                if self._error is not None:
+                    error, self._error = self._error, None
+                    raise error
+                raise StopAsyncIteration
+            self._readable.clear()
+            await self._readable.wait()
+        line = self._lines.popleft()
+        self._writable.set()
+        return line
+
+    def _put(self, line):
+        self.received += 1
+        if len(self._lines) >= self.maxsize:
+            if self.overflow == Overflow.BLOCK:
+                return self._put_when_writable(line)
+            self.dropped += 1
+            if self.overflow == Overflow.DROP_NEWEST:
+                return
+            self._lines.popleft()
+        self._lines.append(line)
+        self._readable.set()
+
+    async def _put_when_writable(self, line):
+        while len(self._lines) >= self.maxsize:
+            self._writable.clear()
+            await self._writable.wait()
+        self._lines.append(line)
+        self._readable.set()
+
+    async def _run(self):
+        try:
+            async with Client(self.serial, self.pool) as client:
+                await client.call(self.service)
+                await client.receive_lines(self._put)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._error = e
+        finally:
+            self._finished = True
+            self._readable.set()
+
+    async def aclose(self):
+        self._finished = True
+        self._lines.clear()
+        self._readable.set()
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
@@ -0,0 +1,331 @@
+import asyncio
+import os
+import posixpath
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional, Tuple
+
+import aiofiles
+
+from aadb import compression as codec
+from aadb import events
+from aadb.transport import Client, Signal, Stats
+
+PULL_BUFFER_SIZE = 1 << 20
+SYNC_DATA_MAX = 65536
+
+
+def _write_all(fd: int, view: memoryview, offset: int):
+    while view:
+        if hasattr(os, 'pwrite'):
+            written = os.pwrite(fd, view, offset)
+        else:
+            os.lseek(fd, offset, os.SEEK_SET)
+            written = os.write(fd, view)
+        view = view[written:]
+        offset += written
+
+
+class PushResult(NamedTuple):
+    local: str
+    remote: str
+    size: int
+    success: bool
+    error: Optional[str] = None
+
+
+class PullResult(NamedTuple):
+    remote: str
+    local: str
+    size: int
+    success: bool
+    error: Optional[str] = None
+
+
+class DeltaReport(NamedTuple):
+    sent_files: int
+    sent_bytes: int
+    skipped_files: int
+    skipped_bytes: int
+    deleted: List[str]
+    results: List[PushResult]
+
+
+class SyncEntry(NamedTuple):
+    name: str
+    mode: int
+    size: int
+    mtime: int
+
+    @property
+    def exists(self) -> bool:
+        return self.mode != 0
+
+    @property
+    def is_dir(self) -> bool:
+        return self.mode & Stats.S_IFMT == Stats.S_IFDIR
+
+    @property
+    def is_file(self) -> bool:
+        return self.mode & Stats.S_IFMT == Stats.S_IFREG
+
+    @property
+    def is_link(self) -> bool:
+        return self.mode & Stats.S_IFMT == Stats.S_IFLNK
+
+
+_ENTRY = struct.Struct('<III')
+_DENT = struct.Struct('<4sIIII')
+
+
+class SyncSession(object):
+
+    def __init__(self, serial: str, pool=None, compression: str = None):
+        # compression None speaks sync v1, anything else is a sync v2 codec name ('none' included)
+        self.client = Client(serial, pool)
+        self.compression = compression
+
+    async def __aenter__(self):
+        await self.client.__aenter__()
+        try:
+            await self.client.call('sync:')
+        except BaseException:
+            await self.client.__aexit__(None, None, None)
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None and self.client.writer and not self.client.writer.is_closing():
+            await self.client.write(Signal.QUIT.encode('utf-8') + struct.pack('<I', 0))
+        await self.client.__aexit__(exc_type, exc_val, exc_tb)
+
+    async def request(self, signal: str, arg: bytes = b''):
+        await self.client.write(signal.encode('utf-8') + struct.pack('<I', len(arg)) + arg)
+
+    async def read_status(self) -> Tuple[str, str]:
+        header = await self.client.reader.readexactly(8)
+        flag, length = header[:4].decode('utf-8'), struct.unpack('<I', header[4:])[0]
+        if flag == Signal.FAIL:
+            return flag, (await self.client.reader.readexactly(length)).decode('utf-8', 'replace')
+        return flag, ''
+
+    async def stat(self, path: str) -> SyncEntry:
+        # a mode of 0 means the path does not exist
+        await self.request(Signal.STAT, path.encode('utf-8'))
+        header = await self.client.reader.readexactly(16)
+        if header[:4].decode('utf-8') != Signal.STAT:
+            raise ConnectionError('stat error: unexpected {}'.format(header[:4]))
+        return SyncEntry(posixpath.basename(path.rstrip('/')) or path, *_ENTRY.unpack_from(header, 4))
+
+    async def list(self, path: str) -> AsyncIterator[SyncEntry]:
+        # DENT records are yielded as they arrive, the whole listing is never held at once
+        await self.request(Signal.LIST, path.encode('utf-8'))
+        reader = self.client.reader
+        while True:
+            flag, mode, size, mtime, name_size = _DENT.unpack(await reader.readexactly(_DENT.size))
+            if flag == b'DONE':
+                return
+            if flag != b'DENT':
+                raise ConnectionError('list error: unexpected {}'.format(flag))
+            name = (await reader.readexactly(name_size)).decode('utf-8', 'surrogateescape')
+            if name not in ('.', '..'):
+                yield SyncEntry(name, mode, size, mtime)
+
+    async def tree(self, path: str) -> Dict[str, SyncEntry]:
+        # every entry below path keyed by its posix path relative to path
+        entries = {}
+        pending = ['']
+        while pending:
+            rel_dir = pending.pop()
+            async for entry in self.list(posixpath.join(path, rel_dir) if rel_dir else path):
+                rel_path = posixpath.join(rel_dir, entry.name) if rel_dir else entry.name
+                entries[rel_path] = entry
+                if entry.is_dir:
+                    pending.append(rel_path)
+        return entries
+
+    async def _write_data(self, data):
+        data = memoryview(data)
+        for offset in range(0, len(data), SYNC_DATA_MAX):
+            chunk = data[offset:offset + SYNC_DATA_MAX]
+            await self.client.write(Signal.DATA.encode('utf-8') + struct.pack('<I', len(chunk)))
+            await self.client.write(chunk)
+            await self.client.writer.drain()
+
+    async def _send_header(self, dest: str, mode: int):
+        # returns the compressor for the DATA payloads, None on sync v1
+        mode |= Stats.S_IFREG
+        if self.compression is None:
+            await self.request(Signal.SEND, '{dest},{mode}'.format(dest=dest, mode=mode).encode('utf-8'))
+            return None
+        await self.request(Signal.SND2, dest.encode('utf-8'))
+        await self.client.write(Signal.SND2.encode('utf-8') + struct.pack('<II', mode, codec.FLAGS[self.compression]))
+        return codec.compressor(self.compression)
+
+    async def send_buffer(self, data, dest: str, mode: int = 0o644, mtime: int = 0, progress_func=None) -> int:
+        # like send_file for data already in memory; chunks are slices of data, nothing is copied
+        # on the way to the socket and every chunk waits for this session's own drain
+        view = memoryview(data)
+        compressor = await self._send_header(dest, mode)
+        total_size = len(view)
+        for offset in range(0, total_size, SYNC_DATA_MAX):
+            chunk = view[offset:offset + SYNC_DATA_MAX]
+            await self._write_data(chunk if compressor is None else compressor.compress(chunk))
+            if progress_func:
+                progress_func(total_size, offset + len(chunk))
+        if compressor is not None:
+            await self._write_data(compressor.flush())
+        await self.client.write(Signal.DONE.encode('utf-8') + struct.pack('<I', mtime))
+        return total_size
+
+    async def send_file(self, src: str, dest: str, mode: int = 0o644, progress_func=None) -> int:
+        # writes one SEND/DATA.../DONE sequence without waiting for the acknowledgement
+        compressor = await self._send_header(dest, mode)
+
+        total_size = os.path.getsize(src)
+        async with aiofiles.open(src, 'rb') as stream:
+            sent_size = 0
+            while True:
+                chunk = await stream.read(SYNC_DATA_MAX)
+                if not chunk:
+                    break
+                sent_size += len(chunk)
+                await self._write_data(chunk if compressor is None else compressor.compress(chunk))
+                if progress_func:
+                    progress_func(total_size, sent_size)
+        if compressor is not None:
+            await self._write_data(compressor.flush())
+        await self.client.write(Signal.DONE.encode('utf-8') + struct.pack('<I', int(os.path.getmtime(src))))
+        return sent_size
+
+    async def push(self, src: str, dest: str, mode: int = 0o644, progress_func=None) -> int:
+        sent_size = await self.send_file(src, dest, mode, progress_func)
+        flag, error = await self.read_status()
+        if flag != Signal.OKAY:
+            raise ConnectionError('push data error: {}'.format(error))
+        return sent_size
+
+    async def push_many(self, files: List[Tuple[str, str]], mode: int = 0o644,
+                        progress_func=None) -> List[PushResult]:
+        # acknowledgements are read by a concurrent task so the next file goes out before
+        # the previous OKAY arrives; adbd ends the session after a FAIL, which stops the batch
+        sizes = asyncio.Queue()
+        results = []
+
+        async def read_acks():
+            for src, dest in files:
+                size = await sizes.get()
+                if size is None:
+                    return
+                try:
+                    flag, error = await self.read_status()
+                except (asyncio.IncompleteReadError, ConnectionError) as e:
+                    results.append(PushResult(src, dest, size, False, 'sync session closed: {}'.format(e)))
+                    return
+                results.append(PushResult(src, dest, size, flag == Signal.OKAY, error or None))
+                if flag != Signal.OKAY:
+                    return
+
+        acks = asyncio.ensure_future(read_acks())
+        try:
+            for src, dest in files:
+                if acks.done():
+                    break
+                try:
+                    size = await self.send_file(src, dest, mode, progress_func)
+                except ConnectionError:
+                    break
+                sizes.put_nowait(size)
+            sizes.put_nowait(None)
+            await acks
+        finally:
+            acks.cancel()
+        return results
+
+    async def recv_chunks(self, src: str, buffer_size: int = PULL_BUFFER_SIZE) -> AsyncIterator[memoryview]:
+        # DATA payloads are packed into two preallocated buffers used in turn, a yielded
+        # view stays valid until the next one has been yielded
+        if self.compression is None:
+            await self.request(Signal.RECV, src.encode('utf-8'))
+            decompressor = None
+        else:
+            await self.request(Signal.RCV2, src.encode('utf-8'))
+            await self.client.write(Signal.RCV2.encode('utf-8') + struct.pack('<I', codec.FLAGS[self.compression]))
+            decompressor = codec.decompressor(self.compression)
+
+        reader = self.client.reader
+        views = [memoryview(bytearray(buffer_size)), memoryview(bytearray(buffer_size))]
+        view = views[0]
+        filled = 0
+        while True:
+            header = await reader.readexactly(8)
+            flag, length = header[:4].decode('utf-8'), struct.unpack('<I', header[4:])[0]
+            if flag == Signal.DATA:
+                data = None
+                if decompressor is not None:
+                    data = memoryview(decompressor.decompress(await reader.readexactly(length)))
+                    length = len(data)
+                while length:
+                    if filled == buffer_size:
+                        yield view
+                        views.reverse()
+                        view, filled = views[0], 0
+                    size = min(length, buffer_size - filled)
+                    if data is None:
+                        chunk = await reader.read(size)
+                        if not chunk:
+                            raise asyncio.IncompleteReadError(b'', length)
+                    else:
+                        chunk, data = data[:size], data[size:]
+                    view[filled:filled + len(chunk)] = chunk
+                    filled += len(chunk)
+                    length -= len(chunk)
+            elif flag == Signal.DONE:
+                if filled:
+                    yield view[:filled]
+                return
+            elif flag == Signal.FAIL:
+                error = (await reader.readexactly(length)).decode('utf-8', 'replace')
+                raise ConnectionError('pull data error: {}'.format(error))
+            else:
+                raise ConnectionError('pull data error: unexpected {}'.format(flag))
+
+    async def pull(self, src: str, dest, buffer_size: int = PULL_BUFFER_SIZE, progress_func=None) -> int:
+        # progress_func is called with the number of bytes received so far
+        if isinstance(dest, str):
+            return await self.pull_file(src, dest, buffer_size, progress_func)
+
+        received = 0
+        async for view in self.recv_chunks(src, buffer_size):
+            if isinstance(dest, bytearray):
+                dest.extend(view)
+            else:
+                dest.write(view)
+            received += len(view)
+            if progress_func:
+                progress_func(received)
+        return received
+
+    async def pull_file(self, src: str, dest: str, buffer_size: int = PULL_BUFFER_SIZE, progress_func=None) -> int:
+        # one writer thread drains a buffer to disk while the other one is being filled
+        fd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o666)
+        executor = ThreadPoolExecutor(max_workers=1)
+        pending = None
+        offset = 0
+        try:
+            async for view in self.recv_chunks(src, buffer_size):
+                if pending is not None:
+                    await pending
+                pending = events.get_event_loop().run_in_executor(executor, _write_all, fd, view, offset)
+                offset += len(view)
+                if progress_func:
+                    progress_func(offset)
+            if pending is not None:
+                await pending
+                pending = None
+        finally:
+            if pending is not None:
+                await asyncio.gather(pending, return_exceptions=True)
+            executor.shutdown(wait=False)
+            os.close(fd)
+        return offset
@@ -0,0 +1,158 @@
+import asyncio
+import inspect
+import re
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional
+
+from aadb import events
+from aadb.transport import Client
+
+_ATTRIBUTE = re.compile(r'^(product|model|device|transport_id|usb|features):(\S*)$')
+
+
+class DeviceInfo(NamedTuple):
+    serial: str
+    state: str
+    attributes: Dict[str, str] = {}
+
+
+class DeviceEvent(NamedTuple):
+    # kind is one of DeviceTracker.CONNECTED, DISCONNECTED or STATE
+    kind: str
+    serial: str
+    state: Optional[str]
+    previous: Optional[str] = None
+    info: Optional[DeviceInfo] = None
+
+
+def parse_devices(listing: str) -> Dict[str, DeviceInfo]:
+    # both `devices` and `devices -l` layouts: serial, a state that may contain spaces, key:value pairs
+    table = {}
+    for line in listing.splitlines():
+        tokens = line.split()
+        if len(tokens) < 2:
+            continue
+        state = []
+        attributes = {}
+        for token in tokens[1:]:
+            match = _ATTRIBUTE.match(token)
+            if match:
+                attributes[match.group(1)] = match.group(2)
+            elif not attributes:
+                state.append(token)
+        table[tokens[0]] = DeviceInfo(tokens[0], ' '.join(state), attributes)
+    return table
+
+
+class DeviceTracker(object):
+    # keeps one host:track-devices connection open and the device table in step with it; the
+    # server pushes a full listing on every change, events come from diffing consecutive listings
+
+    CONNECTED = 'connected'
+    DISCONNECTED = 'disconnected'
+    STATE = 'state'
+
+    def __init__(self, pool=None, long: bool = True, reconnect_delay: float = 1.0):
+        self.pool = pool
+        self.long = long
+        self.reconnect_delay = reconnect_delay
+        self.table: Dict[str, DeviceInfo] = {}
+        self.ready = asyncio.Event()
+        self._listeners = []
+        self._queues = set()
+        self._task = None
+        # the last connection or listener failure, listener_errors counts the latter
+        self.error: Optional[BaseException] = None
+        self.listener_errors = 0
+
+    def __len__(self):
+        return len(self.table)
+
+    def devices(self, state: str = None) -> List[DeviceInfo]:
+        return [info for info in self.table.values() if state is None or info.state == state]
+
+    def add_listener(self, callback):
+        # callback(event), a coroutine function works too
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    async def events(self) -> AsyncIterator[DeviceEvent]:
+        queue = asyncio.Queue()
+        self._queues.add(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self._queues.discard(queue)
+
+    def start(self):
+        if self._task is None:
+            self._task = events.get_event_loop().create_task(self._run())
+        return self
+
+    async def wait_ready(self, timeout: float = None):
+        await asyncio.wait_for(self.ready.wait(), timeout)
+        return self
+
+    async def __aenter__(self):
+        return await self.start().wait_ready()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.stop()
+
+    async def stop(self):
+        self.ready.clear()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        try:
+            while True:
+                try:
+                    async with Client(pool=self.pool) as client:
+                        await client.call('host:track-devices-l' if self.long else 'host:track-devices')
+                        while True:
+                            length = int(await client.reader.readexactly(4), 16)
+                            listing = (await client.reader.readexactly(length)).decode('utf-8', 'replace')
+                            await self._update(parse_devices(listing))
+                            self.ready.set()
+                except (ConnectionError, OSError, asyncio.IncompleteReadError, ValueError) as e:
+                    # the table is kept, the first listing after reconnecting is diffed against it
+                    self.ready.clear()
+                    self.error = e
+                await asyncio.sleep(self.reconnect_delay)
+        finally:
+            # however the task ends, nobody may keep answering from a table that no longer follows the server
+            self.ready.clear()
+
+    async def _update(self, table: Dict[str, DeviceInfo]):
+        changes = []
+        for serial, info in table.items():
+            previous = self.table.get(serial)
+            if previous is None:
+                changes.append(DeviceEvent(self.CONNECTED, serial, info.state, None, info))
+            elif previous.state != info.state:
+                changes.append(DeviceEvent(self.STATE, serial, info.state, previous.state, info))
+        for serial, previous in self.table.items():
+            if serial not in table:
+                changes.append(DeviceEvent(self.DISCONNECTED, serial, None, previous.state, previous))
+        self.table = table
+        for event in changes:
+            for queue in self._queues:
+                queue.put_nowait(event)
+            for listener in list(self._listeners):
+                try:
+                    result = listener(event)
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception as e:
+                    # one broken listener must not stop the tracking for everybody else
+                    self.listener_errors += 1
+                    self.error = e
@@ -1,9 +1,18 @@
 import asyncio
+import codecs
+import inspect
+import time
 from asyncio import StreamReader, StreamWriter
 from asyncio import StreamReaderProtocol
 
 import aadb
 from aadb import events
+from aadb import metrics
+
+
+STREAM_LIMIT = 1 << 20
+LINE_READ_MIN = 1 << 14
+LINE_READ_MAX = 1 << 20
 
 
 class Signal(object):
@@ -16,6 +25,8 @@ class Signal(object):
     DATA = 'DATA'
     DONE = 'DONE'
     SEND = 'SEND'
+    SND2 = 'SND2'
+    RCV2 = 'RCV2'
     QUIT = 'QUIT'
 
 
@@ -44,49 +55,111 @@ class ClientProtocol(StreamReaderProtocol):
 
     def __init__(self, stream_reader: StreamReader, loop: asyncio.AbstractEventLoop):
         super().__init__(stream_reader, loop=loop)
+        # set by the client while instrumentation is on, every byte from the server passes here
+        self.record = None
+
+    def data_received(self, data):
+        if self.record is not None:
+            self.record.received(len(data))
+        super().data_received(data)
 
 
 class Client(object):
 
-    def __init__(self):
-        self.host = aadb.inner_host
-        self.port = aadb.inner_port
+    def __init__(self, serial: str = None, pool=None):
+        # the module wide server of create_bridge() only for clients made without a pool
+        self.host = getattr(pool, 'host', aadb.inner_host)
+        self.port = getattr(pool, 'port', aadb.inner_port)
+        self.serial = serial
+        self.pool = pool
+        self.bound = None
         self.reader: StreamReader = None
         self.writer: StreamWriter = None
         self.transport = None
+        self.protocol: ClientProtocol = None
+        self.record: metrics.RequestRecord = None
+
+    async def connect(self):
+        self.reader = StreamReader(limit=STREAM_LIMIT, loop=events.get_event_loop())
+        self.protocol = ClientProtocol(self.reader, loop=events.get_event_loop())
+        self.transport, _ = await events.get_event_loop().create_connection(lambda: self.protocol,
+                                                                            self.host, self.port)
+        self.writer = StreamWriter(self.transport, self.protocol, self.reader, events.get_event_loop())
+
+    async def bind(self, serial: str):
+        if self.bound != serial:
+            await self.call('host:transport:{}'.format(serial))
+            self.bound = serial
+        return True
 
     async def __aenter__(self):
-        self.reader = StreamReader(loop=events.get_event_loop())
-        protocol = ClientProtocol(self.reader, loop=events.get_event_loop())
+        if metrics.request_hooks:
+            self.record = metrics.RequestRecord(self.serial)
         try:
-            self.transport, _ = await events.get_event_loop().create_connection(lambda: protocol, self.host, self.port)
-            self.writer = StreamWriter(self.transport, protocol, self.reader, events.get_event_loop())
-        except ConnectionRefusedError as e:
-            print(e)
+            if self.pool is not None:
+                borrowed = await self.pool.acquire(self.serial)
+                self.reader, self.writer, self.transport = borrowed.reader, borrowed.writer, borrowed.transport
+                self.protocol = borrowed.protocol
+                self.bound = borrowed.bound
+            else:
+                await self.connect()
+        except BaseException as e:
+            if self.record is not None:
+                self.record.finish('connect-error', e)
+            raise
+
+        if self.record is not None:
+            self.record.connect_time = time.perf_counter() - self.record.started
+            self.protocol.record = self.record
+
+        if self.serial is not None:
+            try:
+                await self.bind(self.serial)
+            except BaseException as e:
+                await self.__aexit__(type(e), e, e.__traceback__)
+                raise
 
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
+        close_error = None
         if self.writer:
             self.writer.close()
-            try:
-                await self.writer.wait_closed()
-            except AttributeError as e:
-                print('close error:', e)
+            # wait_closed is missing before python 3.7, there is nothing to wait for then
+            if hasattr(self.writer, 'wait_closed'):
+                try:
+                    await self.writer.wait_closed()
+                except OSError as e:
+                    # the request itself went through, its record tells the failed close apart
+                    close_error = e
+        if self.record is not None:
+            record, self.record = self.record, None
+            self.protocol.record = None
+            if exc_type is None:
+                record.finish('ok' if close_error is None else 'close-error', close_error)
+            else:
+                record.finish('cancelled' if issubclass(exc_type, asyncio.CancelledError) else 'error', exc_val)
 
     async def call(self, request: str):
         request_encode = request.encode('utf-8')
         request_length = "{0:04X}".format(len(request_encode)).encode('utf-8')
+        record = self.record
+        if record is not None:
+            started = time.perf_counter()
+            record.bytes_out += len(request_encode) + 4
+            record.service = request
         self.writer.write(b''.join([request_length, request_encode]))
         await self.writer.drain()
-        return await self.receive_done()
+        result = await self.receive_done()
+        if record is not None:
+            record.handshake(request, time.perf_counter() - started)
+        return result
 
     async def receive_done(self):
         status_data = await self.reader.read(4)
         if status_data.decode('utf-8') != Signal.OKAY:
-            error = (await self.reader.read(1024)).decode('utf-8')
-            print(error)
-            raise ConnectionError('write error')
+            error = (await self.reader.read(1024)).decode('utf-8', 'replace')
+            raise ConnectionError('write error: {}'.format(error))
 
         return True
 
@@ -95,28 +168,74 @@ class Client(object):
         data_length = int(head_data, 16)
         return (await self.reader.read(data_length)).decode('utf-8')
 
-    async def receive_lines(self, pipeline_func):
-        temp_data = b''
-        temp_line = ''
+    async def receive_lines(self, pipeline_func, batch: bool = False):
+        # incremental decoding keeps split multi-byte characters intact, the read size grows
+        # while the peer keeps the buffer full; batch hands the pipeline a list per read
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        record = self.record
+        if metrics.slow_pipeline_threshold is not None:
+            pipeline_func = self._timed(pipeline_func, metrics.slow_pipeline_threshold)
+        read_size = LINE_READ_MIN
+        tail = ''
         while True:
-            receive_data = temp_data + await self.reader.read(1024)
-            try:
-                result = receive_data.decode('utf-8')
-                temp_data = b''
-                if not result:
-                    if temp_line:
-                        pipeline_func(temp_line)
-                    break
-                result = temp_line + result
-                lines = result.split('\n')
-                if not result.endswith('\n'):
-                    temp_line = lines.pop(-1)
-                for line in lines:
-                    if not line:
-                        continue
-                    pipeline_func(line)
-            except UnicodeDecodeError:
-                temp_data = receive_data
+            data = await self.reader.read(read_size)
+            if data:
+                if len(data) == read_size and read_size < LINE_READ_MAX:
+                    read_size <<= 1
+                text = tail + decoder.decode(data)
+                if '\r' in text:
+                    text = text.replace('\r\n', '\n')
+                lines = text.split('\n')
+                tail = lines.pop()
+            else:
+                text = tail + decoder.decode(b'', final=True)
+                lines = [text[:-1] if text.endswith('\r') else text]
+
+            lines = list(filter(None, lines))
+            if record is not None:
+                record.lines += len(lines)
+            # a pipeline may return an awaitable, awaiting it stops reading and lets TCP push back
+            if lines:
+                if batch:
+                    result = pipeline_func(lines)
+                    if result is not None and inspect.isawaitable(result):
+                        await result
+                else:
+                    for line in lines:
+                        result = pipeline_func(line)
+                        if result is not None and inspect.isawaitable(result):
+                            await result
+            if not data:
+                break
+
+    async def iter_raw(self, chunk_size: int = STREAM_LIMIT):
+        while True:
+            data = await self.reader.read(chunk_size)
+            if not data:
+                break
+            yield data
+
+    def _timed(self, func, threshold: float):
+        # only the synchronous part blocks the loop, an awaitable the pipeline returns is not timed
+        def timed(*args):
+            started = time.perf_counter()
+            result = func(*args)
+            elapsed = time.perf_counter() - started
+            if elapsed > threshold:
+                metrics.slow_pipeline(self.record, func, elapsed)
+            return result
+
+        return timed
+
+    async def receive_raw(self, consume_func, chunk_size: int = STREAM_LIMIT):
+        if metrics.slow_pipeline_threshold is not None:
+            consume_func = self._timed(consume_func, metrics.slow_pipeline_threshold)
+        async for data in self.iter_raw(chunk_size):
+            result = consume_func(data)
+            if inspect.isawaitable(result):
+                await result
 
     async def write(self, data):
+        if self.record is not None:
+            self.record.bytes_out += len(data)
         self.writer.write(data)
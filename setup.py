@@ -4,6 +4,11 @@ setup(
     name='aadb',
     version='1.0.0',
     packages=['aadb'],
+    extras_require={
+        'compression': ['brotli', 'lz4', 'zstandard'],
+        'direct': ['cryptography'],
+        'numpy': ['numpy'],
+    },
     url='',
     license='MIT',
     author='fuxingfu',
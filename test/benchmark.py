@@ -0,0 +1,163 @@
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import aadb
+from aadb.transport import STREAM_LIMIT, Client
+from fake_adb import FakeAdbServer, logcat_line, run
+
+MB = 1024 * 1024
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def bench_push(devices, src, size):
+    started = time.perf_counter()
+    await asyncio.gather(*[device.push(src, '/sdcard/bench.bin') for device in devices])
+    return size * len(devices) / MB / (time.perf_counter() - started)
+
+
+async def bench_pull(devices, workdir, size):
+    started = time.perf_counter()
+    await asyncio.gather(*[device.pull('/sdcard/bench.bin', os.path.join(workdir, '{}.bin'.format(i)))
+                           for i, device in enumerate(devices)])
+    return size * len(devices) / MB / (time.perf_counter() - started)
+
+
+async def bench_lines(devices):
+    count = 0
+
+    def pipeline(line):
+        nonlocal count
+        count += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[device.logcat(pipeline=pipeline) for device in devices])
+    return count / (time.perf_counter() - started), count
+
+
+async def legacy_receive_lines(client, pipeline_func):
+    # Client.receive_lines as it was before the incremental decoder, kept as the baseline
+    temp_data = b''
+    temp_line = ''
+    while True:
+        receive_data = temp_data + await client.reader.read(1024)
+        try:
+            result = receive_data.decode('utf-8')
+            temp_data = b''
+            if not result:
+                if temp_line:
+                    pipeline_func(temp_line)
+                break
+            result = temp_line + result
+            lines = result.split('\n')
+            if not result.endswith('\n'):
+                temp_line = lines.pop(-1)
+            for line in lines:
+                if not line:
+                    continue
+                pipeline_func(line)
+        except UnicodeDecodeError:
+            temp_data = receive_data
+
+
+async def bench_line_engines(lines):
+    data = b''.join(logcat_line(i) for i in range(lines))
+    rates = {}
+    for name, engine in (('before', lambda c, out: legacy_receive_lines(c, out.append)),
+                         ('after', lambda c, out: c.receive_lines(out.append)),
+                         ('after_batch', lambda c, out: c.receive_lines(out.extend, batch=True))):
+        client = Client()
+        client.reader = asyncio.StreamReader(limit=STREAM_LIMIT)
+        client.reader.feed_data(data)
+        client.reader.feed_eof()
+        received = []
+        started = time.perf_counter()
+        await engine(client, received)
+        rates[name] = len(received) / (time.perf_counter() - started)
+    return rates
+
+
+async def bench_devices(bridge, iterations, concurrency):
+    samples = []
+
+    async def probe():
+        started = time.perf_counter()
+        await bridge.devices()
+        samples.append((time.perf_counter() - started) * 1000)
+
+    for _ in range(iterations):
+        await asyncio.gather(*[probe() for _ in range(concurrency)])
+    return statistics.median(samples), percentile(samples, 99)
+
+
+async def benchmark(size=8 * MB, lines=100000, device_counts=(1, 4, 16), iterations=50, logcat_rate=0,
+                    pool_size=0, compression='any'):
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        src = os.path.join(workdir, 'payload.bin')
+        with open(src, 'wb') as f:
+            f.write(os.urandom(size))
+
+        for count in device_counts:
+            serials = ['emulator-{}'.format(5554 + 2 * i) for i in range(count)]
+            async with FakeAdbServer(serials=serials, logcat_lines=lines, logcat_rate=logcat_rate) as server:
+                bridge = aadb.create_bridge(port=server.port, pool_size=pool_size)
+                devices = await bridge.devices()
+                for device in devices:
+                    device.compression = compression
+                push_rate = await bench_push(devices, src, size)
+                pull_rate = await bench_pull(devices, workdir, size)
+                line_rate, line_count = await bench_lines(devices)
+                p50, p99 = await bench_devices(bridge, iterations, count)
+                results.append({
+                    'devices': count,
+                    'push_mb_s': push_rate,
+                    'pull_mb_s': pull_rate,
+                    'lines_s': line_rate,
+                    'lines': line_count,
+                    'devices_p50_ms': p50,
+                    'devices_p99_ms': p99,
+                })
+                await bridge.close()
+    return results
+
+
+def report_engines(rates):
+    print('receive_lines engine: {before:.0f} lines/s before, {after:.0f} lines/s after, '
+          '{after_batch:.0f} lines/s batched'.format(**rates))
+
+
+def report(results):
+    print('{:>8} {:>12} {:>12} {:>14} {:>16} {:>16}'.format(
+        'devices', 'push MB/s', 'pull MB/s', 'lines/s', 'devices() p50', 'devices() p99'))
+    for r in results:
+        print('{devices:>8} {push_mb_s:>12.1f} {pull_mb_s:>12.1f} {lines_s:>14.0f} '
+              '{devices_p50_ms:>13.2f} ms {devices_p99_ms:>13.2f} ms'.format(**r))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='aadb transfer/stream benchmark against an in-process adb server')
+    parser.add_argument('--size', type=int, default=8, help='payload size in MB for push/pull')
+    parser.add_argument('--lines', type=int, default=100000, help='logcat lines per device')
+    parser.add_argument('--rate', type=int, default=0, help='logcat lines per second per device, 0 is unlimited')
+    parser.add_argument('--devices', default='1,4,16', help='comma separated concurrent device counts')
+    parser.add_argument('--iterations', type=int, default=50, help='devices() latency samples per device count')
+    parser.add_argument('--pool', type=int, default=0, help='warm connections kept per transport, 0 disables')
+    parser.add_argument('--compression', default='any',
+                        help="sync v2 codec: any, none, brotli, lz4, zstd or v1 for the original protocol")
+    args = parser.parse_args()
+    report_engines(run(bench_line_engines(args.lines)))
+    report(run(benchmark(size=args.size * MB, lines=args.lines, logcat_rate=args.rate,
+                         device_counts=[int(n) for n in args.devices.split(',')], iterations=args.iterations,
+                         pool_size=args.pool, compression=None if args.compression == 'v1' else args.compression)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,516 @@
+import asyncio
+import hashlib
+import re
+import shlex
+import struct
+import time
+
+from aadb import events
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+OKAY = b'OKAY'
+FAIL = b'FAIL'
+
+SYNC_FEATURES = ('sendrecv_v2', 'sendrecv_v2_brotli', 'sendrecv_v2_lz4', 'sendrecv_v2_zstd')
+
+DIR_MODE = 0o40755
+
+
+def sync_compress(flags: int, data: bytes) -> bytes:
+    if flags & 1:
+        return brotli.compress(data, quality=1)
+    if flags & 2:
+        return lz4_frame.compress(data)
+    if flags & 4:
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+
+def sync_decompress(flags: int, data: bytes) -> bytes:
+    if flags & 1:
+        return brotli.decompress(data)
+    if flags & 2:
+        return lz4_frame.decompress(data)
+    if flags & 4:
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return data
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    events.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        pending = asyncio.all_tasks(loop)
+        for task in pending:
+            task.cancel()
+        if pending:
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        loop.close()
+
+
+def logcat_line(index: int) -> bytes:
+    return '10-18 15:36:{:02d}.{:03d}  1234  {:4d} I FakeTag: synthetic logcat message number {}\n'.format(
+        index // 1000 % 60, index % 1000, 1000 + index % 8000, index).encode('utf-8')
+
+
+class FakeDevice(object):
+
+    def __init__(self, serial: str, state: str = 'device', features=()):
+        self.serial = serial
+        self.state = state
+        self.features = list(features)
+        self.files = {}
+        self.commands = []
+        self.outputs = {}
+        self.readonly = ()
+        # every successful install as the list of apk payloads it was made of
+        self.installed = []
+        self.install_sessions = {}
+        # device side sockets (tcp:, localabstract:) as async handler(reader, writer)
+        self.services = {}
+        self.reverses = {}
+        self.exit_codes = {}
+        # what framebuffer: answers, bytes or a callable returning them
+        self.framebuffer = None
+
+    def put_file(self, path: str, data: bytes, mode: int = 0o100644, mtime: int = None):
+        self.files[path] = (mode, int(time.time()) if mtime is None else mtime, bytes(data))
+
+    def stat(self, path: str):
+        # (mode, size, mtime), directories only exist implicitly through the files below them
+        path = path.rstrip('/') or '/'
+        if path in self.files:
+            mode, mtime, data = self.files[path]
+            return mode, len(data), mtime
+        prefix = path.rstrip('/') + '/'
+        if any(name.startswith(prefix) for name in self.files):
+            return DIR_MODE, 4096, 0
+        return 0, 0, 0
+
+    def listdir(self, path: str):
+        prefix = path.rstrip('/') + '/'
+        children = {}
+        for name in self.files:
+            if name.startswith(prefix):
+                child = name[len(prefix):].split('/', 1)[0]
+                children[child] = self.stat(prefix + child)
+        return sorted(children.items())
+
+    def remove(self, path: str):
+        prefix = path.rstrip('/') + '/'
+        for name in [name for name in self.files if name == path or name.startswith(prefix)]:
+            del self.files[name]
+
+
+class FakeAdbServer(object):
+    # in-process stand-in for the adb host server, logcat_rate=0 streams as fast as possible
+
+    def __init__(self, serials=('emulator-5554',), version: int = 41,
+                 features=('shell_v2', 'cmd', 'fixed_push_mkdir') + SYNC_FEATURES,
+                 logcat_lines: int = 10000, logcat_rate: int = 0, host: str = '127.0.0.1', port: int = 0):
+        self.devices = {serial: FakeDevice(serial, features=features) for serial in serials}
+        self.version = version
+        self.features = list(features)
+        self.sync_flags = []
+        self.logcat_lines = logcat_lines
+        self.logcat_rate = logcat_rate
+        self.host = host
+        self.port = port
+        self.connections = 0
+        self.requests = []
+        self._server = None
+        self._handlers = {}
+        self._trackers = {}
+        self._logcat_cache = None
+        self.forwards = {}
+        self._next_port = 40000
+
+    @property
+    def active(self) -> int:
+        return len(self._handlers)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        self._server.close()
+        for writer in list(self._handlers.values()):
+            writer.close()
+        if self._handlers:
+            await asyncio.gather(*self._handlers, return_exceptions=True)
+        await self._server.wait_closed()
+
+    def _listing(self, long: bool = False) -> str:
+        if not long:
+            return ''.join('{}\t{}\n'.format(d.serial, d.state) for d in self.devices.values())
+        return ''.join('{:<22} {} product:sdk_phone model:Fake_{} device:generic transport_id:{}\n'.format(
+            d.serial, d.state, i, i + 1) for i, d in enumerate(self.devices.values()))
+
+    def _notify_trackers(self):
+        for writer, long in list(self._trackers.items()):
+            writer.write(self._framed(self._listing(long).encode('utf-8')))
+
+    def add_device(self, serial: str, state: str = 'device') -> FakeDevice:
+        device = self.devices[serial] = FakeDevice(serial, state, self.features)
+        self._notify_trackers()
+        return device
+
+    def remove_device(self, serial: str):
+        del self.devices[serial]
+        self._notify_trackers()
+
+    def set_state(self, serial: str, state: str):
+        self.devices[serial].state = state
+        self._notify_trackers()
+
+    async def _track(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, long: bool):
+        writer.write(OKAY + self._framed(self._listing(long).encode('utf-8')))
+        self._trackers[writer] = long
+        try:
+            await reader.read()
+        finally:
+            self._trackers.pop(writer, None)
+
+    @staticmethod
+    def _framed(data: bytes) -> bytes:
+        return '{0:04X}'.format(len(data)).encode('utf-8') + data
+
+    @staticmethod
+    async def _read_request(reader: asyncio.StreamReader) -> str:
+        length = int(await reader.readexactly(4), 16)
+        return (await reader.readexactly(length)).decode('utf-8')
+
+    def _fail(self, writer: asyncio.StreamWriter, message: str):
+        writer.write(FAIL + self._framed(message.encode('utf-8')))
+
+    @staticmethod
+    def _sync_fail(writer: asyncio.StreamWriter, message: str):
+        message = message.encode('utf-8')
+        writer.write(FAIL + struct.pack('<I', len(message)) + message)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        self._handlers[asyncio.current_task()] = writer
+        device = None
+        try:
+            while True:
+                request = await self._read_request(reader)
+                self.requests.append(request)
+                if request.startswith('host:transport:'):
+                    device = self.devices.get(request[len('host:transport:'):])
+                    if device is None:
+                        self._fail(writer, 'device not found')
+                        break
+                    writer.write(OKAY)
+                    continue
+                if request.startswith('host-serial:'):
+                    rest = request[len('host-serial:'):]
+                    # serials may contain ':' themselves, and so may the command
+                    serial = max((s for s in self.devices if rest.startswith(s + ':')), key=len, default=None)
+                    if serial is None:
+                        self._fail(writer, 'device not found')
+                    else:
+                        self._host(writer, rest[len(serial) + 1:], self.devices[serial])
+                elif request in ('host:track-devices', 'host:track-devices-l'):
+                    await self._track(reader, writer, request.endswith('-l'))
+                elif request.startswith('host:'):
+                    self._host(writer, request[len('host:'):])
+                elif device is None:
+                    self._fail(writer, 'no device selected')
+                elif request == 'sync:':
+                    writer.write(OKAY)
+                    await self._sync(device, reader, writer)
+                elif request.startswith('shell:'):
+                    writer.write(OKAY)
+                    await self._shell(device, writer, request[len('shell:'):], reader)
+                elif request.startswith('exec:'):
+                    writer.write(OKAY)
+                    await self._shell(device, writer, request[len('exec:'):], reader)
+                elif request == 'framebuffer:' and device.framebuffer is not None:
+                    frame = device.framebuffer() if callable(device.framebuffer) else device.framebuffer
+                    writer.write(OKAY + frame)
+                elif request.startswith('reverse:'):
+                    self._reverse(device, writer, request[len('reverse:'):])
+                elif request in device.services:
+                    writer.write(OKAY)
+                    await device.services[request](reader, writer)
+                else:
+                    self._fail(writer, 'unknown service {}'.format(request))
+                break
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._handlers.pop(asyncio.current_task(), None)
+            writer.close()
+
+    def _host(self, writer: asyncio.StreamWriter, command: str, device: FakeDevice = None):
+        if command == 'version':
+            writer.write(OKAY + self._framed('{0:04x}'.format(self.version).encode('utf-8')))
+        elif command == 'features':
+            features = self.features if device is None else device.features
+            writer.write(OKAY + self._framed(','.join(features).encode('utf-8')))
+        elif command in ('devices', 'devices-l'):
+            writer.write(OKAY + self._framed(self._listing(command == 'devices-l').encode('utf-8')))
+        elif command in ('kill', 'killforward-all'):
+            writer.write(OKAY)
+        elif command == 'list-forward':
+            listing = ''.join('{} {} {}\n'.format(serial, local, remote)
+                              for (serial, local), remote in self.forwards.items())
+            writer.write(OKAY + self._framed(listing.encode('utf-8')))
+        elif command.startswith('forward:') and device is not None:
+            self._forward(writer, self.forwards, device.serial, command[len('forward:'):])
+        elif command.startswith('killforward:') and device is not None:
+            if self.forwards.pop((device.serial, command[len('killforward:'):]), None) is None:
+                self._fail(writer, 'listener not found')
+            else:
+                writer.write(OKAY + OKAY)
+        else:
+            self._fail(writer, 'unknown host service {}'.format(command))
+
+    def _forward(self, writer: asyncio.StreamWriter, table: dict, serial: str, spec: str):
+        norebind = spec.startswith('norebind:')
+        listener, _, target = spec[len('norebind:') if norebind else 0:].partition(';')
+        if norebind and (serial, listener) in table:
+            self._fail(writer, 'cannot rebind existing socket')
+            return
+        resolved = b''
+        if listener == 'tcp:0':
+            self._next_port += 1
+            listener = 'tcp:{}'.format(self._next_port)
+            resolved = self._framed(str(self._next_port).encode('utf-8'))
+        table[(serial, listener)] = target
+        writer.write(OKAY + OKAY + resolved)
+
+    def _reverse(self, device: FakeDevice, writer: asyncio.StreamWriter, command: str):
+        if command.startswith('forward:'):
+            self._forward(writer, device.reverses, device.serial, command[len('forward:'):])
+        elif command.startswith('killforward:'):
+            if device.reverses.pop((device.serial, command[len('killforward:'):]), None) is None:
+                self._fail(writer, 'listener not found')
+            else:
+                writer.write(OKAY + OKAY)
+        elif command == 'killforward-all':
+            device.reverses.clear()
+            writer.write(OKAY + OKAY)
+        elif command == 'list-forward':
+            listing = ''.join('host-19 {} {}\n'.format(remote, local) for (_, remote), local in device.reverses.items())
+            writer.write(OKAY + OKAY + self._framed(listing.encode('utf-8')))
+        else:
+            self._fail(writer, 'unknown reverse service {}'.format(command))
+
+    async def _shell(self, device: FakeDevice, writer: asyncio.StreamWriter, command: str,
+                     reader: asyncio.StreamReader = None):
+        if command == 'sh' and reader is not None:
+            await self._sh(device, reader, writer)
+            return
+        device.commands.append(command)
+        if command == 'logcat':
+            await self._logcat(writer)
+            return
+        output = await self._output(device, command, reader)
+        if output:
+            view = memoryview(output)
+            for offset in range(0, len(view), 65536):
+                writer.write(view[offset:offset + 65536])
+                await writer.drain()
+
+    async def _output(self, device: FakeDevice, command: str, reader: asyncio.StreamReader = None) -> bytes:
+        output = device.outputs.get(command)
+        if callable(output):
+            output = output(command)
+        if output is None and command.startswith('echo '):
+            output = command[len('echo '):] + '\n'
+        if output is None and command.startswith(('md5sum ', 'rm -rf ', 'rm -f ')):
+            output = self._file_command(device, command)
+        if output is None and command.startswith(('pm install', 'cmd package install')):
+            output = await self._package(device, reader, command)
+        if output is None and command.startswith('cat > ') and reader is not None:
+            # stdin until the client closes, e.g. events for a /dev/input node
+            device.put_file(shlex.split(command[len('cat > '):])[0], await reader.read())
+            output = ''
+        if isinstance(output, str):
+            output = output.encode('utf-8')
+        return output or b''
+
+    async def _sh(self, device: FakeDevice, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # understands the lines ShellSession writes: eval <command> ...; echo <marker> $status
+        pattern = re.compile(r"^eval (.+) </dev/null 2>&1; __aadb=\$\?; echo; echo (\S+) \$__aadb$")
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            match = pattern.match(line.decode('utf-8').rstrip('\n'))
+            command = shlex.split(match.group(1))[0]
+            device.commands.append(command)
+            if command == 'exit':
+                return
+            if command.startswith('sleep '):
+                await asyncio.sleep(float(command[len('sleep '):]))
+            writer.write(await self._output(device, command) + '\n{} {}\n'.format(
+                match.group(2), device.exit_codes.get(command, 0)).encode('utf-8'))
+            await writer.drain()
+
+    @staticmethod
+    def _apk_status(apk: bytes) -> str:
+        if apk.startswith(b'BAD'):
+            return 'Failure [INSTALL_PARSE_FAILED_NOT_APK: Failed to parse]\n'
+        return 'Success\n'
+
+    async def _package(self, device: FakeDevice, reader: asyncio.StreamReader, command: str) -> str:
+        # package manager installs; apks come from stdin with -S <size> or from a device file for pm
+        args = shlex.split(command)
+        args = args[2:] if args[0] == 'cmd' else args[1:]
+        verb, size, positional = args[0], None, []
+        options = iter(args[1:])
+        for arg in options:
+            if arg == '-S':
+                size = int(next(options))
+            elif arg == '-i':
+                next(options)
+            elif arg == '-' or not arg.startswith('-'):
+                positional.append(arg)
+
+        async def payload(path=None):
+            if path is None or path == '-':
+                return await reader.readexactly(size)
+            return device.files[path][2]
+
+        if verb == 'install':
+            apk = await payload(positional[-1] if positional else None)
+            status = self._apk_status(apk)
+            if status.startswith('Success'):
+                device.installed.append([apk])
+            return status
+        if verb == 'install-create':
+            session_id = 1000 + len(device.installed) + len(device.install_sessions)
+            device.install_sessions[session_id] = []
+            return 'Success: created install session [{}]\n'.format(session_id)
+        session_id = int(positional[0])
+        if session_id not in device.install_sessions:
+            return 'Failure [INSTALL_FAILED_INTERNAL_ERROR: unknown session {}]\n'.format(session_id)
+        if verb == 'install-write':
+            apk = await payload(positional[2] if len(positional) > 2 else None)
+            device.install_sessions[session_id].append(apk)
+            return 'Success: streamed {} bytes\n'.format(len(apk))
+        apks = device.install_sessions.pop(session_id)
+        if verb == 'install-commit':
+            for apk in apks:
+                status = self._apk_status(apk)
+                if not status.startswith('Success'):
+                    return status
+            device.installed.append(apks)
+        return 'Success\n'
+
+    @staticmethod
+    def _file_command(device: FakeDevice, command: str) -> str:
+        name, _, args = command.partition(' ')
+        paths = shlex.split(args)
+        if name == 'rm':
+            for path in paths[1:]:
+                device.remove(path)
+            return ''
+        lines = []
+        for path in paths:
+            if path in device.files:
+                lines.append('{}  {}\n'.format(hashlib.md5(device.files[path][2]).hexdigest(), path))
+        return ''.join(lines)
+
+    def _logcat_batches(self, batch: int):
+        if self._logcat_cache is None or self._logcat_cache[0] != (batch, self.logcat_lines):
+            self._logcat_cache = ((batch, self.logcat_lines), [
+                b''.join(logcat_line(i) for i in range(offset, min(offset + batch, self.logcat_lines)))
+                for offset in range(0, self.logcat_lines, batch)])
+        return self._logcat_cache[1]
+
+    async def _logcat(self, writer: asyncio.StreamWriter):
+        batch = 1000 if not self.logcat_rate else max(1, self.logcat_rate // 100)
+        started = time.perf_counter()
+        for index, data in enumerate(self._logcat_batches(batch)):
+            writer.write(data)
+            await writer.drain()
+            if self.logcat_rate:
+                delay = started + (index + 1) * batch / self.logcat_rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+    async def _sync(self, device: FakeDevice, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        while True:
+            header = await reader.readexactly(8)
+            signal, length = header[:4], struct.unpack('<I', header[4:])[0]
+            if signal == b'QUIT':
+                return
+            arg = (await reader.readexactly(length)).decode('utf-8')
+            if signal in (b'SEND', b'SND2'):
+                if signal == b'SEND':
+                    path, _, mode = arg.rpartition(',')
+                    mode, flags = int(mode), 0
+                else:
+                    path = arg
+                    mode, flags = struct.unpack('<II', (await reader.readexactly(12))[4:])
+                self.sync_flags.append(flags)
+                data = bytearray()
+                while True:
+                    header = await reader.readexactly(8)
+                    signal, length = header[:4], struct.unpack('<I', header[4:])[0]
+                    if signal == b'DONE':
+                        break
+                    if signal != b'DATA':
+                        self._sync_fail(writer, 'unexpected {}'.format(signal))
+                        return
+                    data += await reader.readexactly(length)
+                if path.startswith(device.readonly):
+                    self._sync_fail(writer, 'Read-only file system')
+                    return
+                device.files[path] = (mode, length, sync_decompress(flags, bytes(data)))
+                writer.write(OKAY + struct.pack('<I', 0))
+            elif signal == b'STAT':
+                writer.write(b'STAT' + struct.pack('<III', *device.stat(arg)))
+            elif signal == b'LIST':
+                for name, (mode, size, mtime) in device.listdir(arg):
+                    encoded = name.encode('utf-8')
+                    writer.write(b'DENT' + struct.pack('<IIII', mode, size, mtime, len(encoded)) + encoded)
+                writer.write(b'DONE' + struct.pack('<IIII', 0, 0, 0, 0))
+            elif signal in (b'RECV', b'RCV2'):
+                flags = 0
+                if signal == b'RCV2':
+                    flags = struct.unpack('<I', (await reader.readexactly(8))[4:])[0]
+                self.sync_flags.append(flags)
+                if arg not in device.files:
+                    self._sync_fail(writer, 'No such file or directory')
+                    return
+                data = memoryview(sync_compress(flags, device.files[arg][2]))
+                for offset in range(0, len(data), 65536):
+                    chunk = data[offset:offset + 65536]
+                    writer.write(b'DATA' + struct.pack('<I', len(chunk)))
+                    writer.write(chunk)
+                    await writer.drain()
+                writer.write(b'DONE' + struct.pack('<I', 0))
+            else:
+                self._sync_fail(writer, 'unknown sync request {}'.format(signal))
+                return
+            await writer.drain()
@@ -0,0 +1,200 @@
+import asyncio
+import hashlib
+import os
+import struct
+
+from fake_adb import SYNC_FEATURES, FakeAdbServer, FakeDevice
+
+A_CNXN = 0x4e584e43
+A_OPEN = 0x4e45504f
+A_OKAY = 0x59414b4f
+A_CLSE = 0x45534c43
+A_WRTE = 0x45545257
+A_AUTH = 0x48545541
+
+HEADER = struct.Struct('<6I')
+
+
+def signature(key: bytes, token: bytes) -> bytes:
+    # what the fake accepts as a signature, tests sign with the same function
+    return hashlib.sha1(key + token).digest()
+
+
+class KeySigner(object):
+
+    def __init__(self, key: bytes, known: bool = True):
+        self.key = key
+        self.known = known
+
+    def sign(self, token: bytes) -> bytes:
+        return signature(self.key if self.known else b'unknown', token)
+
+    def public_key(self) -> bytes:
+        return self.key + b' test@host\0'
+
+
+class _StreamWriter(object):
+    # the writer handed to the FakeAdbServer service handlers, turns writes into WRTE messages
+    # and waits for the OKAY of each before sending the next
+
+    def __init__(self, session: '_Session', local_id: int, remote_id: int):
+        self.session = session
+        self.local_id = local_id
+        self.remote_id = remote_id
+        self.acked = asyncio.Event()
+        self.acked.set()
+        self.closed = False
+        self._buffer = bytearray()
+
+    def write(self, data):
+        self._buffer += data
+
+    async def drain(self):
+        while self._buffer and not self.closed:
+            chunk = bytes(self._buffer[:self.session.max_payload])
+            del self._buffer[:len(chunk)]
+            await self.acked.wait()
+            self.acked.clear()
+            self.session.send(A_WRTE, self.local_id, self.remote_id, chunk)
+        await self.session.writer.drain()
+
+    def is_closing(self) -> bool:
+        return self.closed
+
+
+class _Session(object):
+
+    def __init__(self, adbd: 'FakeAdbd', reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.adbd = adbd
+        self.reader = reader
+        self.writer = writer
+        self.max_payload = adbd.max_payload
+        self.streams = {}
+        self.next_id = 100
+
+    def send(self, command: int, arg0: int, arg1: int, data: bytes = b''):
+        check = sum(data) & 0xffffffff if self.adbd.version < 0x01000001 else 0
+        self.writer.write(HEADER.pack(command, arg0, arg1, len(data), check, command ^ 0xffffffff) + data)
+
+    async def read(self):
+        command, arg0, arg1, length, check, magic = HEADER.unpack(await self.reader.readexactly(HEADER.size))
+        assert magic == command ^ 0xffffffff
+        data = await self.reader.readexactly(length)
+        if check:
+            assert check == sum(data) & 0xffffffff
+        self.adbd.checksums += bool(check)
+        return command, arg0, arg1, data
+
+    async def handshake(self) -> bool:
+        command, version, max_payload, banner = await self.read()
+        assert command == A_CNXN and banner == b'host::\0'
+        self.max_payload = min(self.max_payload, max_payload)
+        if self.adbd.key is not None:
+            token = os.urandom(20)
+            self.send(A_AUTH, 1, 0, token)
+            command, kind, _, data = await self.read()
+            if data != signature(self.adbd.key, token):
+                self.send(A_AUTH, 1, 0, token)
+                command, kind, _, data = await self.read()
+                if kind != 3:
+                    return False
+                self.adbd.public_keys.append(data)
+        props = 'ro.product.name=sdk_phone;ro.product.model=Fake;ro.product.device=generic;features={}'.format(
+            ','.join(self.adbd.device.features))
+        self.send(A_CNXN, self.adbd.version, self.adbd.max_payload, 'device::{}\0'.format(props).encode('utf-8'))
+        return True
+
+    async def run_service(self, local_id: int, remote_id: int, service: str):
+        reader, stream_writer, _ = self.streams[local_id]
+        server = self.adbd.server
+        try:
+            if service == 'sync:':
+                await server._sync(self.adbd.device, reader, stream_writer)
+            elif service.startswith(('shell:', 'exec:')):
+                await server._shell(self.adbd.device, stream_writer, service.partition(':')[2], reader)
+            await stream_writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if local_id in self.streams:
+                del self.streams[local_id]
+                self.send(A_CLSE, local_id, remote_id)
+
+    async def serve(self):
+        tasks = []
+        try:
+            while True:
+                command, arg0, arg1, data = await self.read()
+                if command == A_OPEN:
+                    service = data.rstrip(b'\0').decode('utf-8')
+                    self.adbd.opened.append(service)
+                    if not service.startswith(('shell:', 'exec:', 'sync:')):
+                        self.send(A_CLSE, 0, arg0)
+                        continue
+                    local_id, self.next_id = self.next_id, self.next_id + 1
+                    self.streams[local_id] = (asyncio.StreamReader(), _StreamWriter(self, local_id, arg0), arg0)
+                    self.adbd.max_streams = max(self.adbd.max_streams, len(self.streams))
+                    self.send(A_OKAY, local_id, arg0)
+                    tasks.append(asyncio.ensure_future(self.run_service(local_id, arg0, service)))
+                elif arg1 in self.streams:
+                    reader, stream_writer, remote_id = self.streams[arg1]
+                    if command == A_WRTE:
+                        reader.feed_data(data)
+                        self.send(A_OKAY, arg1, remote_id)
+                    elif command == A_OKAY:
+                        stream_writer.acked.set()
+                    elif command == A_CLSE:
+                        del self.streams[arg1]
+                        stream_writer.closed = True
+                        stream_writer.acked.set()
+                        reader.feed_eof()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+class FakeAdbd(object):
+    # in-process adbd speaking the device side of the adb protocol, services reuse FakeAdbServer's
+
+    def __init__(self, serial: str = 'fake-adbd', key: bytes = None, version: int = 0x01000001,
+                 max_payload: int = 4096, features=('shell_v2', 'cmd') + SYNC_FEATURES, logcat_lines: int = 1000):
+        self.server = FakeAdbServer(serials=(), logcat_lines=logcat_lines)
+        self.device = FakeDevice(serial, features=features)
+        self.key = key
+        self.version = version
+        self.max_payload = max_payload
+        self.host = '127.0.0.1'
+        self.port = 0
+        self.connections = 0
+        self.opened = []
+        self.public_keys = []
+        self.max_streams = 0
+        self.checksums = 0
+        self._server = None
+        self._sessions = {}
+
+    async def __aenter__(self):
+        self._server = await asyncio.start_server(self._handle, self.host, 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self._server.close()
+        for writer in list(self._sessions.values()):
+            writer.close()
+        if self._sessions:
+            await asyncio.gather(*self._sessions, return_exceptions=True)
+        await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        self._sessions[asyncio.current_task()] = writer
+        session = _Session(self, reader, writer)
+        try:
+            if await session.handshake():
+                await session.serve()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._sessions.pop(asyncio.current_task(), None)
+            writer.close()
@@ -0,0 +1,12 @@
+from benchmark import benchmark
+from fake_adb import run
+
+
+def test_benchmark_smoke():
+    results = run(benchmark(size=256 * 1024, lines=2000, device_counts=(1, 3), iterations=5))
+    assert [r['devices'] for r in results] == [1, 3]
+    for r in results:
+        assert r['push_mb_s'] > 0
+        assert r['pull_mb_s'] > 0
+        assert r['lines'] == 2000 * r['devices']
+        assert r['devices_p99_ms'] >= r['devices_p50_ms']
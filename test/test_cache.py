@@ -0,0 +1,76 @@
+import asyncio
+
+import aadb
+from aadb.cache import TTLCache
+from fake_adb import FakeAdbServer, run
+
+
+def test_ttl_and_lru_eviction():
+    cache = TTLCache(maxsize=2, ttl=60, ttls={'short': 0.01})
+    cache.set('short', 1)
+    cache.set('a', 2)
+    assert cache.get('a') == 2
+    cache.set('b', 3)
+    assert 'short' not in cache
+    assert cache.get('a') == 2 and cache.get('b') == 3
+
+    run(asyncio.sleep(0.02))
+    cache.set('short', 4)
+    assert 'a' not in cache
+    run(asyncio.sleep(0.02))
+    assert cache.get('short') is None
+    assert cache.stats()['keys']['short'] == {'hits': 0, 'misses': 1}
+    assert cache.evictions == 2
+
+
+def test_concurrent_misses_share_one_load_and_invalidation_wins():
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    async def main():
+        cache = TTLCache()
+        values = await asyncio.gather(*[cache.get_or_load('k', loader) for _ in range(10)])
+        assert values == [1] * 10
+        pending = asyncio.ensure_future(cache.get_or_load('other', loader))
+        await asyncio.sleep(0)
+        cache.invalidate('other')
+        await pending
+        assert 'other' not in cache
+        return cache
+
+    cache = run(main())
+    assert len(calls) == 2
+    assert cache.stats()['keys']['k'] == {'hits': 0, 'misses': 10}
+
+
+def test_device_metadata_is_cached_and_invalidated():
+    async def main():
+        async with FakeAdbServer(serials=['cached']) as server:
+            fake = server.devices['cached']
+            fake.outputs['getprop'] = '[ro.product.model]: [Pixel]\n[ro.build.version.sdk]: [34]\n'
+            fake.outputs['pm list packages 2>/dev/null'] = 'package:com.example\npackage:com.android.shell\n'
+            fake.outputs['pm uninstall com.example'] = 'Success\n'
+            adb = aadb.create_bridge(port=server.port)
+            device = (await adb.devices())[0]
+            for _ in range(5):
+                assert (await device.get_properties())['ro.build.version.sdk'] == '34'
+                assert 'com.example' in await device.list_package()
+            assert (await adb.devices())[0] is device
+            assert await device.uninstall('com.example')
+            await device.list_package()
+            device.refresh('properties')
+            await device.get_properties()
+            await adb.version()
+            await adb.version()
+            return fake.commands, device.cache.stats(), adb.cache.stats(), server.requests
+
+    commands, stats, bridge_stats, requests = run(main())
+    assert commands.count('getprop') == 2
+    assert commands.count('pm list packages 2>/dev/null') == 2
+    assert stats['keys']['properties'] == {'hits': 4, 'misses': 2}
+    assert bridge_stats['keys']['version'] == {'hits': 1, 'misses': 1}
+    assert requests.count('host:version') == 1
@@ -0,0 +1,99 @@
+import asyncio
+import itertools
+import struct
+
+import pytest
+
+import aadb
+from fake_adb import FakeAdbServer, run
+
+np = pytest.importorskip('numpy')
+
+from aadb.capture import Roi, Source, changed_region, rgb565_to_rgba, roi_diff, to_gray, to_rgb  # noqa: E402
+
+WIDTH, HEIGHT = 64, 48
+
+
+def framebuffer_v2(pixels: bytes) -> bytes:
+    # BGRA as many devices report it
+    return struct.pack('<14I', 2, 32, 0, len(pixels), WIDTH, HEIGHT, 16, 8, 0, 8, 8, 8, 24, 8) + pixels
+
+
+def test_framebuffer_and_screencap_frames():
+    async def main():
+        async with FakeAdbServer() as server:
+            fake = server.devices['emulator-5554']
+            pixels = np.random.randint(0, 256, (HEIGHT, WIDTH, 4), np.uint8)
+            fake.framebuffer = framebuffer_v2(pixels.tobytes())
+            screencap = struct.pack('<3I', WIDTH, HEIGHT, 1)
+            # with the color space word of newer releases
+            fake.outputs['screencap'] = screencap + struct.pack('<I', 1) + pixels.tobytes()
+            legacy = np.arange(WIDTH * HEIGHT, dtype=np.uint16).reshape(HEIGHT, WIDTH)
+            adb = aadb.create_bridge(port=server.port)
+            device = (await adb.devices())[0]
+
+            capture = device.capture()
+            grabbed = [await capture.grab() for _ in range(4)]
+            fmt = capture.format
+            shot = await device.capture(Source.SCREENCAP).grab()
+            fake.outputs['screencap'] = screencap + pixels.tobytes()
+            old_release = await device.capture(Source.SCREENCAP).grab()
+            fake.framebuffer = struct.pack('<4I', 16, WIDTH * HEIGHT * 2, WIDTH, HEIGHT) + legacy.tobytes()
+            rgb565 = device.capture()
+            packed = await rgb565.grab()
+            return pixels, grabbed, fmt, capture.format, shot, old_release, legacy, packed, rgb565.format
+
+    pixels, grabbed, fmt, fmt_after, shot, old_release, legacy, packed, legacy_fmt = run(main())
+    assert grabbed[0].shape == (HEIGHT, WIDTH, 4) and fmt.order == 'BGRA'
+    assert all((frame == pixels).all() for frame in grabbed)
+    assert fmt_after is fmt
+    # three buffers take turns
+    assert np.shares_memory(grabbed[0], grabbed[3]) and not np.shares_memory(grabbed[0], grabbed[1])
+    assert (to_rgb(grabbed[0], fmt.order) == pixels[..., 2::-1]).all()
+    assert (shot == pixels).all() and (old_release == pixels).all()
+    assert legacy_fmt.order == 'RGB565' and (packed == legacy).all()
+
+
+def test_continuous_capture_drops_stale_frames():
+    counter = itertools.count()
+
+    def next_frame():
+        return framebuffer_v2(bytes([next(counter) % 256]) * (WIDTH * HEIGHT * 4))
+
+    async def main():
+        async with FakeAdbServer() as server:
+            server.devices['emulator-5554'].framebuffer = next_frame
+            adb = aadb.create_bridge(port=server.port)
+            capture = (await adb.devices())[0].capture()
+            seen = []
+            intact = True
+            async for frame in capture.frames(fps=200):
+                value = frame.pixels[0, 0, 0]
+                await asyncio.sleep(0.05)
+                # the frame being looked at is never written over
+                intact = intact and (frame.pixels == value).all()
+                seen.append(frame.index)
+                if len(seen) == 5:
+                    break
+            return seen, intact, capture
+
+    seen, intact, capture = run(main())
+    assert intact
+    assert seen == sorted(seen) and seen[-1] > len(seen)
+    assert capture.dropped > 0 and capture.captured > len(seen)
+
+
+def test_conversion_and_diff_helpers():
+    a = np.zeros((10, 20, 4), np.uint8)
+    b = a.copy()
+    b[2:4, 5:9] = 200
+    b[3, 6, 1] = 201
+    assert changed_region(a, b) == Roi(5, 2, 4, 2)
+    assert changed_region(a, a) is None
+    assert roi_diff(a, b, Roi(5, 2, 4, 2)) == 1.0
+    assert roi_diff(a, b, Roi(0, 0, 10, 10)) == pytest.approx(8 / 100)
+    assert roi_diff(a, b, threshold=200) == pytest.approx(1 / 200)
+    gray = to_gray(np.array([[[255, 255, 255, 255], [255, 0, 0, 255]]], np.uint8))
+    assert gray.tolist() == [[255, 76]]
+    rgba = rgb565_to_rgba(np.array([[0xffff, 0xf800]], np.uint16))
+    assert rgba.tolist() == [[[255, 255, 255, 255], [255, 0, 0, 255]]]
@@ -0,0 +1,78 @@
+import os
+import tempfile
+
+import pytest
+
+import aadb
+from aadb import compression
+from fake_adb import FakeAdbServer, run
+
+PAYLOAD = b''.join(b'I/ActivityManager( 1234): line %d of a very compressible log\n' % i for i in range(20000))
+
+
+def _roundtrip(preference, features=None):
+    async def main():
+        kwargs = {} if features is None else {'features': features}
+        async with FakeAdbServer(serials=['codec'], **kwargs) as server:
+            device = (await aadb.create_bridge(port=server.port).devices())[0]
+            device.compression = preference
+            with tempfile.TemporaryDirectory() as workdir:
+                src = os.path.join(workdir, 'log.txt')
+                with open(src, 'wb') as f:
+                    f.write(PAYLOAD)
+                await device.push(src, '/sdcard/log.txt')
+            pulled = bytearray()
+            await device.pull('/sdcard/log.txt', pulled)
+            return server, await device.sync_compression(), bytes(pulled)
+
+    return run(main())
+
+
+@pytest.mark.parametrize('name,module', [('brotli', 'brotli'), ('lz4', 'lz4.frame'), ('zstd', 'zstandard')])
+def test_sync_v2_codecs(name, module):
+    pytest.importorskip(module)
+    server, negotiated, pulled = _roundtrip(name)
+    assert negotiated == name
+    assert server.devices['codec'].files['/sdcard/log.txt'][2] == PAYLOAD
+    assert pulled == PAYLOAD
+    assert server.sync_flags == [compression.FLAGS[name]] * 2
+
+
+def test_sync_falls_back_to_v1_without_server_support():
+    server, negotiated, pulled = _roundtrip('any', features=('shell_v2', 'cmd'))
+    assert negotiated is None
+    assert pulled == PAYLOAD
+    assert server.devices['codec'].files['/sdcard/log.txt'][2] == PAYLOAD
+
+
+def test_choose_prefers_shared_codecs():
+    features = ['sendrecv_v2', 'sendrecv_v2_brotli']
+    assert compression.choose(features, None) is None
+    assert compression.choose(['shell_v2'], 'any') is None
+    assert compression.choose(['sendrecv_v2'], 'any') == 'none'
+    if 'brotli' in compression.available():
+        assert compression.choose(features, 'any') == 'brotli'
+    assert compression.choose(features, 'zstd') == 'none'
+
+
+def test_changing_compression_after_a_transfer():
+    if not compression.available():
+        pytest.skip('no compression codec installed')
+
+    async def main():
+        async with FakeAdbServer(serials=['codec']) as server:
+            device = (await aadb.create_bridge(port=server.port).devices())[0]
+            with tempfile.TemporaryDirectory() as workdir:
+                src = os.path.join(workdir, 'log.txt')
+                with open(src, 'wb') as f:
+                    f.write(PAYLOAD)
+                await device.push(src, '/sdcard/v2.txt')
+                device.compression = None
+                await device.push(src, '/sdcard/v1.txt')
+            return list(server.sync_flags), await device.sync_compression(), server.devices['codec'].files
+
+    flags, negotiated, files = run(main())
+    # SEND of sync v1 carries no flags, the fake server records it as 0
+    assert flags[0] != 0 and flags[1] == 0
+    assert negotiated is None
+    assert files['/sdcard/v1.txt'][2] == PAYLOAD
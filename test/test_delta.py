@@ -0,0 +1,82 @@
+import os
+import tempfile
+
+import aadb
+from fake_adb import FakeAdbServer, run
+
+
+def _make_tree(workdir):
+    src = os.path.join(workdir, 'data')
+    for rel_path in ('a.txt', 'sub/b.txt', 'sub/deeper/c.txt'):
+        path = os.path.join(src, *rel_path.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(rel_path.encode('utf-8') * 100)
+    return src
+
+
+def test_sync_stat_and_list():
+    async def main():
+        async with FakeAdbServer() as server:
+            device = server.devices['emulator-5554']
+            device.put_file('/sdcard/data/a.txt', b'abc', mtime=1234)
+            device.put_file('/sdcard/data/sub/b.txt', b'b')
+            adb = aadb.create_bridge(port=server.port)
+            async with (await adb.devices())[0].tp.sync() as session:
+                stat = await session.stat('/sdcard/data/a.txt')
+                missing = await session.stat('/sdcard/nothing')
+                names = [entry.name async for entry in session.list('/sdcard/data')]
+                tree = await session.tree('/sdcard/data')
+            return stat, missing, names, tree
+
+    stat, missing, names, tree = run(main())
+    assert stat.is_file and stat.size == 3 and stat.mtime == 1234
+    assert not missing.exists
+    assert names == ['a.txt', 'sub']
+    assert sorted(tree) == ['a.txt', 'sub', 'sub/b.txt']
+    assert tree['sub'].is_dir
+
+
+def test_push_delta_sends_only_changes():
+    async def main():
+        async with FakeAdbServer() as server:
+            adb = aadb.create_bridge(port=server.port)
+            device = (await adb.devices())[0]
+            with tempfile.TemporaryDirectory() as workdir:
+                src = _make_tree(workdir)
+                first = await device.push_delta(src, '/sdcard')
+                second = await device.push_delta(src, '/sdcard')
+                with open(os.path.join(src, 'sub', 'b.txt'), 'ab') as f:
+                    f.write(b'more')
+                third = await device.push_delta(src, '/sdcard')
+            return first, second, third
+
+    first, second, third = run(main())
+    assert first.sent_files == 3 and first.skipped_files == 0
+    assert second.sent_files == 0 and second.skipped_files == 3 and second.skipped_bytes == first.sent_bytes
+    assert third.sent_files == 1 and third.results[0].remote == '/sdcard/data/sub/b.txt'
+
+
+def test_push_delta_checksum_and_delete():
+    async def main():
+        async with FakeAdbServer() as server:
+            adb = aadb.create_bridge(port=server.port)
+            device = (await adb.devices())[0]
+            fake = server.devices[device.serial]
+            with tempfile.TemporaryDirectory() as workdir:
+                src = _make_tree(workdir)
+                await device.push_delta(src, '/sdcard')
+                # same size and content but a different mtime, only the hash tells them apart
+                fake.put_file('/sdcard/data/a.txt', fake.files['/sdcard/data/a.txt'][2], mtime=1)
+                mode, mtime, data = fake.files['/sdcard/data/sub/b.txt']
+                fake.put_file('/sdcard/data/sub/b.txt', data[::-1], mtime=mtime)
+                fake.put_file('/sdcard/data/stale/old.txt', b'old')
+                report = await device.push_delta(src, '/sdcard', checksum=True, delete=True)
+            return fake, report
+
+    fake, report = run(main())
+    assert [result.remote for result in report.results] == ['/sdcard/data/sub/b.txt']
+    assert report.skipped_files == 2
+    assert report.deleted == ['/sdcard/data/stale']
+    assert not any(path.startswith('/sdcard/data/stale') for path in fake.files)
+    assert any(command.startswith('md5sum ') for command in fake.commands)
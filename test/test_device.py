@@ -0,0 +1,165 @@
+import asyncio
+import os
+import tempfile
+
+import aadb
+from fake_adb import FakeAdbServer, run
+
+
+def test_parallel_devices_route_their_own_commands():
+    serials = ['device-{:03d}'.format(i) for i in range(100)]
+
+    async def main():
+        async with FakeAdbServer(serials=serials) as server:
+            adb = aadb.create_bridge(port=server.port)
+            devices = await adb.devices()
+            outputs = {device.serial: [] for device in devices}
+            await asyncio.gather(*[device.shell('echo {}'.format(device.serial), pipeline=outputs[device.serial].append)
+                                   for device in devices])
+            return server, outputs
+
+    server, outputs = run(main())
+    assert sorted(outputs) == serials
+    for serial in serials:
+        assert server.devices[serial].commands == ['echo {}'.format(serial)]
+        assert outputs[serial] == [serial]
+
+
+def test_parallel_push_lands_on_each_device():
+    serials = ['device-{:03d}'.format(i) for i in range(20)]
+
+    async def main():
+        async with FakeAdbServer(serials=serials) as server:
+            adb = aadb.create_bridge(port=server.port)
+            devices = await adb.devices()
+            with tempfile.TemporaryDirectory() as workdir:
+                for device in devices:
+                    with open(os.path.join(workdir, device.serial), 'wb') as f:
+                        f.write(device.serial.encode('utf-8'))
+                await asyncio.gather(*[device.push(os.path.join(workdir, device.serial), '/sdcard/serial')
+                                       for device in devices])
+            return server
+
+    server = run(main())
+    for serial in serials:
+        assert server.devices[serial].files['/sdcard/serial'][2] == serial.encode('utf-8')
+
+
+def test_file_push_reports_like_a_directory_push():
+    async def main():
+        async with FakeAdbServer(serials=['single']) as server:
+            server.devices['single'].readonly = ('/system/',)
+            device = (await aadb.create_bridge(port=server.port).devices())[0]
+            with tempfile.TemporaryDirectory() as workdir:
+                src = os.path.join(workdir, 'a.txt')
+                with open(src, 'wb') as f:
+                    f.write(b'12345')
+                return await device.push(src, '/sdcard/a.txt'), await device.push(src, '/system/a.txt')
+
+    pushed, refused = run(main())
+    assert [(r.remote, r.size, r.success) for r in pushed] == [('/sdcard/a.txt', 5, True)]
+    assert len(refused) == 1 and not refused[0].success and 'Read-only' in refused[0].error
+
+
+def _make_tree(workdir):
+    src = os.path.join(workdir, 'assets')
+    for rel_path in ('a.txt', 'sub/b.txt', 'sub/deeper/c.txt', 'other/d.txt'):
+        path = os.path.join(src, *rel_path.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(rel_path.encode('utf-8'))
+    os.makedirs(os.path.join(src, 'empty'))
+    return src
+
+
+def test_directory_push_uses_one_sync_session():
+    async def main():
+        async with FakeAdbServer(serials=['batch']) as server:
+            device = (await aadb.create_bridge(port=server.port).devices())[0]
+            with tempfile.TemporaryDirectory() as workdir:
+                report = await device.push(_make_tree(workdir), '/sdcard')
+            return server, report
+
+    server, report = run(main())
+    files = server.devices['batch'].files
+    assert sorted(files) == ['/sdcard/assets/a.txt', '/sdcard/assets/other/d.txt',
+                             '/sdcard/assets/sub/b.txt', '/sdcard/assets/sub/deeper/c.txt']
+    assert files['/sdcard/assets/sub/deeper/c.txt'][2] == b'sub/deeper/c.txt'
+    assert all(r.success for r in report) and len(report) == 4
+    assert server.requests.count('sync:') == 1
+    assert server.devices['batch'].commands == ["mkdir -p /sdcard/assets/empty"]
+
+
+def test_directory_push_reports_failures_and_continues():
+    async def main():
+        async with FakeAdbServer(serials=['batch']) as server:
+            server.devices['batch'].readonly = ('/sdcard/assets/other',)
+            device = (await aadb.create_bridge(port=server.port).devices())[0]
+            with tempfile.TemporaryDirectory() as workdir:
+                report = await device.push(_make_tree(workdir), '/sdcard')
+            return server, report
+
+    server, report = run(main())
+    failed = [r for r in report if not r.success]
+    assert len(report) == 4
+    assert [r.remote for r in failed] == ['/sdcard/assets/other/d.txt']
+    assert failed[0].error == 'Read-only file system'
+    assert len(server.devices['batch'].files) == 3
+
+
+def test_pull_into_file_memory_and_iterator():
+    payload = os.urandom(3 * 1024 * 1024 + 17)
+
+    async def main():
+        async with FakeAdbServer(serials=['pull']) as server:
+            server.devices['pull'].put_file('/sdcard/dump.bin', payload)
+            device = (await aadb.create_bridge(port=server.port).devices())[0]
+            with tempfile.TemporaryDirectory() as workdir:
+                await device.pull('/sdcard/dump.bin', os.path.join(workdir, 'dump.bin'))
+                with open(os.path.join(workdir, 'dump.bin'), 'rb') as f:
+                    from_file = f.read()
+            in_memory = bytearray()
+            await device.pull('/sdcard/dump.bin', in_memory)
+            chunks = []
+            async for view in device.pull_iter('/sdcard/dump.bin', buffer_size=1 << 16):
+                assert len(view) <= 1 << 16
+                chunks.append(bytes(view))
+            try:
+                await device.pull('/sdcard/missing.bin', bytearray())
+            except ConnectionError as e:
+                error = str(e)
+            return from_file, bytes(in_memory), b''.join(chunks), error
+
+    from_file, in_memory, iterated, error = run(main())
+    assert from_file == payload
+    assert in_memory == payload
+    assert iterated == payload
+    assert 'No such file or directory' in error
+
+
+def test_exec_out_keeps_binary_output_intact():
+    payload = b'\x89PNG\r\n\x1a\n' + os.urandom(300000) + b'\xff\xfe\r\n\x00'
+
+    async def main():
+        async with FakeAdbServer(serials=['raw']) as server:
+            server.devices['raw'].outputs['screencap -p'] = payload
+            device = (await aadb.create_bridge(port=server.port).devices())[0]
+            collected = await device.exec_out('screencap -p')
+
+            chunks = []
+
+            async def consumer(data):
+                await asyncio.sleep(0)
+                chunks.append(data)
+
+            assert await device.exec_out('screencap -p', consumer=consumer) is None
+            with tempfile.TemporaryFile() as f:
+                await device.exec_out('screencap -p', fd=f)
+                f.seek(0)
+                written = f.read()
+            iterated = b''.join([data async for data in device.exec_iter('screencap -p')])
+            return server, collected, b''.join(chunks), written, iterated
+
+    server, collected, streamed, written, iterated = run(main())
+    assert collected == streamed == written == iterated == payload
+    assert server.requests.count('exec:screencap -p') == 4
@@ -0,0 +1,143 @@
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+from aadb import direct
+from aadb.direct import AdbdConnection
+from aadb.transport import Client
+from fake_adb import run
+from fake_adbd import FakeAdbd, KeySigner
+
+
+def test_device_api_over_one_connection():
+    async def main():
+        async with FakeAdbd(logcat_lines=3000) as adbd:
+            device = await direct.connect('127.0.0.1', adbd.port)
+            try:
+                outputs = [[] for _ in range(20)]
+                await asyncio.gather(*[device.shell('echo {}'.format(i), pipeline=outputs[i].append)
+                                       for i in range(20)])
+                lines = []
+                await device.logcat(lines.append)
+                features = await device.features()
+                compression = await device.sync_compression()
+                with tempfile.TemporaryDirectory() as workdir:
+                    src = os.path.join(workdir, 'blob')
+                    data = os.urandom(300000)
+                    with open(src, 'wb') as f:
+                        f.write(data)
+                    await device.push(src, '/sdcard/blob')
+                    pulled = bytearray()
+                    await device.pull('/sdcard/blob', pulled)
+                echoed = await device.exec_out('echo raw')
+            finally:
+                await device.tp.pool.close()
+            return adbd, outputs, lines, features, compression, data, pulled, echoed
+
+    adbd, outputs, lines, features, compression, data, pulled, echoed = run(main())
+    assert outputs == [[str(i)] for i in range(20)]
+    assert len(lines) == 3000
+    assert 'shell_v2' in features and compression == 'zstd'
+    assert adbd.device.files['/sdcard/blob'][2] == data and pulled == data
+    assert echoed == b'raw\n'
+    assert adbd.connections == 1
+    assert adbd.max_streams > 1
+
+
+def test_checksums_and_small_payloads():
+    async def main():
+        async with FakeAdbd(version=0x01000000, max_payload=1024) as adbd:
+            device = await direct.connect('127.0.0.1', adbd.port, compression=None)
+            try:
+                with tempfile.TemporaryDirectory() as workdir:
+                    src = os.path.join(workdir, 'blob')
+                    with open(src, 'wb') as f:
+                        f.write(os.urandom(50000))
+                    await device.push(src, '/sdcard/blob')
+                    size = os.path.getsize(src)
+            finally:
+                await device.tp.pool.close()
+            return adbd, size
+
+    adbd, size = run(main())
+    assert len(adbd.device.files['/sdcard/blob'][2]) == size
+    assert adbd.checksums > 50
+
+
+def test_stream_window_holds_back_okays():
+    async def main():
+        async with FakeAdbd(logcat_lines=2000, max_payload=4096) as adbd:
+            async with AdbdConnection('127.0.0.1', adbd.port) as connection:
+                reader = asyncio.StreamReader(limit=1024)
+                stream = await connection.open('shell:logcat', reader)
+                await asyncio.sleep(0.2)
+                buffered = len(reader._buffer)
+                data = bytearray()
+                while True:
+                    chunk = await reader.read(65536)
+                    if not chunk:
+                        break
+                    data += chunk
+                stream.close()
+            return buffered, data
+
+    buffered, data = run(main())
+    # adbd waits for an OKAY before every WRTE, a paused stream receives at most one more payload
+    assert 2048 < buffered <= 2048 + 4096
+    assert data.count(b'\n') == 2000
+
+
+def test_authentication():
+    async def main(signer):
+        async with FakeAdbd(key=b'secret') as adbd:
+            try:
+                async with AdbdConnection('127.0.0.1', adbd.port, signer=signer) as connection:
+                    return connection.state, adbd.public_keys
+            except ConnectionError as e:
+                return e, adbd.public_keys
+
+    assert run(main(KeySigner(b'secret'))) == ('device', [])
+    state, keys = run(main(KeySigner(b'other-key', known=False)))
+    assert state == 'device' and keys == [b'other-key test@host\0']
+    error, _ = run(main(None))
+    assert isinstance(error, ConnectionError)
+
+
+def test_refused_and_host_only_services():
+    async def main():
+        async with FakeAdbd() as adbd:
+            async with AdbdConnection('127.0.0.1', adbd.port) as connection:
+                errors = []
+                for service in ('reverse:list-forward', 'host:track-devices'):
+                    client = await connection.acquire(connection.serial)
+                    try:
+                        await client.call(service)
+                    except ConnectionError as e:
+                        errors.append(str(e))
+                    finally:
+                        await client.__aexit__(None, None, None)
+                async with Client(pool=connection) as client:
+                    await client.call('host:devices-l')
+                    listing = await client.receive()
+            return errors, listing
+
+    errors, listing = run(main())
+    assert 'refused' in errors[0] and 'not available' in errors[1]
+    assert listing.startswith('127.0.0.1:') and listing.split()[1] == 'device'
+    assert 'model:Fake' in listing
+
+
+@pytest.mark.parametrize('lines', [0, 1])
+def test_closing_connection_ends_streams(lines):
+    async def main():
+        async with FakeAdbd(logcat_lines=lines) as adbd:
+            connection = await AdbdConnection('127.0.0.1', adbd.port).connect()
+            stream = await connection.open('shell:logcat')
+            await connection.close()
+            await asyncio.wait_for(stream.reader.read(), 5)
+            return stream.closed, len(connection)
+
+    closed, streams = run(main())
+    assert closed and streams == 0
@@ -0,0 +1,58 @@
+import asyncio
+import os
+import tempfile
+
+import aadb
+from aadb.fleet import Fleet
+from fake_adb import FakeAdbServer, run
+
+
+def test_fan_out_push_reaches_every_device():
+    serials = ['rack-{:02d}'.format(i) for i in range(12)]
+    progress = {}
+
+    async def main():
+        async with FakeAdbServer(serials=serials) as server:
+            adb = aadb.create_bridge(port=server.port)
+            server.devices['rack-03'].readonly = ('/sdcard/',)
+            with tempfile.TemporaryDirectory() as workdir:
+                src = os.path.join(workdir, 'build.bin')
+                with open(src, 'wb') as f:
+                    f.write(os.urandom(1 << 20))
+                results = await adb.fan_out_push(src, '/sdcard/build.bin', progress_func=lambda serial, total, sent:
+                                                 progress.__setitem__(serial, sent))
+                data = open(src, 'rb').read()
+                mtime = int(os.path.getmtime(src))
+            return server, results, data, mtime
+
+    server, results, data, mtime = run(main())
+    assert [result.serial for result in results] == serials
+    for result in results:
+        if result.serial == 'rack-03':
+            assert not result.success and 'Read-only' in result.error
+            continue
+        assert result.success and result.size == len(data)
+        assert server.devices[result.serial].files['/sdcard/build.bin'] == (0o100644, mtime, data)
+        assert progress[result.serial] == len(data)
+
+
+def test_slow_device_times_out_alone():
+    async def main():
+        async with FakeAdbServer(serials=['fast', 'stuck']) as server:
+            aadb.create_bridge(port=server.port)
+            original = server._sync
+
+            async def sync(device, reader, writer):
+                if device.serial == 'stuck':
+                    await asyncio.sleep(1)
+                await original(device, reader, writer)
+
+            server._sync = sync
+            with tempfile.TemporaryDirectory() as workdir:
+                src = os.path.join(workdir, 'empty.bin')
+                open(src, 'wb').close()
+                return await Fleet(['fast', 'stuck'], timeout=0.2).push(src, '/sdcard/empty.bin')
+
+    fast, stuck = run(main())
+    assert fast.success and fast.size == 0
+    assert not stuck.success and stuck.error == 'TimeoutError'
@@ -0,0 +1,87 @@
+import asyncio
+
+import aadb
+from aadb.transport import Stats
+from fake_adb import FakeAdbServer, run
+
+
+def test_stat_listdir_and_walk_share_one_session():
+    async def main():
+        async with FakeAdbServer() as server:
+            fake = server.devices['emulator-5554']
+            fake.put_file('/sdcard/a.txt', b'12345', mtime=1700000000)
+            fake.put_file('/sdcard/DCIM/x.jpg', b'x' * 100)
+            fake.put_file('/sdcard/DCIM/old/y.jpg', b'y')
+            fake.put_file('/sdcard/Music/z.mp3', b'z' * 7)
+            for i in range(3000):
+                fake.put_file('/sdcard/many/{:05d}'.format(i), b'')
+            adb = aadb.create_bridge(port=server.port)
+            device = (await adb.devices())[0]
+
+            stat = await device.stat('/sdcard/a.txt')
+            missing = await device.stat('/sdcard/nope')
+            top = sorted([entry async for entry in device.listdir('/sdcard')])
+            count = 0
+            async for _ in device.listdir('/sdcard/many'):
+                count += 1
+            walked = []
+            async for path, dirs, files in device.walk('/sdcard/'):
+                dirs[:] = [d for d in dirs if d.name != 'many']
+                walked.append((path, sorted(d.name for d in dirs), sorted(f.name for f in files)))
+            sessions = server.requests.count('sync:')
+
+            # leaving a listing early drops the session, the next call opens another one
+            async for _ in device.listdir('/sdcard/many'):
+                break
+            again = await device.stat('/sdcard/DCIM')
+            await adb.close()
+            return stat, missing, top, count, walked, sessions, again, server.requests.count('sync:')
+
+    stat, missing, top, count, walked, sessions, again, reopened = run(main())
+    assert stat == ('a.txt', 0o100644, 5, 1700000000) and stat.is_file
+    assert not missing.exists
+    assert [entry.name for entry in top] == ['DCIM', 'Music', 'a.txt', 'many']
+    assert top[0].mode & Stats.S_IFMT == Stats.S_IFDIR
+    assert count == 3000
+    assert walked == [('/sdcard', ['DCIM', 'Music'], ['a.txt']),
+                      ('/sdcard/DCIM', ['old'], ['x.jpg']),
+                      ('/sdcard/DCIM/old', [], ['y.jpg']),
+                      ('/sdcard/Music', [], ['z.mp3'])]
+    assert sessions == 1
+    assert again.is_dir and reopened == 2
+
+
+def test_nested_calls_inside_a_listing():
+    async def main():
+        async with FakeAdbServer() as server:
+            fake = server.devices['emulator-5554']
+            for name in 'abc':
+                fake.put_file('/sdcard/{}/inner'.format(name), name.encode())
+            adb = aadb.create_bridge(port=server.port)
+            device = (await adb.devices())[0]
+            nested = {}
+            async for entry in device.listdir('/sdcard'):
+                nested[entry.name] = ((await device.stat('/sdcard/{}/inner'.format(entry.name))).size,
+                                      [e.name async for e in device.listdir('/sdcard/' + entry.name)])
+            await adb.close()
+            return nested
+
+    nested = run(asyncio.wait_for(main(), 10))
+    assert nested == {name: (1, ['inner']) for name in 'abc'}
+
+
+def test_close_with_an_abandoned_listing():
+    async def main():
+        async with FakeAdbServer() as server:
+            server.devices['emulator-5554'].put_file('/sdcard/a', b'a')
+            server.devices['emulator-5554'].put_file('/sdcard/b', b'b')
+            adb = aadb.create_bridge(port=server.port)
+            device = (await adb.devices())[0]
+            listing = device.listdir('/sdcard')
+            first = await listing.__anext__()
+            await asyncio.wait_for(adb.close(), 5)
+            closed = device._fs is None
+            await listing.aclose()
+            return first.name, closed
+
+    assert run(main()) == ('a', True)
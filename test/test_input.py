@@ -0,0 +1,92 @@
+import asyncio
+import struct
+
+import pytest
+
+from aadb import KeyCode
+from aadb.input import (ABS_MT_POSITION_X, ABS_MT_POSITION_Y, ABS_MT_SLOT, ABS_MT_TRACKING_ID, BTN_TOUCH, EV_ABS,
+                        EV_KEY, EV_SYN, InputScript, parse_input_devices)
+import aadb
+from fake_adb import FakeAdbServer, run
+
+GETEVENT = '''add device 1: /dev/input/event0
+  name:     "gpio-keys"
+  events:
+    KEY (0001): 0072  0073  0074
+  input props:
+    <none>
+add device 2: /dev/input/event2
+  name:     "synaptics_dsx"
+  events:
+    KEY (0001): 014a
+    ABS (0003): 002f  : value 0, min 0, max 9, fuzz 0, flat 0, resolution 0
+                0035  : value 0, min 0, max 4095, fuzz 0, flat 0, resolution 0
+                0036  : value 0, min 0, max 2399, fuzz 0, flat 0, resolution 0
+                0039  : value 0, min 0, max 65535, fuzz 0, flat 0, resolution 0
+  input props:
+    INPUT_PROP_DIRECT
+'''
+
+
+def test_script_coalesces_keys():
+    script = (InputScript().key(KeyCode.KEYCODE_HOME, 4).key('KEYCODE_MENU')
+              .key(KeyCode.KEYCODE_POWER, longpress=True).text("it's me").tap(10, 20.6)
+              .sleep(0.1).swipe(1, 2, 3, 4, 50).key(KeyCode.KEYCODE_ENTER))
+    assert script.commands() == ['input keyevent 3 4 KEYCODE_MENU',
+                                 'input keyevent --longpress 26',
+                                 "input text 'it'\"'\"'s%sme'",
+                                 'input tap 10 20',
+                                 'sleep 0.1',
+                                 'input swipe 1 2 3 4 50',
+                                 'input keyevent 66']
+    assert InputScript('touchscreen').tap(1, 2).script() == 'input touchscreen tap 1 2'
+    assert InputScript().key(KeyCode.KEYCODE_WAKEUP, KeyCode.KEYCODE_MENU).script() == 'input keyevent 224 82'
+
+
+def test_parse_input_devices():
+    keys, touch = parse_input_devices(GETEVENT)
+    assert (keys.path, keys.name, keys.axes, keys.multitouch) == ('/dev/input/event0', 'gpio-keys', {}, False)
+    assert touch.name == 'synaptics_dsx' and touch.multitouch
+    assert touch.axes[ABS_MT_POSITION_X] == (0, 4095) and touch.axes[ABS_MT_SLOT] == (0, 9)
+
+
+def test_batch_is_one_shell_and_touch_events():
+    async def main():
+        async with FakeAdbServer() as server:
+            fake = server.devices['emulator-5554']
+            fake.outputs['getevent -p'] = GETEVENT
+            fake.outputs['wm size'] = 'Physical size: 1080x2400\n'
+            fake.outputs['getprop'] = '[ro.product.cpu.abi]: [arm64-v8a]\n'
+            adb = aadb.create_bridge(port=server.port)
+            device = (await adb.devices())[0]
+            await device.keyevent(*[KeyCode.KEYCODE_DPAD_DOWN] * 50)
+            keys = list(fake.commands)
+            async with await device.touchscreen() as touch:
+                await touch.tap(540, 1200)
+                await touch.pinch((540, 1200), 600, 200, steps=10, interval=0)
+                for strokes in ([], [[(1, 2)], []]):
+                    with pytest.raises(ValueError):
+                        await touch.gesture(strokes)
+                sent = touch.events
+            while '/dev/input/event2' not in fake.files:
+                await asyncio.sleep(0.01)
+            return keys, sent, fake.files['/dev/input/event2'][2]
+
+    keys, sent, data = run(main())
+    assert keys == ['input keyevent ' + ' '.join(['20'] * 50)]
+    events = [event[2:] for event in struct.iter_unpack('<qqHHi', data)]
+    assert len(events) == sent
+    assert events[:6] == [(EV_ABS, ABS_MT_SLOT, 0), (EV_ABS, ABS_MT_TRACKING_ID, 1),
+                          (EV_ABS, ABS_MT_POSITION_X, 2049), (EV_ABS, ABS_MT_POSITION_Y, 1200),
+                          (EV_KEY, BTN_TOUCH, 1), (EV_SYN, 0, 0)]
+    assert events[6:10] == [(EV_ABS, ABS_MT_SLOT, 0), (EV_ABS, ABS_MT_TRACKING_ID, -1),
+                            (EV_KEY, BTN_TOUCH, 0), (EV_SYN, 0, 0)]
+    # the pinch puts two fingers down in one frame and lifts both at the end
+    pinch = events[10:]
+    assert pinch[:4] == [(EV_ABS, ABS_MT_SLOT, 0), (EV_ABS, ABS_MT_TRACKING_ID, 2),
+                         (EV_ABS, ABS_MT_POSITION_X, 911), (EV_ABS, ABS_MT_POSITION_Y, 1200)]
+    assert (EV_ABS, ABS_MT_TRACKING_ID, 3) in pinch[4:9]
+    assert pinch[-6:] == [(EV_ABS, ABS_MT_SLOT, 0), (EV_ABS, ABS_MT_TRACKING_ID, -1),
+                          (EV_ABS, ABS_MT_SLOT, 1), (EV_ABS, ABS_MT_TRACKING_ID, -1),
+                          (EV_KEY, BTN_TOUCH, 0), (EV_SYN, 0, 0)]
+    assert pinch.count((EV_SYN, 0, 0)) == 12
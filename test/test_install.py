@@ -0,0 +1,79 @@
+import os
+import tempfile
+
+import pytest
+
+import aadb
+from fake_adb import FakeAdbServer, run
+
+
+def _apk(workdir, name, data):
+    path = os.path.join(workdir, name)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def _install(method, *args, **kwargs):
+    async def main():
+        async with FakeAdbServer() as server:
+            adb = aadb.create_bridge(port=server.port)
+            device = (await adb.devices())[0]
+            try:
+                result = await getattr(device, method)(*args, **kwargs)
+            except RuntimeError as e:
+                result = e
+            return server.devices[device.serial], result
+
+    return run(main())
+
+
+def test_streamed_install_skips_staging():
+    progress = []
+    with tempfile.TemporaryDirectory() as workdir:
+        apk = _apk(workdir, 'game.apk', os.urandom(3 << 20))
+        fake, result = _install('install', apk, reinstall=True, progress_func=lambda total, sent: progress.append(sent))
+        data = open(apk, 'rb').read()
+    assert result.success and result.streamed
+    assert fake.installed == [[data]]
+    assert fake.commands == ['cmd package install -S {} -r'.format(len(data))]
+    assert not fake.files
+    assert progress[-1] == len(data)
+
+
+def test_legacy_install_removes_staged_apk():
+    with tempfile.TemporaryDirectory() as workdir:
+        apk = _apk(workdir, 'app.apk', b'apk-bytes')
+        fake, result = _install('install', apk, streamed=False)
+    assert result.success and not result.streamed
+    assert fake.installed == [[b'apk-bytes']]
+    assert fake.commands[-1] == 'rm -f /data/local/tmp/app.apk'
+    assert not fake.files
+
+
+def test_install_failure_raises():
+    with tempfile.TemporaryDirectory() as workdir:
+        apk = _apk(workdir, 'bad.apk', b'BAD apk')
+        fake, error = _install('install', apk)
+    assert isinstance(error, RuntimeError)
+    assert 'INSTALL_PARSE_FAILED_NOT_APK' in str(error)
+    assert not fake.installed
+
+
+@pytest.mark.parametrize('streamed', [True, False])
+def test_install_multiple_uses_one_session(streamed):
+    with tempfile.TemporaryDirectory() as workdir:
+        apks = [_apk(workdir, 'base.apk', b'base' * 1000), _apk(workdir, 'split_config.arm64.apk', b'split')]
+        fake, result = _install('install_multiple', apks, streamed=streamed)
+    assert result.success and result.paths == apks
+    assert fake.installed == [[b'base' * 1000, b'split']]
+    assert not fake.install_sessions and not fake.files
+
+
+def test_install_multiple_failed_commit():
+    with tempfile.TemporaryDirectory() as workdir:
+        apks = [_apk(workdir, 'base.apk', b'base'), _apk(workdir, 'split.apk', b'BAD split')]
+        fake, error = _install('install_multiple', apks)
+    assert isinstance(error, RuntimeError)
+    assert 'INSTALL_PARSE_FAILED_NOT_APK' in str(error)
+    assert not fake.installed and not fake.install_sessions
@@ -0,0 +1,55 @@
+import struct
+
+import aadb
+from aadb.logcat import LogcatParser, LogRecord, Priority, build_command
+from fake_adb import FakeAdbServer, run
+
+
+def entry(pid, tid, priority, tag, message, hdr_size=28, sec=1700000000, nsec=5, lid=0, uid=10123):
+    payload = bytes([priority]) + tag.encode('utf-8') + b'\0' + message.encode('utf-8') + b'\0'
+    header = struct.pack('<HHiIII', len(payload), 0 if hdr_size == 20 else hdr_size, pid, tid, sec, nsec)
+    if hdr_size >= 24:
+        header += struct.pack('<I', lid)
+    if hdr_size >= 28:
+        header += struct.pack('<I', uid)
+    return header + payload
+
+
+def test_parser_handles_split_records_and_header_versions():
+    data = (entry(100, 101, Priority.INFO, 'ActivityManager', 'Start proc') +
+            entry(200, 202, Priority.ERROR, 'AndroidRuntime', 'FATAL EXCEPTION: main') +
+            entry(300, 303, Priority.DEBUG, 'v1', 'old header', hdr_size=20))
+    parser = LogcatParser()
+    records = []
+    for i in range(0, len(data), 7):
+        records.extend(parser.feed(data[i:i + 7]))
+    assert records == [
+        LogRecord(100, 101, 1700000000, 5, 0, 10123, Priority.INFO, 'ActivityManager', 'Start proc'),
+        LogRecord(200, 202, 1700000000, 5, 0, 10123, Priority.ERROR, 'AndroidRuntime', 'FATAL EXCEPTION: main'),
+        LogRecord(300, 303, 1700000000, 5, 0, -1, Priority.DEBUG, 'v1', 'old header'),
+    ]
+
+
+def test_filters_are_pushed_down_to_logcat():
+    assert build_command() == 'logcat -B'
+    assert build_command(priority=Priority.WARN, pid=42, buffers=['main', 'crash'], dump=True) == \
+        "logcat -B -d -b main -b crash --pid=42 '*:W'"
+    assert build_command(tags={'ActivityManager': 'I', 'Zygote': Priority.ERROR}) == \
+        "logcat -B ActivityManager:I Zygote:E '*:S'"
+    assert build_command(tags=['Foo'], priority='d') == "logcat -B Foo:D '*:S'"
+
+
+def test_logcat_records_over_exec():
+    stream = b''.join(entry(1000 + i, 2000 + i, Priority.INFO, 'Tag', 'message {}'.format(i)) for i in range(5000))
+
+    async def main():
+        async with FakeAdbServer(serials=['binary']) as server:
+            server.devices['binary'].outputs["logcat -B -d '*:I'"] = stream
+            device = (await aadb.create_bridge(port=server.port).devices())[0]
+            batches = []
+            await device.logcat_records(batches.append, priority=Priority.INFO, dump=True, batch=True)
+            return batches
+
+    records = [record for batch in run(main()) for record in batch]
+    assert len(records) == 5000
+    assert records[4999].pid == 5999 and records[4999].message == 'message 4999'
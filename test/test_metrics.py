@@ -0,0 +1,117 @@
+import asyncio
+import os
+import tempfile
+import time
+
+import pytest
+
+import aadb
+from aadb import metrics
+from fake_adb import FakeAdbServer, run
+
+
+@pytest.fixture
+def records():
+    collected = []
+    metrics.add_hook(collected.append)
+    yield collected
+    metrics.remove_hook(collected.append)
+    metrics.watch_pipelines(None)
+
+
+def test_requests_are_recorded(records):
+    registry = metrics.MetricsRegistry()
+    metrics.add_hook(registry.observe)
+
+    async def main():
+        async with FakeAdbServer(logcat_lines=500) as server:
+            adb = aadb.create_bridge(port=server.port)
+            device = (await adb.devices())[0]
+            await device.logcat(lambda line: None)
+            with tempfile.TemporaryDirectory() as workdir:
+                src = os.path.join(workdir, 'blob')
+                with open(src, 'wb') as f:
+                    f.write(os.urandom(100000))
+                await device.push(src, '/sdcard/blob')
+            try:
+                await device.shell('echo hi', pipeline=lambda line: None)
+                server.devices.clear()
+                await device.shell('echo gone')
+            except ConnectionError:
+                pass
+
+    try:
+        run(main())
+    finally:
+        metrics.remove_hook(registry.observe)
+
+    by_service = {record.service: record for record in records}
+    assert by_service['host:devices'].outcome == 'ok'
+    logcat = by_service['shell:logcat']
+    assert logcat.lines == 500 and logcat.serial == 'emulator-5554'
+    assert logcat.bytes_in > 500 * 40
+    assert 0 < logcat.connect_time <= logcat.first_byte_time <= logcat.duration
+    assert by_service['sync:'].bytes_out > 100000
+    failed = records[-1]
+    assert failed.service == 'host:transport:emulator-5554'
+    assert failed.outcome == 'error' and 'device not found' in failed.error
+
+    exported = registry.export()
+    assert '# TYPE aadb_request_seconds histogram' in exported
+    assert 'aadb_request_seconds_bucket{service="shell",le="+Inf"} 2' in exported
+    assert 'aadb_lines_total{service="shell"} 501' in exported
+    assert 'aadb_requests_total{service="host",outcome="ok"} 1' in exported
+    assert 'aadb_requests_total{service="host",outcome="error"} 1' in exported
+
+
+def test_slow_pipelines_are_flagged(records):
+    flagged = []
+    metrics.watch_pipelines(0.05, lambda record, pipeline, elapsed: flagged.append((record.service, elapsed)))
+
+    def slow(line):
+        if line.endswith('number 3'):
+            time.sleep(0.1)
+
+    async def main():
+        async with FakeAdbServer(logcat_lines=10) as server:
+            adb = aadb.create_bridge(port=server.port)
+            await (await adb.devices())[0].logcat(slow)
+
+    run(main())
+    assert len(flagged) == 1
+    assert flagged[0][0] == 'shell:logcat' and flagged[0][1] >= 0.1
+
+
+def test_disabled_instrumentation_allocates_nothing():
+    seen = []
+
+    async def main():
+        async with FakeAdbServer() as server:
+            adb = aadb.create_bridge(port=server.port)
+            device = (await adb.devices())[0]
+
+            @device.tp.shell(command='echo hi')
+            async def check(pipeline_func):
+                pass
+
+            await check(pipeline_func=seen.append)
+
+    assert not metrics.enabled()
+    run(main())
+    assert seen == ['hi']
+
+
+def test_close_failures_are_recorded(records, monkeypatch):
+    async def reset(writer):
+        raise ConnectionResetError('reset on close')
+
+    async def main():
+        async with FakeAdbServer() as server:
+            adb = aadb.create_bridge(port=server.port)
+            device = (await adb.devices())[0]
+            monkeypatch.setattr(asyncio.StreamWriter, 'wait_closed', reset)
+            await device.shell('echo hi')
+
+    run(main())
+    assert records[-1].service == 'shell:echo hi'
+    assert records[-1].outcome == 'close-error' and 'reset on close' in records[-1].error
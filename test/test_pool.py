@@ -0,0 +1,66 @@
+import asyncio
+
+import aadb
+from fake_adb import FakeAdbServer, run
+
+
+def test_pool_serves_prebound_connections():
+    async def main():
+        async with FakeAdbServer(serials=['pooled']) as server:
+            adb = aadb.create_bridge(port=server.port, pool_size=2)
+            device = (await adb.devices())[0]
+            await adb.pool.warm('pooled')
+            lines = []
+            for i in range(20):
+                await device.shell('echo {}'.format(i), pipeline=lines.append)
+                await asyncio.sleep(0)
+            stats = adb.pool.stats()
+            await adb.close()
+            return server, lines, stats
+
+    server, lines, stats = run(main())
+    assert lines == [str(i) for i in range(20)]
+    assert stats['hits'] >= 15
+    assert stats['hits'] + stats['misses'] == 21
+    # the transport handshake happens once per connection and never on the request path twice
+    assert server.requests.count('host:transport:pooled') <= server.connections
+
+
+def test_pool_evicts_idle_and_dead_connections():
+    async def main():
+        async with FakeAdbServer(serials=['pooled']) as server:
+            pool = aadb.ConnectionPool('127.0.0.1', server.port, size=2, idle_timeout=0.05)
+            await pool.warm('pooled')
+            await asyncio.sleep(0.1)
+            client = await pool.acquire('pooled')
+            assert (pool.hits, pool.misses, pool.evictions) == (0, 1, 2)
+            client.transport.close()
+
+            await pool.warm('pooled')
+            for _, idle in pool._idle['pooled']:
+                idle.transport.close()
+            await pool.acquire('pooled')
+            assert (pool.hits, pool.misses, pool.evictions) == (0, 2, 4)
+            await pool.close()
+            assert len(pool) == 0
+
+    run(main())
+
+
+def test_failed_refills_are_counted():
+    async def main():
+        async with FakeAdbServer(serials=['pooled']) as server:
+            pool = aadb.ConnectionPool('127.0.0.1', server.port, size=2)
+            client = await pool.acquire('missing')
+            client.transport.close()
+            for _ in range(100):
+                if pool.refill_errors:
+                    break
+                await asyncio.sleep(0.01)
+            stats, error = pool.stats(), pool.error
+            await pool.close()
+            return stats, error
+
+    stats, error = run(main())
+    assert stats['refill_errors'] == 1 and stats['idle'] == 0
+    assert isinstance(error, ConnectionError)
@@ -0,0 +1,113 @@
+import asyncio
+import os
+
+import pytest
+
+import aadb
+from fake_adb import FakeAdbServer, run
+
+
+async def echo(reader, writer):
+    while True:
+        data = await reader.read(65536)
+        if not data:
+            break
+        writer.write(data)
+        await writer.drain()
+
+
+def test_forward_and_reverse_requests():
+    async def main():
+        async with FakeAdbServer(serials=['127.0.0.1:5555']) as server:
+            adb = aadb.create_bridge(port=server.port)
+            device = (await adb.devices())[0]
+            fixed = await device.forward('tcp:6000', 'localabstract:chrome_devtools_remote')
+            picked = await adb.forward(device.serial, 'tcp:0', 'tcp:8080')
+            forwards = await adb.list_forward()
+            with pytest.raises(ConnectionError):
+                await device.forward('tcp:6000', 'tcp:9', norebind=True)
+            await device.remove_forward('tcp:6000')
+            remaining = await adb.list_forward()
+
+            reversed_port = await device.reverse('tcp:0', 'tcp:5000')
+            await device.reverse('localabstract:agent', 'tcp:5001')
+            reverses = await device.list_reverse()
+            await device.remove_reverse('localabstract:agent')
+            after_remove = await device.list_reverse()
+            await device.remove_reverse_all()
+            cleared = await device.list_reverse()
+            return fixed, picked, forwards, remaining, reversed_port, reverses, after_remove, cleared
+
+    fixed, picked, forwards, remaining, reversed_port, reverses, after_remove, cleared = run(main())
+    assert fixed is None and isinstance(picked, int)
+    assert forwards == {'127.0.0.1:5555': {'tcp:6000': 'localabstract:chrome_devtools_remote',
+                                           'tcp:{}'.format(picked): 'tcp:8080'}}
+    assert remaining == {'127.0.0.1:5555': {'tcp:{}'.format(picked): 'tcp:8080'}}
+    assert reverses == {'tcp:{}'.format(reversed_port): 'tcp:5000', 'localabstract:agent': 'tcp:5001'}
+    assert after_remove == {'tcp:{}'.format(reversed_port): 'tcp:5000'}
+    assert cleared == {}
+
+
+def test_relay_splices_connections():
+    async def main():
+        async with FakeAdbServer() as server:
+            server.devices['emulator-5554'].services['tcp:7000'] = echo
+            adb = aadb.create_bridge(port=server.port)
+            device = (await adb.devices())[0]
+            payloads = [os.urandom(1 << 20) for _ in range(4)]
+
+            async def roundtrip(payload):
+                reader, writer = await asyncio.open_connection('127.0.0.1', relay.port)
+                writer.write(payload)
+                writer.write_eof()
+                received = await reader.read()
+                writer.close()
+                return received
+
+            async with await device.relay('tcp:7000', buffer_size=65536) as relay:
+                received = await asyncio.gather(*[roundtrip(payload) for payload in payloads])
+                while relay.active:
+                    await asyncio.sleep(0.01)
+                stats = relay.stats()
+            return payloads, received, stats
+
+    payloads, received, stats = run(main())
+    assert received == payloads
+    assert stats.connections == 4 and stats.active == 0 and stats.failed == 0
+    assert stats.bytes_up == stats.bytes_down == 4 << 20
+    assert stats.up_rate > 0 and stats.down_rate > 0
+
+
+def test_relay_backpressure_and_refused_stream():
+    async def main():
+        async with FakeAdbServer() as server:
+            stalled = asyncio.Event()
+
+            async def stuck(reader, writer):
+                await stalled.wait()
+
+            server.devices['emulator-5554'].services['tcp:7001'] = stuck
+            adb = aadb.create_bridge(port=server.port)
+            device = (await adb.devices())[0]
+            async with await device.relay('tcp:7001', buffer_size=65536) as relay:
+                reader, writer = await asyncio.open_connection('127.0.0.1', relay.port)
+                total = 64 << 20
+                writer.write(bytes(total))
+                await asyncio.sleep(0.5)
+                relayed = relay.bytes_up
+                backlog = writer.transport.get_write_buffer_size()
+                stalled.set()
+                writer.close()
+
+            async with await device.relay('tcp:7002') as refused:
+                reader, writer = await asyncio.open_connection('127.0.0.1', refused.port)
+                closed = await asyncio.wait_for(reader.read(), 5)
+                writer.close()
+                while refused.active:
+                    await asyncio.sleep(0.01)
+            return total, relayed, backlog, closed, refused.stats()
+
+    total, relayed, backlog, closed, stats = run(main())
+    assert relayed < total // 2 and backlog > 0
+    assert closed == b''
+    assert stats.failed == 1 and stats.bytes_up == 0
@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+
+import aadb
+from fake_adb import FakeAdbServer, run
+
+np = pytest.importorskip('numpy')
+
+from aadb.sampler import RingBuffer, export, parse_pid_stat, parse_proc_stat  # noqa: E402
+
+MEMINFO = 'MemTotal:        3000000 kB\nMemFree:          500000 kB\nMemAvailable:    1500000 kB\n' \
+          'Cached:           800000 kB\n'
+BATTERY = 'Current Battery Service state:\n  level: 87\n  voltage: 4123\n  temperature: 301\n'
+
+
+def test_ring_buffer_wraps_and_windows():
+    ring = RingBuffer(4, ('a', 'b'))
+    for i in range(6):
+        ring.append(float(i), (i, 10 * i))
+    times, data = ring.ordered()
+    assert list(times) == [2, 3, 4, 5]
+    assert list(data[:, 1]) == [20, 30, 40, 50]
+    assert ring.mean(seconds=1) == {'a': 4.5, 'b': 45.0}
+    assert ring.p95()['a'] == pytest.approx(4.85)
+    assert parse_pid_stat('42 (my (odd) app) S 1 2 3 4 5 6 7 8 9 10 120 30 0 0 20 0 9 0 77 1000 250 0') == (150, 250)
+
+
+def test_sampler_over_session(tmp_path):
+    ticks = {'stat': 0, 'pid': 0, 'gfx': 0}
+
+    def proc_stat(command):
+        ticks['stat'] += 1
+        n = ticks['stat']
+        # every tick 100 jiffies per core, 25 busy on cpu0 and 75 on cpu1
+        return 'cpu  {} 0 0 {} 0 0 0 0 0 0\ncpu0 {} 0 0 {} 0 0 0\ncpu1 {} 0 0 {} 0 0 0\nintr 1 2 3\n'.format(
+            100 * n, 100 * n, 25 * n, 75 * n, 75 * n, 25 * n)
+
+    def pid_stat(command):
+        ticks['pid'] += 1
+        return '321 (com.example) S ' + ' '.join(['0'] * 10) + ' {} 0 '.format(50 * ticks['pid']) + \
+               ' '.join(['0'] * 8) + ' 1000 0\n'
+
+    def gfxinfo(command):
+        ticks['gfx'] += 1
+        return 'Total frames rendered: {}\nJanky frames: {} (5.00%)\n50th percentile: 8ms\n' \
+               '90th percentile: 14ms\n95th percentile: 20ms\n99th percentile: 40ms\n'.format(
+                   30 * ticks['gfx'], 3 * ticks['gfx'])
+
+    async def main():
+        async with FakeAdbServer() as server:
+            device = server.devices['emulator-5554']
+            device.outputs.update({'cat /proc/stat': proc_stat, 'cat /proc/meminfo': MEMINFO,
+                                   'dumpsys battery': BATTERY, 'pidof com.example': '321\n',
+                                   'cat /proc/321/stat': pid_stat, 'dumpsys gfxinfo com.example': gfxinfo})
+            device.exit_codes['pidof com.missing'] = 1
+            adb = aadb.create_bridge(port=server.port)
+            phone = (await adb.devices())[0]
+            sampler = phone.sampler(interval=0.01, capacity=8, packages=['com.example', 'com.missing'])
+            async with sampler:
+                while sampler.samples < 10:
+                    await asyncio.sleep(0.01)
+            spawned = server.requests.count('exec:sh')
+            export([sampler], str(tmp_path / 'samples.npz'))
+            await adb.close()
+            return sampler, spawned
+
+    sampler, spawned = run(main())
+    assert spawned == 1 and sampler.errors == 0
+    assert set(sampler.buffers) == {'cpu', 'memory', 'battery', 'process:com.example', 'gfx:com.example'}
+    assert len(sampler.buffers['cpu']) == 8
+    assert sampler.mean('cpu') == {'total': 0.5, 'cpu0': 0.25, 'cpu1': 0.75}
+    assert sampler.mean('memory')['MemAvailable'] == 1500000
+    assert sampler.p95('battery') == {'level': 87, 'temperature': 30.1, 'voltage': 4.123}
+    # 50 jiffies per tick against 100 of one core
+    assert sampler.mean('process:com.example', seconds=60)['cpu'] == pytest.approx(0.5)
+    assert sampler.mean('process:com.example')['rss_kb'] == 4000
+    gfx = sampler.mean('gfx:com.example')
+    assert gfx['janky'] == pytest.approx(0.1) and gfx['fps'] > 0 and gfx['p95'] == 20
+    with np.load(str(tmp_path / 'samples.npz')) as columns:
+        assert len(columns['emulator-5554/cpu/time']) == 8
+        assert list(columns['emulator-5554/cpu/cpu1']) == [0.75] * 8
+        assert parse_proc_stat('cpu  1 2 3 4 5 6 7\n').shape == (1, 7)
+
+
+def test_failed_tick_commands_do_not_stop_the_sampler():
+    async def main():
+        async with FakeAdbServer() as server:
+            device = server.devices['emulator-5554']
+            device.outputs.update({'cat /proc/stat': 'cpu  1 0 0 1 0 0 0\n', 'cat /proc/meminfo': MEMINFO,
+                                   'dumpsys battery': BATTERY})
+            device.exit_codes['cat /proc/meminfo'] = 1
+            adb = aadb.create_bridge(port=server.port)
+            phone = (await adb.devices())[0]
+            sampler = phone.sampler(interval=0.01, capacity=8)
+            read = sampler._read
+            broken = {'ticks': 2}
+
+            async def flaky(command):
+                if broken['ticks'] and command == 'dumpsys battery':
+                    broken['ticks'] -= 1
+                    raise TypeError('unexpected output')
+                return await read(command)
+
+            sampler._read = flaky
+            async with sampler:
+                while sampler.samples < 3:
+                    await asyncio.sleep(0.01)
+            await adb.close()
+            return sampler
+
+    sampler = run(main())
+    assert sampler.errors == 2 and isinstance(sampler.error, TypeError)
+    assert 'memory' not in sampler.buffers
+    assert set(sampler.buffers) == {'cpu', 'battery'}
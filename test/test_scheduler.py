@@ -0,0 +1,79 @@
+import os
+import tempfile
+
+import aadb
+from aadb.scheduler import Order, TransferJob, order_jobs
+from fake_adb import FakeAdbServer, run
+
+
+def _job(size):
+    return TransferJob('local-{}'.format(size), 'remote-{}'.format(size), size)
+
+
+def test_order_jobs():
+    jobs = [_job(size) for size in (10, 1 << 20, 20, 1 << 21, 300)]
+    assert [job.size for job in order_jobs(jobs, Order.LARGEST)] == [1 << 21, 1 << 20, 300, 20, 10]
+    assert [job.size for job in order_jobs(jobs, Order.BUCKETS)] == [1 << 21, 300, 20, 1 << 20, 10]
+    assert order_jobs(jobs, Order.NONE) == jobs
+
+
+def _make_tree(workdir):
+    src = os.path.join(workdir, 'bundle')
+    for index, rel_path in enumerate(('big.bin', 'a/one.txt', 'a/two.txt', 'b/c/three.txt', 'four.txt')):
+        path = os.path.join(src, *rel_path.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(os.urandom(300000 if index == 0 else 1000 * index))
+    return src
+
+
+def test_push_tree_spreads_files_over_sessions():
+    progress = []
+
+    async def main():
+        async with FakeAdbServer() as server:
+            adb = aadb.create_bridge(port=server.port)
+            device = (await adb.devices())[0]
+            fake = server.devices[device.serial]
+            fake.readonly = ('/sdcard/bundle/b/',)
+            with tempfile.TemporaryDirectory() as workdir:
+                src = _make_tree(workdir)
+                results = await device.push_tree(src, '/sdcard', sessions=3, progress_func=progress.append)
+                expected = {result.remote: open(result.local, 'rb').read() for result in results if result.success}
+            return server, fake, results, expected
+
+    server, fake, results, expected = run(main())
+    assert [result.success for result in results].count(False) == 1
+    assert [result.remote for result in results if not result.success] == ['/sdcard/bundle/b/c/three.txt']
+    for remote, data in expected.items():
+        assert fake.files[remote][2] == data
+    assert server.requests.count('sync:') >= 3
+    last = progress[-1]
+    assert last.done_files == last.total_files == 5
+    # the failed file was sent in full before adbd refused it
+    assert last.done_bytes == last.total_bytes == 310000
+
+
+def test_pull_tree_is_recursive():
+    async def main():
+        async with FakeAdbServer() as server:
+            adb = aadb.create_bridge(port=server.port)
+            device = (await adb.devices())[0]
+            fake = server.devices[device.serial]
+            fake.put_file('/data/local/tmp/out/log.txt', b'log' * 1000)
+            fake.put_file('/data/local/tmp/out/nested/deep/trace.bin', os.urandom(200000))
+            fake.put_file('/data/local/tmp/out/nested/x', b'')
+            with tempfile.TemporaryDirectory() as workdir:
+                results = await device.pull_tree('/data/local/tmp/out', workdir, sessions=2)
+                local = {}
+                for root, dirs, names in os.walk(workdir):
+                    for name in names:
+                        path = os.path.join(root, name)
+                        local[os.path.relpath(path, workdir).replace(os.sep, '/')] = open(path, 'rb').read()
+            return fake, results, local
+
+    fake, results, local = run(main())
+    assert all(result.success for result in results)
+    assert local == {'out/log.txt': fake.files['/data/local/tmp/out/log.txt'][2],
+                     'out/nested/deep/trace.bin': fake.files['/data/local/tmp/out/nested/deep/trace.bin'][2],
+                     'out/nested/x': b''}
@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+import aadb
+from fake_adb import FakeAdbServer, run
+
+
+def test_pipelined_commands_over_one_shell():
+    async def main():
+        async with FakeAdbServer() as server:
+            device = server.devices['emulator-5554']
+            device.outputs['printf partial'] = 'partial'
+            device.outputs['getprop'] = '[a]: [1]\n[b]: [2]\n'
+            device.exit_codes['false'] = 1
+            adb = aadb.create_bridge(port=server.port)
+            phone = (await adb.devices())[0]
+            session = phone.session()
+            results = await asyncio.gather(*[phone.run('echo {}'.format(i)) for i in range(200)],
+                                           phone.run('printf partial'), phone.run('getprop'), phone.run('false'))
+            with pytest.raises(RuntimeError):
+                await session.check('false')
+            spawned = server.requests.count('exec:sh')
+            await session.close()
+            return results, session, spawned
+
+    results, session, spawned = run(main())
+    assert [r.output for r in results[:200]] == ['{}\n'.format(i) for i in range(200)]
+    assert all(r.success for r in results[:200])
+    assert results[200].output == 'partial'
+    assert results[201].output == '[a]: [1]\n[b]: [2]\n'
+    assert (results[202].exit_code, results[202].success) == (1, False)
+    assert spawned == session.spawns == 1
+    assert session.commands == 204
+
+
+def test_respawn_after_exit_and_timeout():
+    async def main():
+        async with FakeAdbServer() as server:
+            adb = aadb.create_bridge(port=server.port)
+            phone = (await adb.devices())[0]
+            async with phone.session() as session:
+                first = await session.run('echo one')
+                with pytest.raises(ConnectionError):
+                    await session.run('exit')
+                second = await session.run('echo two')
+                with pytest.raises(asyncio.TimeoutError):
+                    await session.run('sleep 1', timeout=0.2)
+                third = await session.run('echo three')
+                spawns = session.spawns
+            with pytest.raises(ConnectionError):
+                await session.run('echo closed')
+            return first, second, third, spawns
+
+    first, second, third, spawns = run(main())
+    assert (first.output, second.output, third.output) == ('one\n', 'two\n', 'three\n')
+    assert spawns == 3
@@ -0,0 +1,87 @@
+import asyncio
+import threading
+
+import pytest
+
+import aadb
+
+from aadb import events
+from aadb.shard import Mode, ShardedRuntime
+from fake_adb import FakeAdbServer, run
+
+SERIALS = ['emulator-{}'.format(5554 + 2 * i) for i in range(5)]
+
+
+def test_event_loop_is_per_thread():
+    loops = {}
+
+    def worker(name):
+        loops[name] = events.get_event_loop()
+
+    threads = [threading.Thread(target=worker, args=(name,)) for name in 'ab']
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert loops['a'] is not loops['b']
+    for loop in loops.values():
+        loop.close()
+
+
+@pytest.mark.parametrize('mode', [Mode.THREAD, Mode.PROCESS])
+def test_calls_and_streams_are_routed_to_shards(mode):
+    async def main():
+        async with FakeAdbServer(serials=SERIALS, logcat_lines=2000) as server:
+            async with ShardedRuntime(SERIALS, shards=2, mode=mode, port=server.port) as runtime:
+                owners = dict(runtime.owners)
+                features = await runtime.call_all('features')
+                with pytest.raises(FileNotFoundError):
+                    await runtime.call(SERIALS[0], 'install', '/nonexistent.apk')
+                with pytest.raises(KeyError):
+                    await runtime.call('unknown', 'features')
+
+                streams = [runtime.stream(serial, 'logcat', batch=True) for serial in SERIALS]
+                lines, batches, shards = {}, 0, set()
+                stream = runtime.events()
+                while sum(lines.values()) < 2000 * len(SERIALS):
+                    event = await asyncio.wait_for(stream.__anext__(), 10)
+                    lines[event.serial] = lines.get(event.serial, 0) + len(event.items)
+                    batches += 1
+                    shards.add(event.shard)
+                await asyncio.gather(*streams)
+            return owners, features, lines, batches, shards
+
+    owners, features, lines, batches, shards = run(main())
+    assert sorted(owners.values()) == [0, 0, 0, 1, 1]
+    assert all('shell_v2' in result for result in features.values())
+    assert lines == {serial: 2000 for serial in SERIALS}
+    assert batches < 2000 * len(SERIALS) / 10
+    assert shards == {0, 1}
+
+
+def test_cancel_stream():
+    async def main():
+        async with FakeAdbServer(serials=SERIALS[:1], logcat_lines=10 ** 5, logcat_rate=2000) as server:
+            async with ShardedRuntime(SERIALS[:1], shards=1, mode=Mode.THREAD, port=server.port) as runtime:
+                stream = runtime.stream(SERIALS[0], 'logcat')
+                first = await asyncio.wait_for(runtime.events().__anext__(), 5)
+                stream.cancel()
+                return first, await asyncio.wait_for(stream, 5)
+
+    first, result = run(main())
+    assert first.items and result is None
+
+
+def test_thread_shards_leave_other_bridges_alone():
+    async def main():
+        async with FakeAdbServer(serials=['parent']) as parent, FakeAdbServer(serials=SERIALS[:2]) as other:
+            adb = aadb.create_bridge(port=parent.port)
+            async with ShardedRuntime(SERIALS[:2], shards=2, mode=Mode.THREAD, port=other.port) as runtime:
+                features = await runtime.call_all('features')
+                devices = [device.serial for device in await adb.devices()]
+            await adb.close()
+            return features, devices
+
+    features, devices = run(main())
+    assert set(features) == set(SERIALS[:2])
+    assert devices == ['parent']
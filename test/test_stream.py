@@ -0,0 +1,80 @@
+import asyncio
+
+import aadb
+from aadb.stream import Overflow
+from fake_adb import FakeAdbServer, logcat_line, run
+
+LINES = [logcat_line(i).decode('utf-8').rstrip('\n') for i in range(5000)]
+
+
+def _consume(overflow, maxsize, slow=False):
+    async def main():
+        async with FakeAdbServer(serials=['stream'], logcat_lines=len(LINES)) as server:
+            device = (await aadb.create_bridge(port=server.port).devices())[0]
+            received = []
+            async with device.logcat_stream(maxsize=maxsize, overflow=overflow) as stream:
+                if slow:
+                    while not stream._finished:
+                        await asyncio.sleep(0.01)
+                async for line in stream:
+                    received.append(line)
+                    if len(received) % 500 == 0:
+                        await asyncio.sleep(0.001)
+            return received, stream
+
+    return run(main())
+
+
+def test_block_policy_delivers_everything_in_order():
+    received, stream = _consume(Overflow.BLOCK, maxsize=64)
+    assert received == LINES
+    assert stream.dropped == 0
+
+
+def test_drop_policies_count_what_they_discard():
+    received, stream = _consume(Overflow.DROP_NEWEST, maxsize=100, slow=True)
+    assert received == LINES[:100]
+    assert stream.dropped == len(LINES) - 100
+
+    received, stream = _consume(Overflow.DROP_OLDEST, maxsize=100, slow=True)
+    assert received == LINES[-100:]
+    assert stream.dropped == len(LINES) - 100
+
+
+def _leave_early(consume):
+    async def main():
+        async with FakeAdbServer(serials=['stream'], logcat_lines=200000) as server:
+            device = (await aadb.create_bridge(port=server.port).devices())[0]
+            stream = device.logcat_stream(maxsize=16)
+            await consume(stream)
+            for _ in range(100):
+                if not server.active:
+                    break
+                await asyncio.sleep(0.01)
+            return server.active, stream._task.done()
+
+    return run(main())
+
+
+def test_breaking_out_closes_the_socket():
+    async def consume(stream):
+        async for _ in stream:
+            if stream.received > 100:
+                break
+
+    assert _leave_early(consume) == (0, True)
+
+
+def test_cancelling_the_consumer_closes_the_socket():
+    async def consume(stream):
+        async def reader():
+            async for _ in stream:
+                await asyncio.sleep(0)
+
+        task = asyncio.ensure_future(reader())
+        while stream.received <= 100:
+            await asyncio.sleep(0.001)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    assert _leave_early(consume) == (0, True)
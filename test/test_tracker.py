@@ -0,0 +1,92 @@
+import asyncio
+
+import aadb
+from aadb.adb import AndroidDebugBridge
+from aadb.tracker import DeviceTracker, parse_devices
+from fake_adb import FakeAdbServer, run
+
+
+def test_parse_devices_long_and_short():
+    table = parse_devices('emulator-5554          device product:sdk_phone model:Pixel_7 device:generic '
+                          'transport_id:3\n'
+                          '0123456789ABCDEF       no permissions (user in plugdev group) usb:1-1\n'
+                          'R58M12345\tunauthorized\n')
+    assert table['emulator-5554'].state == 'device'
+    assert table['emulator-5554'].attributes == {'product': 'sdk_phone', 'model': 'Pixel_7', 'device': 'generic',
+                                                 'transport_id': '3'}
+    assert table['0123456789ABCDEF'].state == 'no permissions (user in plugdev group)'
+    assert table['R58M12345'] == ('R58M12345', 'unauthorized', {})
+
+
+def test_devices_state_filter():
+    async def main():
+        async with FakeAdbServer(serials=['online', 'gone']) as server:
+            server.devices['gone'].state = 'offline'
+            adb = aadb.create_bridge(port=server.port)
+            online = await adb.devices(AndroidDebugBridge.DeviceStatus.DEVICE)
+            offline = await adb.devices('offline')
+            return [d.serial for d in online], [d.serial for d in offline]
+
+    assert run(main()) == (['online'], ['gone'])
+
+
+def test_tracker_events_and_zero_io_devices():
+    async def main():
+        async with FakeAdbServer(serials=['a']) as server:
+            adb = aadb.create_bridge(port=server.port)
+            tracker = await adb.track(timeout=5)
+            seen = []
+            tracker.add_listener(seen.append)
+            stream = tracker.events()
+            requests = len(server.requests)
+
+            server.add_device('b', state='offline')
+            first = await asyncio.wait_for(stream.__anext__(), 5)
+            server.set_state('b', 'device')
+            second = await asyncio.wait_for(stream.__anext__(), 5)
+            server.remove_device('a')
+            third = await asyncio.wait_for(stream.__anext__(), 5)
+
+            serials = [d.serial for d in await adb.devices()]
+            online = [d.serial for d in await adb.devices(AndroidDebugBridge.DeviceStatus.DEVICE)]
+            no_io = len(server.requests) == requests
+            model = tracker.table['b'].attributes['model']
+            await stream.aclose()
+            await adb.close()
+            return first, second, third, seen, serials, online, no_io, model
+
+    first, second, third, seen, serials, online, no_io, model = run(main())
+    assert (first.kind, first.serial, first.state) == (DeviceTracker.CONNECTED, 'b', 'offline')
+    assert (second.kind, second.state, second.previous) == (DeviceTracker.STATE, 'device', 'offline')
+    assert (third.kind, third.serial, third.previous) == (DeviceTracker.DISCONNECTED, 'a', 'device')
+    assert seen == [first, second, third]
+    assert serials == online == ['b']
+    assert no_io
+    assert model.startswith('Fake_')
+
+
+def test_failing_listener_does_not_freeze_the_table():
+    async def main():
+        async with FakeAdbServer(serials=['a']) as server:
+            adb = aadb.create_bridge(port=server.port)
+            tracker = await adb.track(timeout=5)
+
+            def broken(event):
+                raise KeyError(event.serial)
+
+            tracker.add_listener(broken)
+            stream = tracker.events()
+            server.add_device('b')
+            await asyncio.wait_for(stream.__anext__(), 5)
+            server.add_device('c')
+            await asyncio.wait_for(stream.__anext__(), 5)
+            serials = sorted(d.serial for d in await adb.devices())
+            errors, error = tracker.listener_errors, tracker.error
+            await stream.aclose()
+            await adb.close()
+            return serials, errors, error, tracker.ready.is_set()
+
+    serials, errors, error, ready = run(main())
+    assert serials == ['a', 'b', 'c']
+    assert errors == 2 and isinstance(error, KeyError)
+    assert not ready
@@ -0,0 +1,37 @@
+from aadb.transport import Client
+from fake_adb import run
+
+
+class ChunkReader(object):
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    async def read(self, n):
+        return self.chunks.pop(0) if self.chunks else b''
+
+
+def _receive(chunks, batch=False):
+    client = Client()
+    client.reader = ChunkReader(chunks)
+    received = []
+    run(client.receive_lines(received.append, batch=batch))
+    return received
+
+
+def test_receive_lines_carries_partial_lines_once():
+    assert _receive([b'first li', b'ne\nsecond', b' line\nthird']) == ['first line', 'second line', 'third']
+
+
+def test_receive_lines_handles_crlf_split_across_reads():
+    assert _receive([b'one\r', b'\ntwo\r\n\r\nthree\r']) == ['one', 'two', 'three']
+
+
+def test_receive_lines_keeps_split_multibyte_characters():
+    data = 'café 中文\n'.encode('utf-8')
+    assert _receive([data[:4], data[4:8], data[8:]]) == ['café 中文']
+    assert _receive([b'bad \xff byte\n']) == ['bad � byte']
+
+
+def test_receive_lines_batch_mode():
+    assert _receive([b'a\nb\n', b'c', b'\nd\n'], batch=True) == [['a', 'b'], ['c', 'd']]